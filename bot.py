@@ -32,17 +32,23 @@ async def on_ready():
     log.info(f'Logged in as {bot.user.name} (ID: {bot.user.id})')
     log.info('Bot is ready and listening for DMs.')
     
-    # if there is a temp_chroma_db folder, move it to chroma_db
+    # if there is a temp_<store>_db folder (e.g. temp_chroma_db), move it to <store>_db
     data_path = os.path.join(os.getcwd(), os.getenv("VECTOR_DB_PATH"))
-    if os.path.exists(os.path.join(data_path, 'temp_chroma_db')):
-        mark_file = os.path.join(data_path, 'temp_chroma_db', '.valid')
+    temp_dirs = [name for name in os.listdir(data_path) if name.startswith('temp_') and name.endswith('_db')] if os.path.isdir(data_path) else []
+    for temp_dir in temp_dirs:
+        temp_path = os.path.join(data_path, temp_dir)
+        store_path = os.path.join(data_path, temp_dir[len('temp_'):])
+        mark_file = os.path.join(temp_path, '.valid')
         if os.path.isfile(mark_file):
             os.remove(mark_file)
-            shutil.rmtree(os.path.join(data_path, 'chroma_db'))
-            os.rename(os.path.join(data_path, 'temp_chroma_db'), os.path.join(data_path, 'chroma_db'))
+            if os.path.exists(store_path):
+                shutil.rmtree(store_path)
+            os.rename(temp_path, store_path)
+        elif os.path.isfile(os.path.join(temp_path, '.checkpoint.json')):
+            log.info("Found an interrupted embedding conversion, it will resume when the conversion is run again with the same model.")
         else:
-            log.warning("Found an incomplete temp chroma database, execution will proceed to clear it.")
-            shutil.rmtree(os.path.join(data_path, 'temp_chroma_db'))
+            log.warning(f"Found an incomplete {temp_dir} database, execution will proceed to clear it.")
+            shutil.rmtree(temp_path)
     
     await load_cogs()
     
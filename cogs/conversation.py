@@ -1,18 +1,22 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord import app_commands
 from src import setup_logger
 import os
+import shutil
 import asyncio
-from datetime import datetime
+from datetime import datetime, timedelta
 from semantic_text_splitter import MarkdownSplitter
 from core import Cog_Extension
 from src import AppConfig
 from src.llm import LLMServiceInterface
 from src.memory_service import MemoryService
-from src.utils.core_utils import get_localized_choices, get_localized_name_from_value
+from src.session import SessionManager
+from src.utils.core_utils import get_localized_choices, get_localized_name_from_value, run_stage, StreamingMessageDelivery
+from src.utils.integrations import get_weather_reporter
 from src.llm.factory import get_llm_service
 from src.embedding.factory import get_embedding_service
+from src.embedding.migration import EmbeddingMigration, load_checkpoint
 from src.vector_store.factory import get_vector_store
 
 log = setup_logger(__name__)
@@ -36,6 +40,25 @@ class ConversationCog(Cog_Extension):
         self.llm_service = llm_service
         self.memory_service = memory_service
         self.system_prompt = config.system_prompt           # load AI personality settings
+        self.lang = config.model_lang
+        
+        # load pipeline settings
+        self.enable_weather_period_prompt = config.enable_weather_period_prompt
+        self.weather_location = config.weather_period["location"]
+        self.weather_timezone = config.weather_period["timezone"]
+        self.weather_reporter = get_weather_reporter(
+            ttl_seconds=config.weather_period["cache_ttl_seconds"],
+            failure_retry_seconds=config.weather_period["failure_retry_seconds"]
+        )
+        self.stage_timeout = config.pipeline_stage_timeout
+        self.vector_store_name = config.default_vector_store
+        self.vector_store_config = config.vector_store
+        self.migration_config = config.embedding_migration
+        self.provider_policy_config = config.provider_policy
+        self.embedding_dimensionality = config.embedding_dimensionality
+        self.local_embedding_config = config.local_embedding
+        self.enable_streaming_response = config.enable_streaming_response
+        self.streaming_edit_interval = config.streaming_edit_interval
         
         # load exception message settings
         self.no_response_exception = config.no_response_exception
@@ -46,12 +69,25 @@ class ConversationCog(Cog_Extension):
         self.model_role = config.model_role
         
         # dynamic settings
-        # TODO: In the future, these values ​​should be made into dictionaries to support multi-user scenarios
-        self.temperature = config.model_default_temperature
-        self.use_search = False
-        self.is_converting = False  # Flag to indicate conversion in progress
+        # per-user settings live in the user's session, idle sessions are reaped periodically
+        self.sessions = SessionManager(config.model_default_temperature, idle_timeout_seconds=config.session_idle_timeout_seconds)
+        self.reap_idle_sessions.change_interval(seconds=config.session_reap_interval_seconds)
+        self.is_converting = False  # Flag to indicate conversion in progress (global, the vector store is shared by all users)
         
 
+    async def cog_load(self):
+        self.reap_idle_sessions.start()
+        self.lexical_backfill = asyncio.create_task(self._backfill_lexical_index())
+
+    async def cog_unload(self):
+        self.reap_idle_sessions.cancel()
+        self.lexical_backfill.cancel()
+        await self.weather_reporter.close()
+        await self.memory_service.close()
+        self.memory_service.vector_store.close()
+        self.memory_service.embedding_service.close()
+        await self.llm_service.close()
+
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
         if message.guild is not None:
@@ -74,56 +110,99 @@ class ConversationCog(Cog_Extension):
 
         log.info(f"Received DM from user {user_id}: {user_input[:50]}...")
 
-        async with message.channel.typing(): # show "typing..."
-            try:
-                # --- memory processing ---
-                # 1. retrieve relevant memories (RAG)
-                relevant_memories = await self.memory_service.retrieve_relevant_memories(user_id, user_input)
-                if relevant_memories is not None: log.info(f"Retrieved relevant memories for user {user_id}: {relevant_memories[:100]}...")
-
-                # 2. get short-term history
-                short_term_history = self.memory_service.get_history(user_id)
-                log.info(f"Retrieved short-term history for user {user_id}. Length: {len(short_term_history)}")
-                
-
-                # --- LLM API calling ---
-                bot_response = await self.llm_service.generate_response(
-                    system_prompt=self.system_prompt,
-                    history=short_term_history,
-                    user_input=user_input,
-                    rag_context=relevant_memories,
-                    temperature=self.temperature,
-                    use_search=self.use_search
-                )
-
-                # --- response and memory update ---
-                if bot_response:
-                    # send response
-                    if len(bot_response) > CHUNK_SIZE:
-                        chunks = splitter.chunks(bot_response)
-                        for chunk in chunks:
-                            await message.author.send(chunk)
-                    else:
-                        await message.author.send(bot_response)
-                    
-                    bot_response_timestamp = datetime.now().isoformat()
-                    log.info(f"Sent response to user {user_id}: {bot_response[:50]}...")
-
-                    # update short-term memory (user input + bot response)
-                    await self.memory_service.add_message(user_id, self.user_role, user_input, user_input_timestamp)
-                    await self.memory_service.add_message(user_id, self.model_role, bot_response, bot_response_timestamp)
-
-                else:
-                    # if LLM API returns no valid response
-                    await message.author.send(self.no_response_exception)
-                    log.warning(f"LLMService returned None or empty response for user {user_id}.")
-
-            except Exception as e:
-                log.error(f"Error processing message from user {user_id}: {e}", exc_info=True)
+        # messages of the same user are processed one at a time and in order, different users run in parallel
+        session = self.sessions.get(user_id)
+        async with session.lock:
+            async with message.channel.typing(): # show "typing..."
                 try:
-                    await message.author.send(self.unknown_exception)
-                except discord.errors.Forbidden:
-                     log.error(f"Cannot send error message to user {user_id} (DM closed or blocked).")
+                    # --- context preparation ---
+                    # independent stages run concurrently and are joined right before generation,
+                    # a stage that times out or fails degrades to "no context" instead of blocking the reply
+                    relevant_memories, short_term_history, summary_context, weather_period_info = await asyncio.gather(
+                        # 1. retrieve relevant memories (RAG)
+                        run_stage("rag", self.memory_service.retrieve_relevant_memories(user_id, user_input), self.stage_timeout.get("rag")),
+                        # 2. get short-term history and the summary of the conversation before it
+                        run_stage("history", self._fetch_history(user_id), self.stage_timeout.get("history"), default=[]),
+                        run_stage("summary", self.memory_service.get_summary_context(user_id), self.stage_timeout.get("history")),
+                        # 3. get weather and period context
+                        run_stage("weather_period", self._fetch_weather_period_info(), self.stage_timeout.get("weather_period"))
+                    )
+                    if relevant_memories is not None: log.info(f"Retrieved {len(relevant_memories)} relevant memories for user {user_id}: {str(relevant_memories)[:100]}...")
+                    if summary_context:
+                        # the summary of the earlier conversation leads the long-term memories, it is the last one dropped for budget
+                        relevant_memories = [summary_context, *(relevant_memories or [])]
+                    log.info(f"Retrieved short-term history for user {user_id}. Length: {len(short_term_history)}")
+
+                    # --- LLM API calling and response delivery ---
+                    generation_kwargs = dict(
+                        system_prompt=self.system_prompt,
+                        history=short_term_history,
+                        user_input=user_input,
+                        rag_context=relevant_memories,
+                        temperature=session.temperature,
+                        use_search=session.use_search,
+                        weather_period_info=weather_period_info
+                    )
+                    if self.enable_streaming_response:
+                        # stream the response, the first chunk is sent before the generation ends
+                        delivery = StreamingMessageDelivery(message.author, chunk_size=CHUNK_SIZE, edit_interval=self.streaming_edit_interval)
+                        async for fragment in self.llm_service.generate_response_stream(**generation_kwargs):
+                            await delivery.feed(fragment)
+                        bot_response = await delivery.finish()
+                    else:
+                        bot_response = await self.llm_service.generate_response(**generation_kwargs)
+                        if bot_response:
+                            # send response
+                            if len(bot_response) > CHUNK_SIZE:
+                                chunks = splitter.chunks(bot_response)
+                                for chunk in chunks:
+                                    await message.author.send(chunk)
+                            else:
+                                await message.author.send(bot_response)
+
+                    # --- memory update ---
+                    if bot_response:
+                        bot_response_timestamp = datetime.now().isoformat()
+                        log.info(f"Sent response to user {user_id}: {bot_response[:50]}...")
+
+                        # update short-term memory (user input + bot response)
+                        await self.memory_service.add_message(user_id, self.user_role, user_input, user_input_timestamp)
+                        await self.memory_service.add_message(user_id, self.model_role, bot_response, bot_response_timestamp)
+
+                    else:
+                        # if LLM API returns no valid response
+                        await message.author.send(self.no_response_exception)
+                        log.warning(f"LLMService returned None or empty response for user {user_id}.")
+
+                except Exception as e:
+                    log.error(f"Error processing message from user {user_id}: {e}", exc_info=True)
+                    try:
+                        await message.author.send(self.unknown_exception)
+                    except discord.errors.Forbidden:
+                         log.error(f"Cannot send error message to user {user_id} (DM closed or blocked).")
+
+    @tasks.loop(minutes=10)
+    async def reap_idle_sessions(self):
+        self.sessions.reap_idle()
+        evicted = self.memory_service.evict_idle()
+        log.debug(f"Evicted {evicted} idle user states. Memory stats: {self.memory_service.stats()}")
+
+    async def _backfill_lexical_index(self):
+        """index the memories stored before hybrid retrieval was enabled, in the background"""
+        try:
+            await self.memory_service.backfill_lexical_index()
+        except Exception as e:
+            log.error(f"Failed to backfill the lexical memory index: {e}", exc_info=True)
+
+    async def _fetch_history(self, user_id: str) -> list[dict]:
+        """pipeline stage: get the short-term history of the user"""
+        return await self.memory_service.get_history(user_id)
+
+    async def _fetch_weather_period_info(self) -> tuple[str, str, str] | None:
+        """pipeline stage: get the (date, period, weather) context, or None if disabled"""
+        if not self.enable_weather_period_prompt:
+            return None
+        return await self.weather_reporter.report(self.weather_timezone, lang=self.lang, location=self.weather_location)
 
     toggle_group = app_commands.Group(name='toggle', description='Toggle something')
 
@@ -136,7 +215,7 @@ class ConversationCog(Cog_Extension):
         state: int
             Whether to enable or disable search functionality.
         """
-        self.use_search = bool(state)
+        self.sessions.get(str(itn.user.id)).use_search = bool(state)
         
         choice_name = get_localized_name_from_value(itn, state, BINARY_STATES, 'binary_state', BINARY_STATES_CALCULATOR)
         await itn.response.send_message(f"Search functionality {choice_name}.", ephemeral=True)
@@ -167,7 +246,7 @@ class ConversationCog(Cog_Extension):
         temperature: float
             The temperature level of LLM's response.
         """
-        self.temperature = temperature
+        self.sessions.get(str(itn.user.id)).temperature = temperature
         
         choice_name = get_localized_name_from_value(itn, temperature, TEMPERATURE_LEVELS, 'temperature_level', TEMPERATURE_LEVELS_CALCULATOR)
         await itn.response.send_message(f"Temperature level set to {choice_name}.", ephemeral=True)
@@ -187,15 +266,23 @@ class ConversationCog(Cog_Extension):
     @embedding_subgroup.command(name="model")
     @app_commands.choices(new_service=[
         app_commands.Choice(name='✨Gemini', value='gemini'),
-        # app_commands.Choice(name='🤗Hugging Face', value='huggingface') # TODO: Add Hugging Face support
+        app_commands.Choice(name='💻Local', value='local')
     ])
-    async def convert_embedding_model(self, itn: discord.Interaction, new_service: str, new_model_name: str, batch_size: int = 60, delay_seconds: int = 60):
+    async def convert_embedding_model(self, itn: discord.Interaction, new_service: str, new_model_name: str, batch_size: int = 100, requests_per_minute: int = None, concurrency: int = None, dimensionality: int = None):
         """Convert the embedding model to a new one.
 
         Parameters
         -----------
         new_model_name: str
-            The name of the new embedding model.
+            The name of the new embedding model (the model directory for the local service).
+        batch_size: int
+            The number of documents embedded per request.
+        requests_per_minute: int
+            The embedding request quota of the provider.
+        concurrency: int
+            The maximum number of embedding requests in flight.
+        dimensionality: int
+            The embedding dimensionality of the new store (defaults to the configured one).
         """
         # TODO: get default service & model name from config
         
@@ -203,91 +290,90 @@ class ConversationCog(Cog_Extension):
             await itn.response.send_message("Only the owner can perform this operation.", ephemeral=True)
             return
         
+        if self.is_converting:
+            await itn.response.send_message("A conversion is already in progress.", ephemeral=True)
+            return
+        
         await itn.response.defer(ephemeral=True)
-        asyncio.create_task(self._convert_embedding_model(itn, new_service, new_model_name, batch_size, delay_seconds))
-
-    # TODO: Consider multi-process execution (if API restrictions are loose)
-    async def _convert_embedding_model(self, itn: discord.Interaction, new_service: str, new_model_name: str, batch_size: int, delay_seconds: int):
+        asyncio.create_task(self._convert_embedding_model(
+            itn, new_service, new_model_name, batch_size,
+            requests_per_minute or self.migration_config["requests_per_minute"],
+            concurrency or self.migration_config["concurrency"],
+            dimensionality or self.embedding_dimensionality
+        ))
+
+    async def _convert_embedding_model(self, itn: discord.Interaction, new_service: str, new_model_name: str, batch_size: int, requests_per_minute: int, concurrency: int, dimensionality: int):
         """Handle the embedding model conversion process."""
         self.is_converting = True
         log.info(f"Starting embedding model conversion to {new_model_name} by {itn.user.id}")
         
         data_path = os.path.join(os.getcwd(), os.getenv("VECTOR_DB_PATH"))
-        temp_path = os.path.join(data_path, 'temp_chroma_db')
+        temp_path = os.path.join(data_path, f'temp_{self.vector_store_name}_db')
+        signature = {"service": new_service, "model": new_model_name, "dimensionality": dimensionality}
+        temp_vector_store = None
+        new_embedding_service = None
 
         try:
-            # Get all existing memories
-            all_memories = self.memory_service.vector_store.collection.get()
-            if not all_memories['documents']:
+            source_store = self.memory_service.vector_store
+            if await source_store.count() == 0:
                 await itn.followup.send("No memories found to convert.", ephemeral=True)
-                self.is_converting = False
                 return
 
-            # Initialize new embedding service
-            new_embedding_service = get_embedding_service(service_name=new_service, embedding_model_name=new_model_name)
-
-            # Convert embeddings with batch processing and API limit handling
-            new_embeddings = []
-            documents_to_process = all_memories['documents']
-            total_documents = len(documents_to_process)
-            total_batches = (total_documents + batch_size - 1) // batch_size
-            
-            log.info(f"Starting embedding generation in batches (batch size: {batch_size}, delay: {delay_seconds}s).")
-
-            for i in range(0, total_documents, batch_size):
-                batch = documents_to_process[i:i + batch_size]
-                current_batch_index = (i // batch_size) + 1
-                
-                batch_embeddings = []
-                for doc in batch:
-                    try:
-                        # use asyncio to run the embedding generation in parallel
-                        embedding = await new_embedding_service.get_embedding(doc)
-                        if embedding is not None:
-                            batch_embeddings.append(embedding)
-                        else:
-                            log.warning(f"Failed to generate embedding for a document in batch {current_batch_index}")
-                    except Exception as doc_e:
-                        log.error(f"Error generating embedding for a document in batch {current_batch_index}: {doc_e}", exc_info=True)
-                        # TODO: decide whether to continue or stop based on the exception
-                        
-                log.info(f"Processed batch {i//batch_size + 1}/{total_batches}")
-                new_embeddings.extend(batch_embeddings)
-
-                if i + batch_size < total_documents:
-                    log.info(f"Waiting for {delay_seconds} seconds before next batch...")
-                    await asyncio.sleep(delay_seconds)
-
-            # Store in temporary ChromaDB
+            # a checkpoint of the same target model is resumed, anything else left in the temp directory is discarded
+            checkpoint = load_checkpoint(temp_path)
+            if os.path.exists(temp_path) and (checkpoint is None or checkpoint.get("signature") != signature):
+                shutil.rmtree(temp_path)
             os.makedirs(temp_path, exist_ok=True)
-            temp_vector_store = get_vector_store(vector_store_name="chroma", path=temp_path)
-            for idx, (doc, embedding, metadata, id) in enumerate(zip(all_memories['documents'], new_embeddings, all_memories['metadatas'], all_memories['ids'])):
-                temp_vector_store.collection.add(
-                    embeddings=[embedding],
-                    documents=[doc],
-                    metadatas=[metadata],
-                    ids=[id]
-                )
+
+            # Initialize new embedding service and temporary store
+            new_embedding_service = get_embedding_service(service_name=new_service, embedding_model_name=new_model_name, output_dimensionality=dimensionality, policy_config=self.provider_policy_config, local_config=self.local_embedding_config)
+            temp_vector_store = get_vector_store(vector_store_name=self.vector_store_name, path=temp_path, dimension=dimensionality, **self.vector_store_config)
+
+            progress_message = await itn.followup.send("Conversion started...", ephemeral=True, wait=True)
+            async def report_progress(progress: dict):
+                await progress_message.edit(content=(
+                    f"Converting embeddings: {progress['done']}/{progress['total']} "
+                    f"({progress['failed']} failed), ETA {timedelta(seconds=int(progress['eta_seconds']))}"
+                ))
+
+            migration = EmbeddingMigration(
+                source_store, temp_vector_store, new_embedding_service, temp_path, signature,
+                page_size=self.migration_config["page_size"],
+                batch_size=batch_size,
+                concurrency=concurrency,
+                requests_per_minute=requests_per_minute,
+                progress_callback=report_progress
+            )
+            result = await migration.run()
+
+            if result["failed_ids"]:
+                log.error(f"Embedding conversion failed for {len(result['failed_ids'])} documents: {result['failed_ids']}")
+                await itn.followup.send(f"Conversion failed: could not embed {len(result['failed_ids'])} documents. Run the command again to retry from the checkpoint.", ephemeral=True)
+                return
 
             # Validate temporary DB
-            temp_count = temp_vector_store.collection.count()
-            original_count = len(all_memories['ids'])
+            temp_count = await temp_vector_store.count()
+            original_count = await source_store.count()
             if temp_count != original_count:
-                log.error(f"Temporary ChromaDB incomplete: {temp_count} vs {original_count} original")
+                log.error(f"Temporary vector store incomplete: {temp_count} vs {original_count} original")
                 await itn.followup.send("Conversion failed: Temporary DB incomplete.", ephemeral=True)
-                self.is_converting = False
                 return
             else:
                 # mark the temp DB as valid
+                migration.clear_checkpoint()
                 with open(os.path.join(temp_path, '.valid'), 'w') as f:
                     pass
 
-            await itn.followup.send(f"Embedding model converted to {new_model_name} successfully! It will take effect at next startup. Please remember to modify the config before the next startup to ensure the embedding model used is consistent with the database.", ephemeral=True)
+            await itn.followup.send(f"Embedding model converted to {new_model_name} successfully! It will take effect at next startup. Please remember to modify the config (embedding model and embedding_dimensionality: {dimensionality}) before the next startup to ensure the embedding model used is consistent with the database.", ephemeral=True)
 
         except Exception as e:
             log.error(f"Error during embedding conversion: {e}", exc_info=True)
             await itn.followup.send(f"Conversion failed: {str(e)}", ephemeral=True)
         finally:
+            if temp_vector_store is not None:
+                temp_vector_store.close()
+            if new_embedding_service is not None:
+                new_embedding_service.close()
             self.is_converting = False
             log.info("Embedding model conversion process completed.")
 
@@ -297,15 +383,25 @@ async def setup(bot: commands.Bot):
 
     config = AppConfig()
 
-    vector_db_path = os.path.join(os.getenv("VECTOR_DB_PATH"), "chroma_db") or "data/chroma_db/"                    # set the path to the ChromaDB persistence path
+    vector_db_path = os.path.join(os.getenv("VECTOR_DB_PATH"), f"{config.default_vector_store}_db")                 # set the path to the vector store persistence path
+    embedding_cache_config = dict(config.embedding_cache)
+    if embedding_cache_config.get("persistent"):
+        embedding_cache_config["persistent_path"] = os.path.join(os.getenv("VECTOR_DB_PATH"), "embedding_cache.sqlite3")
+    history_store_path = None
+    # the store is also needed without persistence, to receive the histories evicted from memory
+    if config.short_term_memory_store.get("persistent") or config.user_state_limits.get("spill_evicted_histories"):
+        history_store_path = os.path.join(os.getenv("VECTOR_DB_PATH"), "short_term_memory.sqlite3")
+    lexical_index_path = None
+    if config.hybrid_retrieval.get("enabled"):
+        lexical_index_path = os.path.join(os.getenv("VECTOR_DB_PATH"), "lexical_index.sqlite3")
 
     try:
         use_llm_service = config.default_llm_service
         use_embedding_service = config.default_embedding_service
-        llm_service = get_llm_service(service_name=use_llm_service, model_name=config.default_model[use_llm_service], config=config)
-        embedding_service = get_embedding_service(service_name=use_embedding_service, embedding_model_name=config.default_embedding_model[use_embedding_service])
-        vector_store = get_vector_store(vector_store_name="chroma", path=vector_db_path)
-        memory_service = MemoryService(llm_service, embedding_service, vector_store, config)
+        llm_service = get_llm_service(service_name=use_llm_service, model_name=config.default_model.get(use_llm_service), config=config)
+        embedding_service = get_embedding_service(service_name=use_embedding_service, embedding_model_name=config.default_embedding_model[use_embedding_service], output_dimensionality=config.embedding_dimensionality, cache_config=embedding_cache_config, policy_config=config.provider_policy, local_config=config.local_embedding)
+        vector_store = get_vector_store(vector_store_name=config.default_vector_store, path=vector_db_path, dimension=config.embedding_dimensionality, **config.vector_store)
+        memory_service = MemoryService(llm_service, embedding_service, vector_store, config, history_store_path=history_store_path, lexical_index_path=lexical_index_path)
         await bot.add_cog(ConversationCog(bot, llm_service, memory_service, config))
         log.info("ConversationCog added successfully.")
     except Exception as e:
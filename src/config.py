@@ -29,12 +29,117 @@ class AppConfig:
             "gemini": "gemini-2.0-flash",
             "grok": "grok-3-mini-fast-beta"
         }
+        self.provider_policy: dict = {
+            "gemini": {"requests_per_minute": 60, "tokens_per_minute": 1000000, "burst": 10},
+            "grok": {"requests_per_minute": 60, "tokens_per_minute": None, "burst": 10},
+            "gemini_embedding": {"requests_per_minute": 300, "tokens_per_minute": None, "burst": 20}
+        }
+        self.llm_router: dict = {
+            "providers": ["gemini", "grok"],
+            "enable_hedging": False,
+            "hedge_min_delay_seconds": 2.0,
+            "latency_window": 100,
+            "min_samples": 10,
+            "unhealthy_error_rate": 0.5
+        }
+        self.gemini_prefix_cache: dict = {
+            "enabled": False,
+            "ttl_seconds": 3600,
+            "renew_before_seconds": 300,
+            "retry_after_seconds": 600
+        }
+        self.grok_client: dict = {
+            "max_connections": 20,
+            "max_keepalive_connections": 10,
+            "keepalive_expiry": 30.0,
+            "max_in_flight": 8,
+            "timeout": 60.0
+        }
         self.default_embedding_service: str = "gemini"
+        self.embedding_dimensionality: int = 64
+        self.default_vector_store: str = "chroma"
         self.default_embedding_model: dict = {
-            "gemini": "embedding-001"
+            "gemini": "embedding-001",
+            "local": "models/nomic-embed-text-v1.5"
+        }
+        self.local_embedding: dict = {
+            "matryoshka": True,
+            "query_prefix": "search_query: ",
+            "document_prefix": "search_document: ",
+            "max_batch_size": 32,
+            "max_batch_wait_ms": 2.0,
+            "inference_threads": 2,
+            "intra_op_threads": 1,
+            "max_length": 256
+        }
+        self.embedding_cache: dict = {
+            "enabled": True,
+            "max_entries": 2048,
+            "persistent": True
+        }
+        self.vector_store: dict = {
+            "max_workers": 4,
+            "write_chunk_size": 1000,
+            "dedup_distance": None,
+            "dedup_mode": "skip",
+            "sharding": "none",
+            "num_shards": 16,
+            "max_open_collections": 256,
+            "segment_cache_bytes": None,
+            "max_open_users": 256,
+            "compaction_ratio": 0.25,
+            "coarse_dimension": None,
+            "rerank_candidates": 100
+        }
+        self.embedding_migration: dict = {
+            "page_size": 500,
+            "requests_per_minute": 60,
+            "concurrency": 4
         }
+        self.summarization_max_concurrency: int = 2
+        self.rolling_summary_max_chars: int = 2000
+        self.user_state_limits: dict = {
+            "max_users": 5000,
+            "max_history_bytes": 134217728,
+            "idle_ttl_seconds": 21600,
+            "spill_evicted_histories": True
+        }
+        self.short_term_memory_store: dict = {
+            "persistent": True,
+            "flush_interval": 0.5,
+            "max_batch_size": 256
+        }
+        self.rag_relevance: dict = {
+            "max_distance": 0.5,
+            "max_distance_gap": 0.15,
+            "min_lexical_score": 1.0
+        }
+        self.hybrid_retrieval: dict = {
+            "enabled": True,
+            "candidates": 10,
+            "rrf_k": 60
+        }
+        self.enable_streaming_response: bool = True
+        self.streaming_edit_interval: float = 1.0
+        self.session_idle_timeout_seconds: float = 21600
+        self.session_reap_interval_seconds: float = 600
         self.enable_timestamp_prompt: bool = True
         self.enable_weather_period_prompt: bool = True
+        self.weather_period: dict = {
+            "location": "Taipei",
+            "timezone": "Asia/Taipei",
+            "cache_ttl_seconds": 900,
+            "failure_retry_seconds": 60
+        }
+        self.context_budget: dict = {
+            "max_tokens": 8000,
+            "min_history_messages": 4
+        }
+        self.pipeline_stage_timeout: dict = {
+            "rag": 3.0,
+            "history": 1.0,
+            "weather_period": 2.0
+        }
 
         # personality default settings
         self.system_prompt: str = "You are a friendly AI assistant."
@@ -83,10 +188,37 @@ class AppConfig:
         self.model_default_temperature = self.base_setting_data.get("model_default_temperature", self.model_default_temperature)
         self.default_llm_service = self.base_setting_data.get("default_llm_service", self.default_llm_service)
         self.default_model = self.base_setting_data.get("default_model", self.default_model)
+        provider_policy_data = self.base_setting_data.get("provider_policy", {})
+        self.provider_policy = {
+            provider: {**self.provider_policy.get(provider, {}), **provider_policy_data.get(provider, {})}
+            for provider in {*self.provider_policy, *provider_policy_data}
+        }
+        self.llm_router = {**self.llm_router, **self.base_setting_data.get("llm_router", {})}
+        self.gemini_prefix_cache = {**self.gemini_prefix_cache, **self.base_setting_data.get("gemini_prefix_cache", {})}
+        self.grok_client = {**self.grok_client, **self.base_setting_data.get("grok_client", {})}
         self.default_embedding_service = self.base_setting_data.get("default_embedding_service", self.default_embedding_service)
+        self.embedding_dimensionality = self.base_setting_data.get("embedding_dimensionality", self.embedding_dimensionality)
+        self.default_vector_store = self.base_setting_data.get("default_vector_store", self.default_vector_store)
         self.default_embedding_model = self.base_setting_data.get("default_embedding_model", self.default_embedding_model)
+        self.local_embedding = {**self.local_embedding, **self.base_setting_data.get("local_embedding", {})}
+        self.embedding_cache = {**self.embedding_cache, **self.base_setting_data.get("embedding_cache", {})}
+        self.vector_store = {**self.vector_store, **self.base_setting_data.get("vector_store", {})}
+        self.embedding_migration = {**self.embedding_migration, **self.base_setting_data.get("embedding_migration", {})}
+        self.summarization_max_concurrency = self.base_setting_data.get("summarization_max_concurrency", self.summarization_max_concurrency)
+        self.rolling_summary_max_chars = self.base_setting_data.get("rolling_summary_max_chars", self.rolling_summary_max_chars)
+        self.user_state_limits = {**self.user_state_limits, **self.base_setting_data.get("user_state_limits", {})}
+        self.short_term_memory_store = {**self.short_term_memory_store, **self.base_setting_data.get("short_term_memory_store", {})}
+        self.rag_relevance = {**self.rag_relevance, **self.base_setting_data.get("rag_relevance", {})}
+        self.hybrid_retrieval = {**self.hybrid_retrieval, **self.base_setting_data.get("hybrid_retrieval", {})}
+        self.enable_streaming_response = self.base_setting_data.get("enable_streaming_response", self.enable_streaming_response)
+        self.streaming_edit_interval = self.base_setting_data.get("streaming_edit_interval", self.streaming_edit_interval)
+        self.session_idle_timeout_seconds = self.base_setting_data.get("session_idle_timeout_seconds", self.session_idle_timeout_seconds)
+        self.session_reap_interval_seconds = self.base_setting_data.get("session_reap_interval_seconds", self.session_reap_interval_seconds)
         self.enable_timestamp_prompt = self.base_setting_data.get("enable_timestamp_prompt", self.enable_timestamp_prompt)
         self.enable_weather_period_prompt = self.base_setting_data.get("enable_weather_period_prompt", self.enable_weather_period_prompt)
+        self.weather_period = {**self.weather_period, **self.base_setting_data.get("weather_period", {})}
+        self.context_budget = {**self.context_budget, **self.base_setting_data.get("context_budget", {})}
+        self.pipeline_stage_timeout = {**self.pipeline_stage_timeout, **self.base_setting_data.get("pipeline_stage_timeout", {})}
         
         # Load personality config
         personality_data = self._load_yaml_config(self._personality_config_path, "Personality")
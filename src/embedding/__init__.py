@@ -1,3 +1,4 @@
 from .base import EmbeddingServiceInterface
+from .cache import CachedEmbeddingService
 
 from .factory import get_embedding_service
\ No newline at end of file
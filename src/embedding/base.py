@@ -1,5 +1,6 @@
 from abc import ABC, abstractmethod
 from typing import List, Optional
+from src.utils.core_utils import INTERACTIVE
 
 class EmbeddingServiceInterface(ABC):
     """
@@ -7,6 +8,10 @@ class EmbeddingServiceInterface(ABC):
     Classes implementing this interface can integrate with different Embedding Model Providers, such as Gemini, Claude, GPT, etc.
     """
     
+    # instruction prefixes prepended by the service for models trained with them (e.g. E5 "query: " / "passage: ")
+    query_prefix: str = ""
+    document_prefix: str = ""
+    
     @abstractmethod
     def __init__(self, api_key: str):
         """
@@ -18,18 +23,48 @@ class EmbeddingServiceInterface(ABC):
         pass
     
     @abstractmethod
-    async def get_embedding(self, text: str) -> Optional[List[float]]:
+    async def get_embedding(self, text: str, priority: str = INTERACTIVE) -> Optional[List[float]]:
         """
         Get the embedding vector of the text.
         
         Args:
             text: The text to be converted to an embedding vector.
+            priority: INTERACTIVE or BACKGROUND, the provider call policy bucket of the request.
             
         Returns:
             The embedding vector (list of floats), or None if failed.
         """
         pass
     
+    async def get_query_embedding(self, text: str, priority: str = INTERACTIVE) -> Optional[List[float]]:
+        """
+        Get the embedding vector of a search query.
+        Services whose models embed queries and documents differently override this method,
+        the others embed a query like any other text.
+        
+        Args:
+            text: The query to be converted to an embedding vector.
+            priority: INTERACTIVE or BACKGROUND, the provider call policy bucket of the request.
+            
+        Returns:
+            The embedding vector (list of floats), or None if failed.
+        """
+        return await self.get_embedding(text, priority=priority)
+    
+    @abstractmethod
+    async def get_embeddings(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        Get the embedding vectors of multiple texts, split into provider-sized batches.
+        
+        Args:
+            texts: The texts to be converted to embedding vectors.
+            
+        Returns:
+            A list aligned with `texts`, each item is the embedding vector of the text at the same index,
+            or None if the embedding of that item failed.
+        """
+        pass
+    
     @abstractmethod
     def _validate_model(self, model_name: str, model_type: str, default_model: str) -> str:
         """
@@ -45,3 +80,10 @@ class EmbeddingServiceInterface(ABC):
             NotImplementedError: This method must be implemented by concrete subclasses.
         """
         pass
+    
+    def close(self):
+        """
+        Release the resources held by the Embedding Service (thread pools, model sessions, ...).
+        Services without such resources do not need to override this method.
+        """
+        pass
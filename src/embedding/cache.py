@@ -0,0 +1,232 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import List, Optional
+
+from src import setup_logger
+from src.utils.core_utils import INTERACTIVE
+from .base import EmbeddingServiceInterface
+
+log = setup_logger(__name__)
+
+class CachedEmbeddingService(EmbeddingServiceInterface):
+    """
+    Two-tier embedding cache that wraps any EmbeddingServiceInterface implementation.
+    Tier 1 is an in-process LRU, tier 2 is an optional SQLite store that survives restarts.
+    Entries are keyed by (service, model, output dimensionality, normalized text hash),
+    and the persistent store is purged automatically when the embedding model changes.
+    """
+
+    def __init__(self, service: EmbeddingServiceInterface, max_entries: int = 2048, persistent_path: Optional[str] = None):
+        self.service = service
+        self.max_entries = max_entries
+        self.embedding_model = service.embedding_model
+        self.namespace = self._build_namespace(service)
+
+        self._lru: OrderedDict[str, List[float]] = OrderedDict()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        if persistent_path:
+            self._open_persistent_store(persistent_path)
+
+    @staticmethod
+    def _build_namespace(service: EmbeddingServiceInterface) -> str:
+        service_name = getattr(service, "SERVICE_NAME", type(service).__name__)
+        dimensionality = getattr(service, "output_dimensionality", None)
+        return f"{service_name}:{service.embedding_model}:{dimensionality}"
+
+    def _open_persistent_store(self, path: str):
+        """open the SQLite store and drop entries produced by another embedding model"""
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'namespace'").fetchone()
+            if row is None or row[0] != self.namespace:
+                if row is not None:
+                    log.info(f"Embedding model changed ({row[0]} -> {self.namespace}), invalidating persistent embedding cache.")
+                self._db.execute("DELETE FROM embeddings")
+                self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('namespace', ?)", (self.namespace,))
+            self._db.commit()
+            log.info(f"Persistent embedding cache opened at {path}.")
+        except sqlite3.Error as e:
+            log.error(f"Failed to open persistent embedding cache at {path}, falling back to memory only: {e}")
+            self._db = None
+
+    @property
+    def query_prefix(self) -> str:
+        return self.service.query_prefix
+
+    @property
+    def document_prefix(self) -> str:
+        return self.service.document_prefix
+
+    def _make_key(self, text: str, prefix: str = "") -> str:
+        """the key covers the text as the model sees it, so queries and documents differ when the service prefixes them"""
+        normalized = " ".join(unicodedata.normalize("NFKC", prefix + text).split())
+        return hashlib.sha256(f"{self.namespace}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def _lru_get(self, key: str) -> Optional[List[float]]:
+        embedding = self._lru.get(key)
+        if embedding is not None:
+            self._lru.move_to_end(key)
+        return embedding
+
+    def _lru_put(self, key: str, embedding: List[float]):
+        self._lru[key] = embedding
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def _disk_get(self, key: str) -> Optional[List[float]]:
+        with self._db_lock:
+            row = self._db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return array("f", row[0]).tolist()
+
+    def _disk_put(self, key: str, embedding: List[float]):
+        with self._db_lock:
+            self._db.execute("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", (key, array("f", embedding).tobytes()))
+            self._db.commit()
+
+    async def get_embedding(self, text: str, priority: str = INTERACTIVE) -> Optional[List[float]]:
+        """get the embedding vector of the text, served from the cache when possible"""
+        return await self._get_cached(self._make_key(text, self.document_prefix), text, self.service.get_embedding, priority)
+
+    async def get_query_embedding(self, text: str, priority: str = INTERACTIVE) -> Optional[List[float]]:
+        """get the embedding vector of a search query, served from the cache when possible"""
+        if self.query_prefix == self.document_prefix:
+            return await self.get_embedding(text, priority=priority)
+        return await self._get_cached(self._make_key(text, self.query_prefix), text, self.service.get_query_embedding, priority)
+
+    async def _get_cached(self, key: str, text: str, fetch, priority: str) -> Optional[List[float]]:
+
+        embedding = self._lru_get(key)
+        if embedding is not None:
+            self.memory_hits += 1
+            return embedding
+
+        if self._db is not None:
+            try:
+                embedding = await asyncio.to_thread(self._disk_get, key)
+            except sqlite3.Error as e:
+                log.warning(f"Failed to read persistent embedding cache: {e}")
+            if embedding is not None:
+                self.disk_hits += 1
+                self._lru_put(key, embedding)
+                return embedding
+
+        self.misses += 1
+        embedding = await fetch(text, priority=priority)
+        if embedding is None:
+            return None         # never cache failures
+
+        embedding = list(embedding)
+        self._lru_put(key, embedding)
+        if self._db is not None:
+            try:
+                await asyncio.to_thread(self._disk_put, key, embedding)
+            except sqlite3.Error as e:
+                log.warning(f"Failed to write persistent embedding cache: {e}")
+        return embedding
+
+    def _disk_get_many(self, keys: List[str]) -> dict:
+        found = {}
+        with self._db_lock:
+            for key in keys:
+                row = self._db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    found[key] = array("f", row[0]).tolist()
+        return found
+
+    def _disk_put_many(self, items: List[tuple]):
+        with self._db_lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, array("f", embedding).tobytes()) for key, embedding in items]
+            )
+            self._db.commit()
+
+    async def get_embeddings(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """get the embedding vectors of multiple texts, only the cache misses are sent to the wrapped service"""
+        keys = [self._make_key(text, self.document_prefix) for text in texts]
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+
+        pending = {}            # key -> indices still waiting for an embedding
+        for i, key in enumerate(keys):
+            embedding = self._lru_get(key)
+            if embedding is not None:
+                self.memory_hits += 1
+                embeddings[i] = embedding
+            else:
+                pending.setdefault(key, []).append(i)
+
+        if pending and self._db is not None:
+            try:
+                found = await asyncio.to_thread(self._disk_get_many, list(pending))
+            except sqlite3.Error as e:
+                log.warning(f"Failed to read persistent embedding cache: {e}")
+                found = {}
+            for key, embedding in found.items():
+                self.disk_hits += len(pending[key])
+                self._lru_put(key, embedding)
+                for i in pending.pop(key):
+                    embeddings[i] = embedding
+
+        if not pending:
+            return embeddings
+
+        miss_keys = list(pending)
+        self.misses += sum(len(indices) for indices in pending.values())
+        results = await self.service.get_embeddings([texts[pending[key][0]] for key in miss_keys])
+
+        to_persist = []
+        for key, embedding in zip(miss_keys, results):
+            if embedding is None:
+                continue        # never cache failures
+            embedding = list(embedding)
+            self._lru_put(key, embedding)
+            to_persist.append((key, embedding))
+            for i in pending[key]:
+                embeddings[i] = embedding
+
+        if to_persist and self._db is not None:
+            try:
+                await asyncio.to_thread(self._disk_put_many, to_persist)
+            except sqlite3.Error as e:
+                log.warning(f"Failed to write persistent embedding cache: {e}")
+        return embeddings
+
+    def stats(self) -> dict:
+        """return the hit/miss counters of the cache"""
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            "resident_entries": len(self._lru)
+        }
+
+    def close(self):
+        """close the persistent store and the wrapped service"""
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
+        self.service.close()
+
+    def _validate_model(self, model_name: str, model_type: str, default_model: str) -> str:
+        return self.service._validate_model(model_name, model_type, default_model)
@@ -1,12 +1,45 @@
 import os
+from typing import Optional
 
 from .gemini_service import GeminiEmbeddingService
+from .cache import CachedEmbeddingService
 from .base import EmbeddingServiceInterface
 
 def get_embedding_service(service_name: str, **kwargs) -> EmbeddingServiceInterface:
     embedding_model_name = kwargs["embedding_model_name"]
+    cache_config: Optional[dict] = kwargs.get("cache_config")
+    policy_config: Optional[dict] = kwargs.get("policy_config")
+    local_config: dict = kwargs.get("local_config") or {}
     match service_name:
         case "gemini":
-            return GeminiEmbeddingService(api_key=os.getenv("GEMINI_API_KEY"), embedding_model_name=embedding_model_name)
+            service = GeminiEmbeddingService(
+                api_key=os.getenv("GEMINI_API_KEY"),
+                embedding_model_name=embedding_model_name,
+                output_dimensionality=kwargs.get("output_dimensionality", 64),
+                policy_config=(policy_config or {}).get("gemini_embedding")
+            )
+        case "local":
+            # imported lazily, onnxruntime and tokenizers are only needed by this backend
+            from .local_service import LocalEmbeddingService
+            service = LocalEmbeddingService(
+                embedding_model_name=embedding_model_name,
+                output_dimensionality=kwargs.get("output_dimensionality", 64),
+                max_batch_size=local_config.get("max_batch_size", 32),
+                max_batch_wait_ms=local_config.get("max_batch_wait_ms", 2.0),
+                inference_threads=local_config.get("inference_threads", 2),
+                intra_op_threads=local_config.get("intra_op_threads", 1),
+                max_length=local_config.get("max_length", 256),
+                query_prefix=local_config.get("query_prefix", ""),
+                document_prefix=local_config.get("document_prefix", ""),
+                matryoshka=local_config.get("matryoshka", False)
+            )
         case _:
-            raise ValueError(f"Unknown Embedding name: {service_name}")
\ No newline at end of file
+            raise ValueError(f"Unknown Embedding name: {service_name}")
+
+    if cache_config and cache_config.get("enabled", False):
+        service = CachedEmbeddingService(
+            service,
+            max_entries=cache_config.get("max_entries", 2048),
+            persistent_path=cache_config.get("persistent_path")
+        )
+    return service
\ No newline at end of file
@@ -2,13 +2,17 @@ from google import genai
 # from google.genai import types, errors
 from typing import List, Optional
 from src import setup_logger
+from src.utils.core_utils import get_provider_policy, INTERACTIVE, BACKGROUND
+from .base import EmbeddingServiceInterface
 
 log = setup_logger(__name__)
 
-class GeminiEmbeddingService:
+class GeminiEmbeddingService(EmbeddingServiceInterface):
+    SERVICE_NAME = "gemini"
     DEFAULT_EMBEDDING_MODEL = "embedding-001"
+    MAX_BATCH_SIZE = 100            # maximum number of contents accepted by a single embed_content request
     
-    def __init__(self, api_key: str, embedding_model_name: str):
+    def __init__(self, api_key: str, embedding_model_name: str, output_dimensionality: int = 64, policy_config: Optional[dict] = None):
         try:
             self.client = genai.Client(api_key=api_key)
             log.info("Google Generative AI configured successfully.")
@@ -17,23 +21,56 @@ class GeminiEmbeddingService:
             raise
         
         self.embedding_model = self._validate_model(embedding_model_name, "embedding", self.DEFAULT_EMBEDDING_MODEL)
-        
-    async def get_embedding(self, text: str) -> Optional[List[float]]:
-        """get the embedding vector of the text"""
-        try:
-            result = await self.client.aio.models.embed_content(
+        # Matryoshka-style embeddings: lower dimensionalities are prefixes of the full vector
+        self.output_dimensionality = output_dimensionality
+        # embedding requests have their own quota, separate from the generation models
+        self.policy = get_provider_policy("gemini_embedding", policy_config)
+
+    async def _embed(self, contents: List[str], priority: str):
+        """one embed_content request under the provider call policy (rate limits, retries, circuit breaker)"""
+        return await self.policy.call(
+            lambda: self.client.aio.models.embed_content(
                 model=self.embedding_model,
-                contents=[text],
+                contents=contents,
                 config={
-                    'output_dimensionality': 64 #TODO: set the embedding dimension (config option & find a better value)
+                    'output_dimensionality': self.output_dimensionality
                 }
-            )
+            ),
+            priority=priority
+        )
+        
+    async def get_embedding(self, text: str, priority: str = INTERACTIVE) -> Optional[List[float]]:
+        """get the embedding vector of the text"""
+        try:
+            result = await self._embed([text], priority)
             log.debug(f"Embedding result: {result.embeddings[0].values}")
             return result.embeddings[0].values
         except Exception as e:
             log.error(f"Error getting embedding from Gemini: {e}", exc_info=True)
             return None
         
+    async def get_embeddings(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """get the embedding vectors of multiple texts, one request per provider-sized batch (background priority)"""
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        for start in range(0, len(texts), self.MAX_BATCH_SIZE):
+            batch = texts[start:start + self.MAX_BATCH_SIZE]
+            try:
+                result = await self._embed(batch, BACKGROUND)
+                if len(result.embeddings) != len(batch):
+                    raise ValueError(f"expected {len(batch)} embeddings, got {len(result.embeddings)}")
+                for offset, embedding in enumerate(result.embeddings):
+                    embeddings[start + offset] = embedding.values
+            except Exception as e:
+                # isolate the failing items instead of dropping the whole batch
+                log.warning(f"Batch embedding request failed ({e}), retrying items {start}-{start + len(batch) - 1} one by one.")
+                for offset, text in enumerate(batch):
+                    embeddings[start + offset] = await self.get_embedding(text, priority=BACKGROUND)
+
+        failed = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if failed:
+            log.warning(f"Failed to embed {len(failed)}/{len(texts)} texts at indices: {failed}")
+        return embeddings
+        
     def _validate_model(self, model_name: str, model_type: str, default_model: str) -> str:
         """check if the specified model is available, otherwise use the default model"""
         try:
@@ -0,0 +1,200 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Set, Tuple
+
+from src import setup_logger
+from src.utils.core_utils import INTERACTIVE
+from .base import EmbeddingServiceInterface
+
+log = setup_logger(__name__)
+
+class LocalEmbeddingService(EmbeddingServiceInterface):
+    """
+    Sentence embeddings computed on the local CPU with ONNX Runtime, no network round trip and no quota.
+    The model directory holds `model.onnx` and its Hugging Face `tokenizer.json`. Token embeddings are
+    mean-pooled over the attention mask (models exporting a pooled 2-D output are used as is), then
+    truncated to `output_dimensionality` and L2-normalized. Truncation is refused unless the model is
+    declared `matryoshka` (trained so that prefixes of its vectors are embeddings themselves).
+    Queries and documents get the model's `query_prefix` / `document_prefix` (e.g. "search_query: ").
+    Concurrent single-text requests are gathered into micro-batches of up to `max_batch_size`, waiting
+    at most `max_batch_wait_ms` for company, and at most `inference_threads` batches run at once on a
+    thread pool off the event loop.
+    """
+    SERVICE_NAME = "local"
+    MODEL_FILE = "model.onnx"
+    TOKENIZER_FILE = "tokenizer.json"
+
+    def __init__(
+        self,
+        embedding_model_name: str,
+        output_dimensionality: Optional[int] = None,
+        max_batch_size: int = 32,
+        max_batch_wait_ms: float = 2.0,
+        inference_threads: int = 2,
+        intra_op_threads: int = 1,
+        max_length: int = 256,
+        query_prefix: str = "",
+        document_prefix: str = "",
+        matryoshka: bool = False
+    ):
+        # optional dependencies, only needed when the local backend is selected
+        try:
+            import numpy as np
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError("The local embedding service needs onnxruntime, tokenizers and numpy: pip install onnxruntime tokenizers numpy") from e
+        self._np = np
+
+        self.model_path = self._validate_model(embedding_model_name, "embedding", embedding_model_name)
+        self.embedding_model = os.path.basename(os.path.normpath(self.model_path))
+        self.output_dimensionality = output_dimensionality
+        self.query_prefix = query_prefix
+        self.document_prefix = document_prefix
+        self.max_batch_size = max_batch_size
+        self.max_batch_wait = max_batch_wait_ms / 1000
+        self.inference_threads = inference_threads
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(self.model_path, self.TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+
+        # each inference thread runs its own requests, so every session call stays single-threaded inside
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(os.path.join(self.model_path, self.MODEL_FILE), sess_options=options, providers=["CPUExecutionProvider"])
+        self._input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self._executor = ThreadPoolExecutor(max_workers=inference_threads, thread_name_prefix="local-embedding")
+
+        # a vector cut below the model's size only keeps its meaning for Matryoshka models
+        self.native_dimensionality = self._pool([document_prefix or "dimension probe"]).shape[1]
+        if output_dimensionality and output_dimensionality > self.native_dimensionality:
+            raise ValueError(f"Local embedding model '{self.embedding_model}' produces {self.native_dimensionality}-d vectors, {output_dimensionality} dimensions were requested.")
+        if output_dimensionality and output_dimensionality < self.native_dimensionality and not matryoshka:
+            raise ValueError(
+                f"Local embedding model '{self.embedding_model}' produces {self.native_dimensionality}-d vectors and is not declared matryoshka, "
+                f"truncating them to {output_dimensionality} dimensions would ruin retrieval. Set embedding_dimensionality to "
+                f"{self.native_dimensionality}, or use a Matryoshka model (local_embedding.matryoshka: true)."
+            )
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._batcher: Optional[asyncio.Task] = None
+        self._batch_slots: Optional[asyncio.Semaphore] = None
+        self._batch_tasks: Set[asyncio.Task] = set()
+        log.info(f"Local embedding model '{self.embedding_model}' ({self.native_dimensionality}-d) loaded from {self.model_path}.")
+
+    def _pool(self, texts: List[str]):
+        """tokenize and run one batch, return one pooled (not normalized) vector per text"""
+        np = self._np
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.array([encoding.type_ids for encoding in encodings], dtype=np.int64)
+        output = self.session.run(None, {name: value for name, value in feeds.items() if name in self._input_names})[0]
+
+        if output.ndim == 3:
+            # mean pooling of the token embeddings, padding excluded
+            mask = attention_mask[:, :, None].astype(output.dtype)
+            output = (output * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        return output
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        """embed one batch of already prefixed texts, executed on the inference thread pool"""
+        np = self._np
+        output = self._pool(texts)
+        if self.output_dimensionality:
+            output = output[:, :self.output_dimensionality]
+        norms = np.linalg.norm(output, axis=1, keepdims=True)
+        return (output / np.maximum(norms, 1e-12)).astype(np.float32).tolist()
+
+    async def _run_batch(self, batch: List[Tuple[str, asyncio.Future]]):
+        try:
+            embeddings = await asyncio.get_running_loop().run_in_executor(self._executor, self._encode, [text for text, _ in batch])
+            for (_, future), embedding in zip(batch, embeddings):
+                if not future.done():
+                    future.set_result(embedding)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        except asyncio.CancelledError:
+            for _, future in batch:
+                future.cancel()
+            raise
+        finally:
+            self._batch_slots.release()
+
+    async def _batch_loop(self):
+        """gather concurrent requests into micro-batches, at most inference_threads batches run at once"""
+        loop = asyncio.get_running_loop()
+        while True:
+            # while every slot is busy the requests keep queueing, so the next batch comes out larger
+            await self._batch_slots.acquire()
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_batch_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            task = asyncio.create_task(self._run_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _embed_one(self, text: str) -> Optional[List[float]]:
+        if self._batcher is None or self._batcher.done():
+            # started lazily, it needs the running event loop
+            self._queue = asyncio.Queue()
+            self._batch_slots = asyncio.Semaphore(self.inference_threads)
+            self._batcher = asyncio.create_task(self._batch_loop())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+        try:
+            return await future
+        except Exception as e:
+            log.error(f"Error computing local embedding: {e}", exc_info=True)
+            return None
+
+    async def get_embedding(self, text: str, priority: str = INTERACTIVE) -> Optional[List[float]]:
+        """get the embedding vector of the text (a document); no quota to share, the priority is not used"""
+        return await self._embed_one(self.document_prefix + text)
+
+    async def get_query_embedding(self, text: str, priority: str = INTERACTIVE) -> Optional[List[float]]:
+        """get the embedding vector of a search query"""
+        return await self._embed_one(self.query_prefix + text)
+
+    async def get_embeddings(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """get the embedding vectors of multiple texts, one inference per batch of max_batch_size"""
+        loop = asyncio.get_running_loop()
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        for start in range(0, len(texts), self.max_batch_size):
+            batch = [self.document_prefix + text for text in texts[start:start + self.max_batch_size]]
+            try:
+                embeddings[start:start + len(batch)] = await loop.run_in_executor(self._executor, self._encode, batch)
+            except Exception as e:
+                log.error(f"Error computing local embeddings for items {start}-{start + len(batch) - 1}: {e}", exc_info=True)
+        return embeddings
+
+    def close(self):
+        """stop the micro-batcher and the inference threads"""
+        if self._batcher is not None:
+            self._batcher.cancel()
+        for task in list(self._batch_tasks):
+            task.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _validate_model(self, model_name: str, model_type: str, default_model: str) -> str:
+        """the model name is the directory of the exported model, it must hold the model and its tokenizer"""
+        model_path = os.path.abspath(model_name)
+        for file_name in (self.MODEL_FILE, self.TOKENIZER_FILE):
+            if not os.path.isfile(os.path.join(model_path, file_name)):
+                raise FileNotFoundError(f"{model_type.capitalize()} model directory '{model_path}' has no {file_name}.")
+        log.info(f"{model_type.capitalize()} model '{model_name}' validated successfully.")
+        return model_path
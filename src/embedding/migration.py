@@ -0,0 +1,187 @@
+import asyncio
+import json
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from src import setup_logger
+from src.utils.core_utils import TokenBucket
+from src.vector_store import VectorStoreInterface
+from .base import EmbeddingServiceInterface
+
+log = setup_logger(__name__)
+
+CHECKPOINT_FILE = ".checkpoint.json"
+
+def load_checkpoint(target_path: str) -> Optional[Dict[str, Any]]:
+    """load the migration checkpoint stored in the target directory, or None if there is none"""
+    checkpoint_path = os.path.join(target_path, CHECKPOINT_FILE)
+    if not os.path.isfile(checkpoint_path):
+        return None
+    try:
+        with open(checkpoint_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        log.warning(f"Ignoring unreadable migration checkpoint at {checkpoint_path}: {e}")
+        return None
+
+class EmbeddingMigration:
+    """
+    Resumable re-embedding of a vector store into a new one.
+    The source store is walked page by page, each page is embedded in batches with bounded concurrency
+    under a token-bucket rate limit, and a checkpoint is written after every page so an interrupted
+    migration resumes where it stopped instead of starting over.
+    """
+
+    def __init__(
+        self,
+        source_store: VectorStoreInterface,
+        target_store: VectorStoreInterface,
+        embedding_service: EmbeddingServiceInterface,
+        target_path: str,
+        signature: Dict[str, str],
+        page_size: int = 500,
+        batch_size: int = 100,
+        concurrency: int = 4,
+        requests_per_minute: float = 60,
+        progress_callback: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None
+    ):
+        self.source_store = source_store
+        self.target_store = target_store
+        self.embedding_service = embedding_service
+        self.target_path = target_path
+        self.signature = signature                  # identifies the target model, a checkpoint of another model is not resumed
+        self.page_size = page_size
+        self.batch_size = batch_size
+        self.progress_callback = progress_callback
+
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._bucket = TokenBucket.per_minute(requests_per_minute, burst=concurrency)
+
+        checkpoint = load_checkpoint(target_path)
+        if checkpoint and checkpoint.get("signature") == signature:
+            self.checkpoint = checkpoint
+            log.info(f"Resuming embedding migration at offset {checkpoint['offset']}.")
+        else:
+            self.checkpoint = {"signature": signature, "offset": 0, "converted": 0, "failed_ids": [], "failed_offsets": []}
+
+    def _save_checkpoint(self):
+        """write the checkpoint atomically"""
+        checkpoint_path = os.path.join(self.target_path, CHECKPOINT_FILE)
+        tmp_path = checkpoint_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.checkpoint, f)
+        os.replace(tmp_path, checkpoint_path)
+
+    def clear_checkpoint(self):
+        """remove the checkpoint once the migration is complete"""
+        checkpoint_path = os.path.join(self.target_path, CHECKPOINT_FILE)
+        if os.path.isfile(checkpoint_path):
+            os.remove(checkpoint_path)
+
+    async def _embed_batch(self, documents: List[str]) -> List[Optional[List[float]]]:
+        async with self._semaphore:
+            await self._bucket.acquire()
+            return await self.embedding_service.get_embeddings(documents)
+
+    async def _write(self, ids: List[str], documents: List[str], embeddings: List[List[float]], metadatas: List[Dict]) -> List[str]:
+        # add_memories overwrites existing ids, a page replayed after a crash does not duplicate anything
+        if not ids:
+            return []
+        return await self.target_store.add_memories(ids, documents, embeddings, metadatas)
+
+    async def _retry_failed(self):
+        """retry the documents that failed in a previous run, located by their offset in the source store"""
+        failed = list(zip(self.checkpoint["failed_ids"], self.checkpoint["failed_offsets"]))
+        if not failed:
+            return
+        log.info(f"Retrying {len(failed)} documents that failed in a previous run.")
+        self.checkpoint["failed_ids"], self.checkpoint["failed_offsets"] = [], []
+        for id, offset in failed:
+            page = await self.source_store.get_page(offset, 1)
+            if page["ids"] != [id]:
+                log.warning(f"Document {id} moved in the source store, it cannot be retried from the checkpoint.")
+                self.checkpoint["failed_ids"].append(id)
+                self.checkpoint["failed_offsets"].append(offset)
+                continue
+            embedding = (await self._embed_batch(page["documents"]))[0]
+            if embedding is None:
+                self.checkpoint["failed_ids"].append(id)
+                self.checkpoint["failed_offsets"].append(offset)
+                continue
+            if await self._write(page["ids"], page["documents"], [embedding], page["metadatas"]):
+                self.checkpoint["failed_ids"].append(id)
+                self.checkpoint["failed_offsets"].append(offset)
+                continue
+            self.checkpoint["converted"] += 1
+        await asyncio.to_thread(self._save_checkpoint)
+
+    async def run(self) -> Dict[str, Any]:
+        """run (or resume) the migration, return the final checkpoint state"""
+        total = await self.source_store.count()
+        started_at = time.monotonic()
+        processed_this_run = 0
+        log.info(f"Embedding migration started: {total} memories, {self.checkpoint['offset']} already processed.")
+
+        await self._retry_failed()
+
+        while True:
+            offset = self.checkpoint["offset"]
+            page = await self.source_store.get_page(offset, self.page_size)
+            ids, documents, metadatas = page["ids"], page["documents"], page["metadatas"]
+            if not ids:
+                break
+
+            # embed the page in batches, concurrently under the rate limit
+            batches = [range(start, min(start + self.batch_size, len(ids))) for start in range(0, len(ids), self.batch_size)]
+            results = await asyncio.gather(*(self._embed_batch([documents[i] for i in batch]) for batch in batches))
+
+            ok_indices = []
+            embeddings = {}
+            for batch, batch_embeddings in zip(batches, results):
+                for i, embedding in zip(batch, batch_embeddings):
+                    if embedding is None:
+                        self.checkpoint["failed_ids"].append(ids[i])
+                        self.checkpoint["failed_offsets"].append(offset + i)
+                    else:
+                        ok_indices.append(i)
+                        embeddings[i] = embedding
+
+            write_failed = set(await self._write(
+                [ids[i] for i in ok_indices],
+                [documents[i] for i in ok_indices],
+                [embeddings[i] for i in ok_indices],
+                [metadatas[i] for i in ok_indices]
+            ))
+            for i in ok_indices:
+                if ids[i] in write_failed:
+                    self.checkpoint["failed_ids"].append(ids[i])
+                    self.checkpoint["failed_offsets"].append(offset + i)
+
+            self.checkpoint["offset"] = offset + len(ids)
+            self.checkpoint["converted"] += len(ok_indices) - len(write_failed)
+            await asyncio.to_thread(self._save_checkpoint)
+
+            processed_this_run += len(ids)
+            await self._report_progress(total, processed_this_run, started_at)
+
+        return self.checkpoint
+
+    async def _report_progress(self, total: int, processed_this_run: int, started_at: float):
+        elapsed = time.monotonic() - started_at
+        done = self.checkpoint["offset"]
+        rate = processed_this_run / elapsed if elapsed > 0 else 0.0
+        eta_seconds = (total - done) / rate if rate > 0 and total > done else 0.0
+        progress = {
+            "done": done,
+            "total": total,
+            "failed": len(self.checkpoint["failed_ids"]),
+            "rate_per_second": rate,
+            "eta_seconds": eta_seconds
+        }
+        log.info(f"Embedding migration progress: {done}/{total} ({progress['failed']} failed), {rate:.1f} docs/s, ETA {eta_seconds:.0f}s")
+        if self.progress_callback is not None:
+            try:
+                await self.progress_callback(progress)
+            except Exception as e:
+                log.warning(f"Failed to report migration progress: {e}")
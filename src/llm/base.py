@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict, Optional, Any
+from typing import AsyncIterator, List, Dict, Optional, Any, Tuple
 
 class LLMServiceInterface(ABC):
     """
@@ -18,7 +18,7 @@ class LLMServiceInterface(ABC):
         pass
     
     @abstractmethod
-    async def generate_response(self, system_prompt: str, history: List[Dict[str, str]], user_input: str, rag_context: Optional[str] = None, temperature: float = 1.0, use_search: bool = False) -> Optional[str]:
+    async def generate_response(self, system_prompt: str, history: List[Dict[str, str]], user_input: str, rag_context: Optional[List[str]] = None, temperature: float = 1.0, use_search: bool = False, weather_period_info: Optional[Tuple[str, str, str]] = None) -> Optional[str]:
         """
         Generate a response to a conversation.
         
@@ -26,13 +26,28 @@ class LLMServiceInterface(ABC):
             system_prompt: System prompt, defining the behavior and limitations of the AI assistant.
             history: Conversation history list, each item contains 'role' and 'content'.
             user_input: The current user input.
-            rag_context: Optional context for search-enhanced generation.
+            rag_context: Optional relevant memories for retrieval-augmented generation, most relevant first.
+            weather_period_info: Optional (date, period, weather) tuple prepared by the caller, injected as auxiliary context.
             
         Returns:
             The generated response text, or None or an error message if failed.
         """
         pass
     
+    @abstractmethod
+    async def generate_response_stream(self, system_prompt: str, history: List[Dict[str, str]], user_input: str, rag_context: Optional[List[str]] = None, temperature: float = 1.0, use_search: bool = False, weather_period_info: Optional[Tuple[str, str, str]] = None) -> AsyncIterator[str]:
+        """
+        Generate a response to a conversation as a stream of text fragments.
+        
+        Args:
+            Same as `generate_response`.
+            
+        Yields:
+            Text fragments in generation order. If the call fails before anything was produced,
+            a single error message is yielded instead; a failure after partial output ends the stream.
+        """
+        pass
+    
     @abstractmethod
     async def summarize_conversation(self, conversation_history: str, summarization_prompt: str) -> Optional[str]:
         """
@@ -47,6 +62,13 @@ class LLMServiceInterface(ABC):
         """
         pass
     
+    async def close(self):
+        """
+        Release the resources held by the service (HTTP connection pools, ...).
+        Services without such resources do not need to override this method.
+        """
+        pass
+    
     @abstractmethod
     def _validate_model(self, model_name: str, model_type: str, default_model: str) -> str:
         """
@@ -0,0 +1,131 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+from src import setup_logger
+from src import AppConfig
+from src.utils.i18n import get_translator
+from src.utils.core_utils import insert_timestamp, create_system_message
+
+log = setup_logger(__name__)
+
+# CJK ideographs, kana, hangul and full-width forms are roughly one token per character
+_CJK_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+MESSAGE_OVERHEAD_TOKENS = 4         # role marker and separators added around every message
+
+def estimate_tokens(text: str) -> int:
+    """fast local token estimate: one token per CJK character, about four characters per token otherwise"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def _messages_tokens(messages: List[Dict[str, str]]) -> int:
+    return sum(estimate_tokens(msg['content']) + MESSAGE_OVERHEAD_TOKENS for msg in messages)
+
+class AssembledContext:
+    """the context messages (in the internal history format) and the tokens each section contributes"""
+    __slots__ = ("messages", "section_tokens", "dropped")
+
+    def __init__(self, messages: List[Dict[str, str]], section_tokens: Dict[str, int], dropped: Dict[str, int]):
+        self.messages = messages
+        self.section_tokens = section_tokens
+        self.dropped = dropped
+
+class ContextAssembler:
+    """
+    Fit the system prompt, RAG memories, short-term history and auxiliary context (weather/period)
+    into a token budget. The system prompt and the user input are always kept; when the estimate
+    exceeds the budget, the oldest history beyond `min_history_messages` is dropped first, then the
+    lowest-ranked memories, then the auxiliary context, and finally the remaining oldest history.
+    """
+
+    def __init__(self, config: AppConfig):
+        self.lang = config.model_lang
+        self.enable_timestamp_prompt = config.enable_timestamp_prompt
+        self.rag_prompt_prefix = config.rag_prompt_prefix
+        self.max_tokens = config.context_budget["max_tokens"]
+        self.min_history_messages = config.context_budget["min_history_messages"]
+        self.tr = get_translator()
+
+    def _rag_messages(self, memories: List[str]) -> List[Dict[str, str]]:
+        if not memories:
+            return []
+        relevant_memories = "\n".join([f"- {doc}" for doc in memories])
+        rag_context = self.rag_prompt_prefix.format(relevant_memories=relevant_memories)
+        return [create_system_message(self.tr.t(self.lang, 'prompt.long_term_memory', rag_context=rag_context))]    # Inject RAG context as a system message
+
+    def _history_messages(self, history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        if self.enable_timestamp_prompt:
+            return insert_timestamp(history, self.tr.t(self.lang, 'prompt.timestamp_format'))    # Insert timestamp to the history record
+        return list(history)
+
+    def _aux_messages(self, weather_period_info: Optional[Tuple[str, str, str]]) -> List[Dict[str, str]]:
+        if not weather_period_info:
+            return []
+        date, period, weather = weather_period_info
+        return [create_system_message(self.tr.t(self.lang, 'prompt.weather_period_info_format', date=date, period=period, weather=weather))]
+
+    def assemble(
+        self,
+        system_prompt: str,
+        history: List[Dict[str, str]],
+        user_input: str,
+        rag_context: Optional[List[str]] = None,
+        weather_period_info: Optional[Tuple[str, str, str]] = None
+    ) -> AssembledContext:
+        """build the context messages (without the user input) within the token budget"""
+        memories = list(rag_context or [])
+        history = list(history)
+        use_aux = True
+
+        fixed_messages = [
+            create_system_message(system_prompt),
+            create_system_message(self.tr.t(self.lang, 'prompt.history_separator'))
+        ]
+        fixed_tokens = _messages_tokens(fixed_messages) + estimate_tokens(user_input) + MESSAGE_OVERHEAD_TOKENS
+
+        def measure() -> Dict[str, int]:
+            return {
+                "rag": _messages_tokens(self._rag_messages(memories)),
+                "history": _messages_tokens(self._history_messages(history)),
+                "aux": _messages_tokens(self._aux_messages(weather_period_info)) if use_aux else 0
+            }
+
+        dropped = {"history": 0, "rag": 0, "aux": 0}
+        tokens = measure()
+        while fixed_tokens + sum(tokens.values()) > self.max_tokens:
+            # drop the lowest-value item still present
+            if len(history) > self.min_history_messages:
+                history.pop(0)
+                dropped["history"] += 1
+            elif memories:
+                memories.pop()          # memories are ranked, the last one is the least relevant
+                dropped["rag"] += 1
+            elif use_aux and tokens["aux"]:
+                use_aux = False
+                dropped["aux"] += 1
+            elif len(history) > 1:
+                history.pop(0)
+                dropped["history"] += 1
+            else:
+                break                   # only the mandatory parts are left
+            tokens = measure()
+
+        messages = [fixed_messages[0]]
+        messages.extend(self._rag_messages(memories))
+        messages.append(fixed_messages[1])
+        messages.extend(self._history_messages(history))     # Insert the conversation history after the RAG context (if present)
+        if use_aux:
+            messages.extend(self._aux_messages(weather_period_info))
+
+        section_tokens = {
+            "system_prompt": estimate_tokens(system_prompt) + MESSAGE_OVERHEAD_TOKENS,
+            **tokens,
+            "user_input": estimate_tokens(user_input) + MESSAGE_OVERHEAD_TOKENS,
+            "total": fixed_tokens + sum(tokens.values())
+        }
+        if any(dropped.values()):
+            log.info(f"Context exceeded the budget of {self.max_tokens} tokens, dropped {dropped}. Section tokens: {section_tokens}")
+        else:
+            log.debug(f"Context section tokens: {section_tokens}")
+        return AssembledContext(messages, section_tokens, dropped)
@@ -2,10 +2,11 @@ import os
 
 from .gemini_service import GeminiAssistant
 from .grok_service import GrokAssistant
+from .router import LLMRouter
 from .base import LLMServiceInterface
 
 def get_llm_service(service_name: str, **kwargs) -> LLMServiceInterface:
-    model_name = kwargs["model_name"]
+    model_name = kwargs.get("model_name")
     config = kwargs["config"]
     match service_name:
         case "gemini":
@@ -13,6 +14,13 @@ def get_llm_service(service_name: str, **kwargs) -> LLMServiceInterface:
             return GeminiAssistant(api_key=os.getenv("GEMINI_API_KEY"), model_name=model_name, config=config)
         case "grok":
             return GrokAssistant(api_key=os.getenv("GROK_API_KEY"), model_name=model_name, config=config)
+        case "router":
+            # wrap the configured providers, each with its own default model
+            providers = {
+                name: get_llm_service(name, model_name=config.default_model[name], config=config)
+                for name in config.llm_router["providers"]
+            }
+            return LLMRouter(providers, config)
         case _:
             raise ValueError(f"Unknown LLM name: {service_name}")
         
\ No newline at end of file
@@ -1,14 +1,14 @@
-import asyncio
 from google import genai
 from google.genai import types, errors
 from google.genai.types import Tool, GoogleSearch
 from src import setup_logger
 from src.utils.i18n import get_translator
-from src.utils.core_utils import insert_timestamp, create_system_message
-from src.utils.integrations import weather_period_reporter
+from src.utils.core_utils import get_provider_policy, CircuitOpenError, BACKGROUND
 from src import AppConfig
-from typing import List, Dict, Optional
+from typing import Any, AsyncIterator, List, Dict, Optional, Tuple
 from .base import LLMServiceInterface
+from .context_assembler import ContextAssembler, estimate_tokens
+from .prefix_cache import GeminiPrefixCache, is_cached_content_error
 
 log = setup_logger(__name__)
 
@@ -24,103 +24,186 @@ class GeminiAssistant(LLMServiceInterface):
             raise
         
         self.generation_model = self._validate_model(model_name, "generation", self.DEFAULT_GENERATION_MODEL)
+        self.policy = get_provider_policy("gemini", config.provider_policy["gemini"])
         
         self.lang = config.model_lang
-        self.enable_timestamp_prompt = config.enable_timestamp_prompt
-        self.enable_weather_period_prompt = config.enable_weather_period_prompt
+        self.context_assembler = ContextAssembler(config)
         
         self.content_moderation_error = config.content_moderation_error
         self.unknown_response_error = config.unknown_response_error
         self.service_error = config.service_error
         
         self.google_search_tool = Tool(google_search=GoogleSearch())
+
+        # provider-side cache of the static system prompt (optional)
+        self.prefix_cache: Optional[GeminiPrefixCache] = None
+        prefix_cache_config = config.gemini_prefix_cache
+        if prefix_cache_config["enabled"]:
+            self.prefix_cache = GeminiPrefixCache(
+                self.client,
+                self.generation_model,
+                ttl_seconds=prefix_cache_config["ttl_seconds"],
+                renew_before_seconds=prefix_cache_config["renew_before_seconds"],
+                retry_after_seconds=prefix_cache_config["retry_after_seconds"]
+            )
         
         self.tr = get_translator()
         
 
-    async def generate_response(self, system_prompt: str, history: List[Dict[str, str]], user_input: str, rag_context: Optional[str] = None, temperature: float = 1.0, use_search: bool = False) -> Optional[str]:
-        try:
-            # Construct the complete context
-            full_history = [create_system_message(system_prompt)]
-            if rag_context:
-                rag_msg = self.tr.t(self.lang, 'prompt.long_term_memory', rag_context=rag_context)
-                full_history.append(create_system_message(rag_msg)) # Inject RAG context as a system message
-            
-            sep = self.tr.t(self.lang, 'prompt.history_separator')
-            full_history.append(create_system_message(sep))
-           
-            if self.enable_timestamp_prompt:
-                timestamped_history = insert_timestamp(history, self.tr.t(self.lang, 'prompt.timestamp_format'))    # Insert timestamp to the history record
-                full_history.extend(timestamped_history)                                                            # Insert the conversation history after the RAG context (if present)
-            else:
-                full_history.extend(history)
-            
-            if self.enable_weather_period_prompt:
-                date, period, weather = await weather_period_reporter('Asia/Taipei', lang=self.lang, location='Taipei') # TODO: time zone and location should be configurable
-                full_history.append(create_system_message(self.tr.t(self.lang, 'prompt.weather_period_info_format', date=date, period=period, weather=weather)))
-
-            system_instruction = self._format_history(full_history)
-            log.debug(f"system instruction: {system_instruction}")
-            
-            # Configure generation
+    async def _prepare_request(self, system_prompt: str, history: List[Dict[str, str]], user_input: str, rag_context: Optional[List[str]], temperature: float, use_search: bool, weather_period_info: Optional[Tuple[str, str, str]], use_prefix_cache: bool = True) -> Tuple[types.GenerateContentConfig, Any, int]:
+        """construct the complete context, the generation config, the contents and the estimated token count shared by the normal and the streaming call"""
+        context = self.context_assembler.assemble(system_prompt, history, user_input, rag_context, weather_period_info)
+        full_history = context.messages
+
+        # tools cannot be combined with cached content, search requests always send the full prompt
+        cache_name = None
+        if use_prefix_cache and self.prefix_cache is not None and not use_search:
+            cache_name = await self.prefix_cache.get_handle(system_prompt)
+        if cache_name:
+            # the system prompt is served from the cache, the dynamic context travels with the user input
+            dynamic_context = "\n".join(self._format_history(full_history[1:]))
             gemini_config = types.GenerateContentConfig(
-                system_instruction=system_instruction,
+                cached_content=cache_name,
                 temperature=temperature
             )
-            if use_search:
-                gemini_config.tools = [self.google_search_tool]
-                gemini_config.response_modalities = ["TEXT"]
-
-            max_retries = 3
-            retry_delay_seconds = 5
-            
-            for attempt in range(max_retries):
-                try:
-                    # Call the Gemini API to generate response
-                    response = await self.client.aio.models.generate_content(
-                        model=self.generation_model,
-                        config=gemini_config,
-                        contents=user_input
-                    )
-
-                    # check if response is empty
-                    if response.text:
-                        return response.text
-                    elif response.prompt_feedback:
-                        log.warning(f"Gemini call blocked or failed. Feedback: {response.prompt_feedback}")
-                        return self.content_moderation_error
-                    else:
-                        log.error(f"Gemini returned an empty response or unexpected format: {response}")
-                        return self.unknown_response_error
-                except errors.ServerError as e:
-                    # catch ServerError and retry if necessary
-                    log.warning(f"ServerError on attempt {attempt + 1}: {e}")
-                    if e.code == 503 and attempt < max_retries - 1:
-                        log.info(f"Retrying in {retry_delay_seconds} seconds...")
-                        await asyncio.sleep(retry_delay_seconds)
-                    elif e.code == 503 and attempt == max_retries - 1:
-                        log.error(f"Max retries reached for 503 ServerError: {e}", exc_info=True)
-                        return self.service_error
-                    else:
-                        log.error(f"Non-retryable ServerError on attempt {attempt + 1}: {e}", exc_info=True)
-                        return self.service_error
+            contents = [types.Content(role="user", parts=[types.Part(text=dynamic_context), types.Part(text=user_input)])]
+            return gemini_config, contents, context.section_tokens["total"]
+
+        system_instruction = self._format_history(full_history)
+        log.debug(f"system instruction: {system_instruction}")
+        
+        # Configure generation
+        gemini_config = types.GenerateContentConfig(
+            system_instruction=system_instruction,
+            temperature=temperature
+        )
+        if use_search:
+            gemini_config.tools = [self.google_search_tool]
+            gemini_config.response_modalities = ["TEXT"]
+        return gemini_config, user_input, context.section_tokens["total"]
+
+    async def _generate(self, gemini_config: types.GenerateContentConfig, contents: Any, tokens: int) -> types.GenerateContentResponse:
+        """call the Gemini API under the provider call policy (rate limits, retries, circuit breaker)"""
+        return await self.policy.call(
+            lambda: self.client.aio.models.generate_content(
+                model=self.generation_model,
+                config=gemini_config,
+                contents=contents
+            ),
+            tokens=tokens
+        )
+
+    async def _open_stream(self, gemini_config: types.GenerateContentConfig, contents: Any, tokens: int) -> Tuple[Optional[types.GenerateContentResponse], AsyncIterator[types.GenerateContentResponse]]:
+        """open the stream and wait for its first chunk under the call policy, so failures before any output are retried"""
+        async def attempt():
+            stream = await self.client.aio.models.generate_content_stream(
+                model=self.generation_model,
+                config=gemini_config,
+                contents=contents
+            )
+            return await anext(stream, None), stream
+        return await self.policy.call(attempt, tokens=tokens)
 
+    async def generate_response(self, system_prompt: str, history: List[Dict[str, str]], user_input: str, rag_context: Optional[List[str]] = None, temperature: float = 1.0, use_search: bool = False, weather_period_info: Optional[Tuple[str, str, str]] = None) -> Optional[str]:
+        try:
+            request_args = (system_prompt, history, user_input, rag_context, temperature, use_search, weather_period_info)
+            gemini_config, contents, tokens = await self._prepare_request(*request_args)
+
+            # Call the Gemini API to generate response
+            try:
+                response = await self._generate(gemini_config, contents, tokens)
+            except errors.ClientError as e:
+                # only a rejected cache is worth a retry with the full prompt, a quota or request error would just repeat
+                if not gemini_config.cached_content or not is_cached_content_error(e):
+                    raise
+                # the cached prefix expired or was rejected, retry with the full prompt
+                log.warning(f"Gemini rejected the cached context, falling back to the full prompt: {e}")
+                self.prefix_cache.invalidate()
+                gemini_config, contents, tokens = await self._prepare_request(*request_args, use_prefix_cache=False)
+                response = await self._generate(gemini_config, contents, tokens)
+
+            # check if response is empty
+            if response.text:
+                return response.text
+            elif response.prompt_feedback:
+                log.warning(f"Gemini call blocked or failed. Feedback: {response.prompt_feedback}")
+                return self.content_moderation_error
+            else:
+                log.error(f"Gemini returned an empty response or unexpected format: {response}")
+                return self.unknown_response_error
+
+        except CircuitOpenError as e:
+            log.warning(f"Skipping Gemini call: {e}")
+            return self.service_error
         except Exception as e:
             log.error(f"Error generating response from Gemini: {e}", exc_info=True)
-            # TODO consider more fine-grained error handling, e.g., API rate limit
             return self.service_error
 
+    async def generate_response_stream(self, system_prompt: str, history: List[Dict[str, str]], user_input: str, rag_context: Optional[List[str]] = None, temperature: float = 1.0, use_search: bool = False, weather_period_info: Optional[Tuple[str, str, str]] = None) -> AsyncIterator[str]:
+        yielded = False
+        try:
+            request_args = (system_prompt, history, user_input, rag_context, temperature, use_search, weather_period_info)
+            gemini_config, contents, tokens = await self._prepare_request(*request_args)
+
+            # Call the Gemini API to stream the response, a stream can only be retried before anything has been delivered
+            try:
+                first_chunk, stream = await self._open_stream(gemini_config, contents, tokens)
+            except errors.ClientError as e:
+                # only a rejected cache is worth a retry with the full prompt, a quota or request error would just repeat
+                if not gemini_config.cached_content or not is_cached_content_error(e):
+                    raise
+                # the cached prefix expired or was rejected, retry with the full prompt
+                log.warning(f"Gemini rejected the cached context, falling back to the full prompt: {e}")
+                self.prefix_cache.invalidate()
+                gemini_config, contents, tokens = await self._prepare_request(*request_args, use_prefix_cache=False)
+                first_chunk, stream = await self._open_stream(gemini_config, contents, tokens)
+
+            last_chunk = first_chunk
+            if first_chunk is not None:
+                if first_chunk.text:
+                    yielded = True
+                    yield first_chunk.text
+                async for chunk in stream:
+                    last_chunk = chunk
+                    if chunk.text:
+                        yielded = True
+                        yield chunk.text
+
+            # check if response is empty
+            if not yielded:
+                if last_chunk is not None and last_chunk.prompt_feedback:
+                    log.warning(f"Gemini stream blocked or failed. Feedback: {last_chunk.prompt_feedback}")
+                    yield self.content_moderation_error
+                else:
+                    log.error(f"Gemini stream returned an empty response or unexpected format: {last_chunk}")
+                    yield self.unknown_response_error
+
+        except CircuitOpenError as e:
+            log.warning(f"Skipping Gemini stream: {e}")
+            yield self.service_error
+        except Exception as e:
+            if yielded:
+                log.error(f"Gemini stream interrupted after partial output: {e}", exc_info=True)
+            else:
+                log.error(f"Error streaming response from Gemini: {e}", exc_info=True)
+                yield self.service_error
+
     async def summarize_conversation(self, conversation_history: str, summarization_prompt: str) -> Optional[str]:
         """use the LLM to summarize the conversation content"""
         log.debug(f"Summarizing conversation history: {conversation_history}")
         try:
-            response = await self.client.aio.models.generate_content(
-                model=self.generation_model,
-                config=types.GenerateContentConfig(
-                    system_instruction=summarization_prompt,
-                    temperature=0.1
+            # summaries are background work, they must not use up the budget of interactive replies
+            response = await self.policy.call(
+                lambda: self.client.aio.models.generate_content(
+                    model=self.generation_model,
+                    config=types.GenerateContentConfig(
+                        system_instruction=summarization_prompt,
+                        temperature=0.1
+                    ),
+                    contents=conversation_history
                 ),
-                contents=conversation_history
+                priority=BACKGROUND,
+                tokens=estimate_tokens(summarization_prompt) + estimate_tokens(conversation_history)
             )
             if response.text:
                 log.info("Summarization successful.")
@@ -136,6 +219,11 @@ class GeminiAssistant(LLMServiceInterface):
             log.error(f"Error summarizing conversation with Gemini: {e}", exc_info=True)
             return None
         
+    async def close(self):
+        """delete the provider-side context cache"""
+        if self.prefix_cache is not None:
+            await self.prefix_cache.close()
+
     def _validate_model(self, model_name: str, model_type: str, default_model: str) -> str:
         """check if the specified model is available, otherwise use the default model"""
         try:
@@ -1,17 +1,19 @@
 import asyncio
-from openai import OpenAI, OpenAIError
+import httpx
+from openai import AsyncOpenAI, OpenAI
 from src import setup_logger
 from src.utils.i18n import get_translator
-from src.utils.core_utils import insert_timestamp, create_system_message
-from src.utils.integrations import weather_period_reporter
+from src.utils.core_utils import get_provider_policy, CircuitOpenError, BACKGROUND
 from src import AppConfig
-from typing import List, Dict, Optional
+from typing import AsyncIterator, List, Dict, Optional, Tuple
 from .base import LLMServiceInterface
+from .context_assembler import ContextAssembler, estimate_tokens
 
 log = setup_logger(__name__)
 
 class GrokAssistant(LLMServiceInterface):
     DEFAULT_GENERATION_MODEL = "grok-3-mini-fast-beta"
+    BASE_URL = "https://api.x.ai/v1"
 
     def __init__(
         self,
@@ -19,18 +21,33 @@ class GrokAssistant(LLMServiceInterface):
         model_name: str,
         config: AppConfig
     ):
+        self._api_key = api_key
+        client_config = config.grok_client
         try:
-            self.client = OpenAI(api_key=api_key, base_url="https://api.x.ai/v1")
+            # native async client on an explicitly sized, keep-alive connection pool
+            self.http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=client_config["max_connections"],
+                    max_keepalive_connections=client_config["max_keepalive_connections"],
+                    keepalive_expiry=client_config["keepalive_expiry"]
+                ),
+                timeout=httpx.Timeout(client_config["timeout"])
+            )
+            # retries are handled by the shared provider call policy, not by the SDK
+            self.client = AsyncOpenAI(api_key=api_key, base_url=self.BASE_URL, http_client=self.http_client, max_retries=0)
             log.info("xAI Grok configured successfully.")
         except Exception as e:
             log.error(f"Failed to configure xAI Grok: {e}")
             raise
 
+        # requests beyond this limit wait here instead of piling up on the connection pool
+        self._in_flight = asyncio.Semaphore(client_config["max_in_flight"])
+
         self.generation_model = self._validate_model(model_name, "generation", self.DEFAULT_GENERATION_MODEL)
+        self.policy = get_provider_policy("grok", config.provider_policy["grok"])
 
         self.lang = config.model_lang
-        self.enable_timestamp_prompt = config.enable_timestamp_prompt
-        self.enable_weather_period_prompt = config.enable_weather_period_prompt
+        self.context_assembler = ContextAssembler(config)
         
         # load role settings for history formatting
         self.user_role = config.user_role
@@ -42,86 +59,134 @@ class GrokAssistant(LLMServiceInterface):
 
         self.tr = get_translator()
 
+    def _build_messages(
+        self,
+        system_prompt: str,
+        history: List[Dict[str, str]],
+        user_input: str,
+        rag_context: Optional[List[str]],
+        weather_period_info: Optional[Tuple[str, str, str]]
+    ) -> Tuple[List[Dict[str, str]], int]:
+        """construct the complete context (and its estimated token count) shared by the normal and the streaming call"""
+        context = self.context_assembler.assemble(system_prompt, history, user_input, rag_context, weather_period_info)
+        full_history = context.messages
+
+        log.debug(f"full_history: {full_history}")
+        
+        messages = self._format_history(full_history)
+        messages.append({"role": "user", "content": user_input})
+        return messages, context.section_tokens["total"]
+
+    async def _create(self, **kwargs):
+        """one non-streaming chat completion request, holding an in-flight slot (the slot is not held while the policy backs off)"""
+        # cancelling the caller aborts the HTTP request
+        async with self._in_flight:
+            return await self.client.chat.completions.create(model=self.generation_model, **kwargs)
+
     async def generate_response(
         self,
         system_prompt: str,
         history: List[Dict[str, str]],
         user_input: str,
-        rag_context: Optional[str] = None,
+        rag_context: Optional[List[str]] = None,
         temperature: float = 1.0,
-        use_search: bool = False
+        use_search: bool = False,
+        weather_period_info: Optional[Tuple[str, str, str]] = None
     ) -> Optional[str]:
         try:
-            # Construct the complete context
-            full_history = [create_system_message(system_prompt)]
-            if rag_context:
-                rag_msg = self.tr.t(self.lang, 'prompt.long_term_memory', rag_context=rag_context)
-                full_history.append(create_system_message(rag_msg)) # Inject RAG context as a system message
-
-            sep = self.tr.t(self.lang, 'prompt.history_separator')
-            full_history.append(create_system_message(sep))
-
-            if self.enable_timestamp_prompt:
-                timestamped_history = insert_timestamp(history, self.tr.t(self.lang, 'prompt.timestamp_format'))    # Insert timestamp to the history record
-                full_history.extend(timestamped_history)
+            messages, tokens = self._build_messages(system_prompt, history, user_input, rag_context, weather_period_info)
+            
+            if use_search:
+                # TODO: implement search functionality
+                pass
+
+            response = await self.policy.call(
+                lambda: self._create(messages=messages, temperature=temperature),
+                tokens=tokens
+            )
+            text = response.choices[0].message.content
+            refusal = response.choices[0].message.refusal
+            if text:
+                return text
+            elif refusal:
+                log.warning(f"Grok call blocked or failed. Feedback: {refusal}")
+                return self.content_moderation_error
             else:
-                full_history.extend(history)
+                log.error(f"Grok returned an empty response or unexpected format: {response}")
+                return self.unknown_response_error
 
-            if self.enable_weather_period_prompt:
-                date, period, weather = await weather_period_reporter('Asia/Taipei', lang=self.lang, location='Taipei') # TODO: time zone and location should be configurable
-                full_history.append(create_system_message(self.tr.t(self.lang, 'prompt.weather_period_info_format', date=date, period=period, weather=weather)))
+        except CircuitOpenError as e:
+            log.warning(f"Skipping Grok call: {e}")
+            return self.service_error
+        except Exception as e:
+            log.error(f"Error generating response from Grok: {e}", exc_info=True)
+            return self.service_error
 
-            log.debug(f"full_history: {full_history}")
-            
-            messages = self._format_history(full_history)
-            messages.append({"role": "user", "content": user_input})
+    async def generate_response_stream(
+        self,
+        system_prompt: str,
+        history: List[Dict[str, str]],
+        user_input: str,
+        rag_context: Optional[List[str]] = None,
+        temperature: float = 1.0,
+        use_search: bool = False,
+        weather_period_info: Optional[Tuple[str, str, str]] = None
+    ) -> AsyncIterator[str]:
+        yielded = False
+        try:
+            messages, tokens = self._build_messages(system_prompt, history, user_input, rag_context, weather_period_info)
             
             if use_search:
                 # TODO: implement search functionality
                 pass
 
-            max_retries = 3
-            retry_delay_seconds = 5
-            loop = asyncio.get_running_loop()
-
-            for attempt in range(max_retries):
+            refusal = None
+            # the stream is opened (and its first chunk awaited) under the call policy, so failures before any output are retried
+            # the in-flight slot is taken here and held until the stream is closed, not just while it is opened
+            async def open_stream():
+                await self._in_flight.acquire()
                 try:
-                    # Run synchronous API call in thread executor to avoid blocking
-                    response = await loop.run_in_executor(
-                        None,
-                        lambda: self.client.chat.completions.create(
-                            model=self.generation_model,
-                            messages=messages,
-                            temperature=temperature
-                        )
-                    )
-                    text = response.choices[0].message.content
-                    refusal = response.choices[0].message.refusal
-                    if text:
-                        return text
-                    elif refusal:
-                        log.warning(f"Grok call blocked or failed. Feedback: {refusal}")
-                        return self.content_moderation_error
-                    else:
-                        log.error(f"Grok returned an empty response or unexpected format: {response}")
-                        return self.unknown_response_error
-                except OpenAIError as e:
-                    # catch OpenAIError and retry if necessary
-                    log.warning(f"API error on attempt {attempt+1}: {e}")
-                    if e.code == 503 and attempt < max_retries - 1:
-                        log.info(f"Retrying in {retry_delay_seconds} seconds...")
-                        await asyncio.sleep(retry_delay_seconds)
-                    elif e.code == 503 and attempt == max_retries - 1:
-                        log.error(f"Max retries reached for 503 ServerError: {e}", exc_info=True)
-                        return self.service_error
-                    else:
-                        log.error(f"Non-retryable ServerError on attempt {attempt + 1}: {e}", exc_info=True)
-                        return self.service_error
+                    stream = await self.client.chat.completions.create(model=self.generation_model, messages=messages, temperature=temperature, stream=True)
+                    try:
+                        return await anext(stream, None), stream
+                    except BaseException:
+                        await stream.close()
+                        raise
+                except BaseException:
+                    self._in_flight.release()
+                    raise
+            first_chunk, stream = await self.policy.call(open_stream, tokens=tokens)
+
+            # closing the stream (also on cancellation or when the consumer stops early) aborts the request
+            try:
+                async with stream:
+                    chunk = first_chunk
+                    while chunk is not None:
+                        if chunk.choices:
+                            delta = chunk.choices[0].delta
+                            refusal = refusal or getattr(delta, "refusal", None)
+                            if delta.content:
+                                yielded = True
+                                yield delta.content
+                        chunk = await anext(stream, None)
+            finally:
+                self._in_flight.release()
 
+            if not yielded:
+                if refusal:
+                    log.warning(f"Grok stream blocked or failed. Feedback: {refusal}")
+                    yield self.content_moderation_error
+                else:
+                    log.error("Grok stream returned an empty response.")
+                    yield self.unknown_response_error
+
+        except CircuitOpenError as e:
+            log.warning(f"Skipping Grok stream: {e}")
+            yield self.service_error
         except Exception as e:
-            log.error(f"Error generating response from Grok: {e}", exc_info=True)
-            # TODO consider more fine-grained error handling, e.g., API rate limit
-            return self.service_error
+            log.error(f"Error streaming response from Grok: {e}", exc_info=True)
+            if not yielded:
+                yield self.service_error
 
     async def summarize_conversation(
         self,
@@ -130,18 +195,17 @@ class GrokAssistant(LLMServiceInterface):
     ) -> Optional[str]:
         """use the LLM to summarize the conversation content"""
         try:
-            loop = asyncio.get_running_loop()
-            # Wrap in executor
-            response = await loop.run_in_executor(
-                None,
-                lambda: self.client.chat.completions.create(
-                    model=self.generation_model,
+            # summaries are background work, they must not use up the budget of interactive replies
+            response = await self.policy.call(
+                lambda: self._create(
                     messages=[
                         {"role": "system", "content": summarization_prompt},
                         {"role": "user", "content": conversation_history}
                     ],
                     temperature=0.1
-                )
+                ),
+                priority=BACKGROUND,
+                tokens=estimate_tokens(summarization_prompt) + estimate_tokens(conversation_history)
             )
             summary = response.choices[0].message.content
             refusal = response.choices[0].message.refusal
@@ -155,7 +219,7 @@ class GrokAssistant(LLMServiceInterface):
             else:
                 log.error(f"Grok summarization returned empty response: {response}")
                 return None
-        except OpenAIError as e:
+        except Exception as e:
             log.error(f"Error summarizing conversation with Grok: {e}", exc_info=True)
             return None
 
@@ -166,7 +230,9 @@ class GrokAssistant(LLMServiceInterface):
         default_model: str
     ) -> str:
         try:
-            available_model_ids = [model.id for model in self.client.models.list()]
+            # validation runs once at startup, outside the event loop, with a short-lived synchronous client
+            with OpenAI(api_key=self._api_key, base_url=self.BASE_URL) as client:
+                available_model_ids = [model.id for model in client.models.list()]
             
             if model_name in available_model_ids:
                 log.info(f"{model_type.capitalize()} model '{model_name}' validated successfully.")
@@ -183,6 +249,10 @@ class GrokAssistant(LLMServiceInterface):
             )
             return default_model
         
+    async def close(self):
+        """close the pooled HTTP client"""
+        await self.client.close()
+        
     def _format_history(self, history: List[Dict[str, str]]) -> List[Dict[str, any]]:
         """transform internal history record to the format accepted by the Grok API"""
         formatted = []
@@ -0,0 +1,117 @@
+import asyncio
+import hashlib
+import time
+from typing import Optional
+
+from google.genai import types
+
+from src import setup_logger
+
+log = setup_logger(__name__)
+
+_CACHE_ERROR_MARKERS = ("cachedcontent", "cached_content", "cached content")
+
+def is_cached_content_error(error: Exception) -> bool:
+    """
+    whether a rejected request failed because of its cached content (expired, deleted or invalid),
+    as opposed to a quota, safety or request error that the full prompt would hit as well
+    """
+    message = str(getattr(error, "message", None) or error).lower()
+    if not any(marker in message for marker in _CACHE_ERROR_MARKERS):
+        return False
+    return getattr(error, "code", None) in (400, 403, 404)
+
+class GeminiPrefixCache:
+    """
+    Provider-side cache of the static prompt prefix (the system prompt) using Gemini cached content.
+    The prefix is uploaded once and referenced by its handle; the TTL is renewed shortly before it
+    expires, and a new cache is created only when the prefix or the model changes.
+    Any failure disables the cache for `retry_after_seconds` and callers fall back to sending the
+    full prompt, so caching never breaks generation. The client is injected so it can be faked in tests.
+    """
+
+    def __init__(self, client, model: str, ttl_seconds: float = 3600, renew_before_seconds: float = 300, retry_after_seconds: float = 600):
+        self.client = client
+        self.model = model
+        self.ttl_seconds = ttl_seconds
+        self.renew_before_seconds = renew_before_seconds
+        self.retry_after_seconds = retry_after_seconds
+
+        self._lock = asyncio.Lock()
+        self._key: Optional[str] = None
+        self._name: Optional[str] = None
+        self._expires_at = 0.0
+        self._disabled_until = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def _make_key(self, system_prompt: str) -> str:
+        return hashlib.sha256(f"{self.model}\0{system_prompt}".encode("utf-8")).hexdigest()
+
+    async def get_handle(self, system_prompt: str) -> Optional[str]:
+        """return the cached content name holding the prefix, or None if the full prompt must be sent"""
+        now = time.monotonic()
+        if now < self._disabled_until:
+            return None
+        key = self._make_key(system_prompt)
+        if self._key == key and now < self._expires_at - self.renew_before_seconds:
+            self.hits += 1
+            return self._name
+
+        async with self._lock:
+            now = time.monotonic()
+            if self._key == key and now < self._expires_at - self.renew_before_seconds:
+                self.hits += 1
+                return self._name       # refreshed by another task while waiting for the lock
+            self.misses += 1
+            try:
+                if self._key == key and now < self._expires_at:
+                    await self._renew()
+                else:
+                    await self._create(key, system_prompt)
+                return self._name
+            except Exception as e:
+                log.warning(f"Gemini context cache unavailable, sending the full prompt for {self.retry_after_seconds}s: {e}")
+                self._disabled_until = time.monotonic() + self.retry_after_seconds
+                self._key, self._name, self._expires_at = None, None, 0.0
+                return None
+
+    async def _create(self, key: str, system_prompt: str):
+        previous = self._name
+        cached = await self.client.aio.caches.create(
+            model=self.model,
+            config=types.CreateCachedContentConfig(
+                system_instruction=system_prompt,
+                ttl=f"{int(self.ttl_seconds)}s",
+                display_name="system-prompt"
+            )
+        )
+        self._key, self._name = key, cached.name
+        self._expires_at = time.monotonic() + self.ttl_seconds
+        log.info(f"Created Gemini context cache {cached.name} for the system prompt (model {self.model}).")
+        if previous is not None:
+            await self._delete(previous)     # the prefix or the model changed, the old cache is useless
+
+    async def _renew(self):
+        await self.client.aio.caches.update(
+            name=self._name,
+            config=types.UpdateCachedContentConfig(ttl=f"{int(self.ttl_seconds)}s")
+        )
+        self._expires_at = time.monotonic() + self.ttl_seconds
+        log.debug(f"Renewed Gemini context cache {self._name}.")
+
+    async def _delete(self, name: str):
+        try:
+            await self.client.aio.caches.delete(name=name)
+        except Exception as e:
+            log.warning(f"Failed to delete Gemini context cache {name}: {e}")
+
+    def invalidate(self):
+        """forget the current handle (e.g. after the provider rejected it), the next call creates a new cache"""
+        self._key, self._name, self._expires_at = None, None, 0.0
+
+    async def close(self):
+        """delete the cache on the provider side"""
+        if self._name is not None:
+            await self._delete(self._name)
+            self.invalidate()
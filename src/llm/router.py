@@ -0,0 +1,214 @@
+import asyncio
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from src import setup_logger
+from src import AppConfig
+from .base import LLMServiceInterface
+
+log = setup_logger(__name__)
+
+class ProviderStats:
+    """rolling latency and error samples of one provider"""
+    __slots__ = ("samples",)
+
+    def __init__(self, window: int):
+        self.samples: deque = deque(maxlen=window)     # (latency_seconds, ok)
+
+    def record(self, latency: float, ok: bool):
+        self.samples.append((latency, ok))
+
+    def error_rate(self) -> float:
+        if not self.samples:
+            return 0.0
+        return sum(1 for _, ok in self.samples if not ok) / len(self.samples)
+
+    def percentile(self, q: float) -> Optional[float]:
+        latencies = sorted(latency for latency, ok in self.samples if ok)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        return {
+            "samples": len(self.samples),
+            "error_rate": self.error_rate(),
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95)
+        }
+
+class LLMRouter(LLMServiceInterface):
+    """
+    LLM service routing requests over several providers.
+    Providers are tried in order of health (error rate) and rolling median latency; a provider that
+    fails (service error, empty response, no response) is failed over to the next one. With hedging
+    enabled, a second provider is started when the first one exceeds its p95 latency, and whichever
+    answers first wins. Streams are only failed over or hedged before their first fragment.
+    """
+
+    def __init__(self, providers: Dict[str, LLMServiceInterface], config: AppConfig):
+        if not providers:
+            raise ValueError("LLMRouter needs at least one provider")
+        self.providers = providers                  # configured priority order
+        router_config = config.llm_router
+        self.enable_hedging = router_config["enable_hedging"]
+        self.hedge_min_delay = router_config["hedge_min_delay_seconds"]
+        self.min_samples = router_config["min_samples"]
+        self.unhealthy_error_rate = router_config["unhealthy_error_rate"]
+
+        self.failure_responses = {config.service_error, config.unknown_response_error}
+        self.service_error = config.service_error
+
+        # response latency and time to first fragment are tracked separately
+        self._stats = {
+            kind: {name: ProviderStats(router_config["latency_window"]) for name in providers}
+            for kind in ("response", "stream")
+        }
+        log.info(f"LLM router configured with providers {list(providers)} (hedging {'enabled' if self.enable_hedging else 'disabled'}).")
+
+    def _is_failure(self, result: Optional[str]) -> bool:
+        return result is None or result in self.failure_responses
+
+    def _ranked(self, kind: str) -> List[str]:
+        """providers ordered by health, then by median latency once enough samples exist, then by configuration"""
+        stats = self._stats[kind]
+        def sort_key(item: Tuple[int, str]):
+            index, name = item
+            provider_stats = stats[name]
+            enough = len(provider_stats.samples) >= self.min_samples
+            unhealthy = enough and provider_stats.error_rate() >= self.unhealthy_error_rate
+            median = provider_stats.percentile(0.5) if enough else None
+            return (unhealthy, median if median is not None else float("inf"), index)
+        return [name for _, name in sorted(enumerate(self.providers), key=sort_key)]
+
+    def _hedge_delay(self, kind: str, name: str) -> Optional[float]:
+        stats = self._stats[kind][name]
+        if len(stats.samples) < self.min_samples:
+            return None                 # no reliable p95 yet, do not hedge
+        p95 = stats.percentile(0.95)
+        return max(self.hedge_min_delay, p95) if p95 is not None else None
+
+    async def _timed(self, kind: str, name: str, call: Awaitable, is_failure: Callable) -> Tuple[str, object]:
+        started_at = time.monotonic()
+        try:
+            result = await call
+        except asyncio.CancelledError:
+            # a cancelled call (a hedge loser) would have taken at least this long; this lower bound is
+            # recorded when it exceeds the provider's median, so a provider that keeps losing is demoted
+            elapsed = time.monotonic() - started_at
+            stats = self._stats[kind][name]
+            median = stats.percentile(0.5)
+            if median is not None and elapsed > median:
+                stats.record(elapsed, True)
+            raise
+        except Exception as e:
+            log.error(f"Provider {name} raised: {e}", exc_info=True)
+            result = None
+        self._stats[kind][name].record(time.monotonic() - started_at, not is_failure(result))
+        return name, result
+
+    async def _route(self, kind: str, start: Callable[[str], Awaitable], is_failure: Callable, cancel: Callable = None):
+        """
+        Run `start(name)` on the providers in ranked order until one succeeds.
+        With hedging, the next provider is started once the current one passes its p95 deadline.
+        Returns (name, result) of the winner, or (None, last result) if every provider failed.
+        """
+        order = self._ranked(kind)
+        pending: Dict[asyncio.Task, str] = {}
+        last_result = None
+        try:
+            while order or pending:
+                if order and (not pending or self.enable_hedging):
+                    name = order.pop(0)
+                    task = asyncio.create_task(self._timed(kind, name, start(name), is_failure))
+                    pending[task] = name
+                    if len(pending) > 1:
+                        log.info(f"Hedging request to provider {name}.")
+
+                # wait for a result, or until it is time to hedge to the next provider
+                timeout = None
+                if self.enable_hedging and order:
+                    timeout = self._hedge_delay(kind, pending[next(reversed(pending))])
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    pending.pop(task)
+                    name, result = task.result()
+                    if not is_failure(result):
+                        return name, result
+                    log.warning(f"Provider {name} failed, failing over.")
+                    last_result = result
+                    if cancel is not None and result is not None:
+                        await cancel(result)
+            return None, last_result
+        finally:
+            for task in pending:
+                task.cancel()
+            for task, _ in list(pending.items()):
+                try:
+                    _, result = await task
+                    if cancel is not None and result is not None:
+                        await cancel(result)       # release the losing result (e.g. an open stream)
+                except (asyncio.CancelledError, Exception):
+                    pass
+
+    async def generate_response(self, system_prompt: str, history: List[Dict[str, str]], user_input: str, rag_context: Optional[List[str]] = None, temperature: float = 1.0, use_search: bool = False, weather_period_info: Optional[Tuple[str, str, str]] = None) -> Optional[str]:
+        def start(name: str):
+            return self.providers[name].generate_response(system_prompt, history, user_input, rag_context, temperature, use_search, weather_period_info)
+        name, result = await self._route("response", start, self._is_failure)
+        if name is not None:
+            log.debug(f"Response served by provider {name}.")
+        return result if result is not None else self.service_error
+
+    async def generate_response_stream(self, system_prompt: str, history: List[Dict[str, str]], user_input: str, rag_context: Optional[List[str]] = None, temperature: float = 1.0, use_search: bool = False, weather_period_info: Optional[Tuple[str, str, str]] = None) -> AsyncIterator[str]:
+        async def start(name: str):
+            # a stream is "answered" when its first fragment arrives
+            stream = self.providers[name].generate_response_stream(system_prompt, history, user_input, rag_context, temperature, use_search, weather_period_info)
+            first = await anext(stream, None)
+            return first, stream
+
+        def is_failure(result) -> bool:
+            return result is None or self._is_failure(result[0])
+
+        async def close(result):
+            await result[1].aclose()
+
+        name, result = await self._route("stream", start, is_failure, cancel=close)
+        if result is None:
+            yield self.service_error
+            return
+        first, stream = result
+        if name is None:
+            yield first if first is not None else self.service_error        # every provider failed, already closed
+            return
+        log.debug(f"Stream served by provider {name}.")
+        try:
+            yield first
+            async for fragment in stream:
+                yield fragment
+        finally:
+            await stream.aclose()
+
+    async def summarize_conversation(self, conversation_history: str, summarization_prompt: str) -> Optional[str]:
+        # background work, plain failover without hedging
+        for name in self._ranked("response"):
+            summary = await self.providers[name].summarize_conversation(conversation_history, summarization_prompt)
+            if summary:
+                return summary
+            log.warning(f"Provider {name} failed to summarize, failing over.")
+        return None
+
+    def stats(self) -> Dict[str, Dict[str, Dict[str, Optional[float]]]]:
+        """return the rolling latency and error statistics of every provider"""
+        return {kind: {name: stats.summary() for name, stats in by_name.items()} for kind, by_name in self._stats.items()}
+
+    async def close(self):
+        await asyncio.gather(*(provider.close() for provider in self.providers.values()), return_exceptions=True)
+
+    def _validate_model(self, model_name: str, model_type: str, default_model: str) -> str:
+        # each provider validates its own model
+        return model_name
+
+    def _format_history(self, history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        # each provider formats the history for its own API
+        return history
@@ -1 +1,4 @@
-from .memory_service import MemoryService
\ No newline at end of file
+from .memory_service import MemoryService
+from .history_store import HistoryStore
+from .bounded_user_map import BoundedUserMap
+from .lexical_index import LexicalIndex
\ No newline at end of file
@@ -0,0 +1,149 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional, Tuple
+
+from src import setup_logger
+
+log = setup_logger(__name__)
+
+_MISSING = object()
+
+class BoundedUserMap:
+    """
+    Dict-like per-user state map with bounded size.
+    Entries are kept in LRU order and evicted when the entry count or the estimated total size
+    exceeds its cap, or when they have not been accessed for `idle_ttl_seconds`.
+    `on_evict(key, value)` is called for every evicted entry (e.g. to spill it to disk).
+    Values mutated in place should be re-measured with `refresh(key)`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        idle_ttl_seconds: Optional[float] = None,
+        sizeof: Optional[Callable[[Any], int]] = None,
+        on_evict: Optional[Callable[[Hashable, Any], None]] = None
+    ):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self._sizeof = sizeof or (lambda value: 0)
+        self._on_evict = on_evict
+
+        self._entries: OrderedDict[Hashable, Tuple[Any, int, float]] = OrderedDict()  # key -> (value, size, last_access)
+        self._bytes = 0
+        self.evictions = {"capacity": 0, "bytes": 0, "idle": 0}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(list(self._entries))
+
+    def __getitem__(self, key: Hashable) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """get the value and mark it as recently used"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        value, size, _ = entry
+        self._entries[key] = (value, size, time.monotonic())
+        self._entries.move_to_end(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any):
+        self._discard(key)
+        size = self._sizeof(value)
+        self._entries[key] = (value, size, time.monotonic())
+        self._bytes += size
+        self._enforce_limits(keep=key)
+
+    def __delitem__(self, key: Hashable):
+        if key not in self._entries:
+            raise KeyError(key)
+        self._discard(key)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """remove the entry without calling on_evict"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        self._discard(key)
+        return entry[0]
+
+    def refresh(self, key: Hashable):
+        """re-measure a value mutated in place, mark it as recently used and enforce the limits"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        value, old_size, _ = entry
+        size = self._sizeof(value)
+        self._bytes += size - old_size
+        self._entries[key] = (value, size, time.monotonic())
+        self._entries.move_to_end(key)
+        self._enforce_limits(keep=key)
+
+    def evict_idle(self) -> int:
+        """evict the entries idle for longer than idle_ttl_seconds, return how many were evicted"""
+        if self.idle_ttl_seconds is None:
+            return 0
+        deadline = time.monotonic() - self.idle_ttl_seconds
+        evicted = 0
+        # entries are in LRU order, stop at the first one that is still fresh
+        while self._entries:
+            key, (_, _, last_access) = next(iter(self._entries.items()))
+            if last_access > deadline:
+                break
+            self._evict(key, "idle")
+            evicted += 1
+        return evicted
+
+    def _enforce_limits(self, keep: Hashable):
+        # never evict the entry being written, even if it alone exceeds the byte cap
+        while self.max_entries is not None and len(self._entries) > max(self.max_entries, 1):
+            self._evict(self._oldest_except(keep), "capacity")
+        while self.max_bytes is not None and self._bytes > self.max_bytes and len(self._entries) > 1:
+            self._evict(self._oldest_except(keep), "bytes")
+
+    def _oldest_except(self, keep: Hashable) -> Hashable:
+        for key in self._entries:
+            if key != keep:
+                return key
+        return keep
+
+    def _discard(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def _evict(self, key: Hashable, reason: str):
+        value = self._entries[key][0]
+        self._discard(key)
+        self.evictions[reason] += 1
+        log.debug(f"Evicted {self.name} entry {key} ({reason}).")
+        if self._on_evict is not None:
+            try:
+                self._on_evict(key, value)
+            except Exception as e:
+                log.error(f"Failed to handle eviction of {self.name} entry {key}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """return the resident-set size and the eviction counters"""
+        return {
+            "entries": len(self._entries),
+            "estimated_bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "evictions": dict(self.evictions)
+        }
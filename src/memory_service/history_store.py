@@ -0,0 +1,159 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List
+
+from src import setup_logger
+
+log = setup_logger(__name__)
+
+_STOP = object()
+
+class HistoryStore:
+    """
+    Durable, write-behind store for the short-term conversation history.
+    Writes are queued and committed by a single writer thread in batched SQLite (WAL) transactions,
+    so the reply path never waits on disk. Loads go through the same queue, which guarantees they
+    observe every write enqueued before them. Each user keeps at most `max_history_length` rows,
+    matching the in-memory deque, plus the rolling summary of the older conversation.
+    """
+
+    def __init__(self, path: str, max_history_length: int = 20, flush_interval: float = 0.5, max_batch_size: int = 256):
+        self.path = path
+        self.max_history_length = max_history_length
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")       # WAL + NORMAL: durable across crashes of the process, only fsync at checkpoints
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, "
+            "role TEXT NOT NULL, content TEXT NOT NULL, timestamp TEXT)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS messages_user ON messages (user_id, seq)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS summaries (user_id TEXT PRIMARY KEY, summary TEXT NOT NULL)")
+        self._db.commit()
+
+        self._queue: queue.Queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="history-store-writer", daemon=True)
+        self._writer.start()
+        log.info(f"Short-term history store opened at {path}.")
+
+    def append(self, user_id: str, message: Dict[str, str]):
+        """queue a message to be appended to the user's history"""
+        self._queue.put(("append", user_id, message))
+
+    def replace(self, user_id: str, messages: List[Dict[str, str]]):
+        """queue a replacement of the user's whole history (e.g. after summarization)"""
+        self._queue.put(("replace", user_id, list(messages)))
+
+    def clear(self, user_id: str):
+        """queue the deletion of the user's history"""
+        self._queue.put(("replace", user_id, []))
+
+    def set_summary(self, user_id: str, summary: str):
+        """queue an update of the user's rolling summary"""
+        self._queue.put(("summary", user_id, summary))
+
+    def load(self, user_id: str) -> Future:
+        """
+        Load the user's history (oldest first).
+        Returns a concurrent Future resolved by the writer thread, await it with asyncio.wrap_future.
+        """
+        future = Future()
+        self._queue.put(("load", user_id, future))
+        return future
+
+    def load_summary(self, user_id: str) -> Future:
+        """load the user's rolling summary (None if there is none), same contract as load()"""
+        future = Future()
+        self._queue.put(("load_summary", user_id, future))
+        return future
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            # collect more writes for one transaction, but never delay a load or the shutdown
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch_size and batch[-1] is not _STOP and not batch[-1][0].startswith("load"):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            stop = batch[-1] is _STOP
+            self._apply([op for op in batch if op is not _STOP])
+            if stop:
+                return
+
+    def _write(self, writes: list):
+        touched = set()
+        with self._db:
+            for kind, user_id, payload in writes:
+                if kind == "append":
+                    self._db.execute(
+                        "INSERT INTO messages (user_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+                        (user_id, payload["role"], payload["content"], payload.get("timestamp"))
+                    )
+                    touched.add(user_id)
+                elif kind == "replace":
+                    self._db.execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
+                    self._db.executemany(
+                        "INSERT INTO messages (user_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+                        [(user_id, msg["role"], msg["content"], msg.get("timestamp")) for msg in payload]
+                    )
+                    touched.add(user_id)
+                elif kind == "summary":
+                    self._db.execute("INSERT OR REPLACE INTO summaries (user_id, summary) VALUES (?, ?)", (user_id, payload))
+
+            # keep the same bound as the in-memory deque
+            for user_id in touched:
+                self._db.execute(
+                    "DELETE FROM messages WHERE user_id = ? AND seq NOT IN "
+                    "(SELECT seq FROM messages WHERE user_id = ? ORDER BY seq DESC LIMIT ?)",
+                    (user_id, user_id, self.max_history_length)
+                )
+
+    def _apply(self, batch: list):
+        writes = [op for op in batch if not op[0].startswith("load")]
+        loads = [op for op in batch if op[0].startswith("load")]
+        try:
+            self._write(writes)
+        except Exception as e:
+            log.error(f"Failed to write {len(writes)} short-term history operations: {e}", exc_info=True)
+
+        for kind, user_id, future in loads:
+            try:
+                if kind == "load_summary":
+                    row = self._db.execute("SELECT summary FROM summaries WHERE user_id = ?", (user_id,)).fetchone()
+                    future.set_result(row[0] if row else None)
+                    continue
+                rows = self._db.execute(
+                    "SELECT role, content, timestamp FROM messages WHERE user_id = ? ORDER BY seq DESC LIMIT ?",
+                    (user_id, self.max_history_length)
+                ).fetchall()
+                future.set_result([{"role": role, "content": content, "timestamp": timestamp} for role, content, timestamp in reversed(rows)])
+            except Exception as e:
+                future.set_exception(e)
+
+    def pending(self) -> int:
+        """return the number of queued operations not yet written"""
+        return self._queue.qsize()
+
+    def close(self):
+        """flush the queued writes and close the database"""
+        if not self._writer.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._writer.join()
+        self._db.close()
+        log.info("Short-term history store closed.")
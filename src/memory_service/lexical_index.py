@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import math
+import os
+import re
+import sqlite3
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Tuple
+
+from src import setup_logger
+
+log = setup_logger(__name__)
+
+# runs of CJK characters (no spaces between words) or of letters/digits
+_TOKEN_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+|[^\W_]+")
+_CJK_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]")
+MAX_QUERY_TERMS = 64
+
+def tokenize(text: str) -> List[str]:
+    """lowercased words and numbers; CJK runs are split into overlapping bigrams since they have no word boundaries"""
+    tokens = []
+    for run in _TOKEN_PATTERN.findall(text.lower()):
+        if _CJK_PATTERN.match(run) and len(run) > 1:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+class LexicalIndex:
+    """
+    Per-user BM25 inverted index of the long-term memories, persisted in SQLite.
+    It complements the embedding search with exact matches on names, dates and rare terms.
+    Documents are identified by a hash of (user_id, text), so adding the same memory twice is a no-op.
+    All database access runs on a single worker thread, off the event loop.
+    """
+
+    def __init__(self, path: str, k1: float = 1.2, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lexical-index")
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS docs (doc_id TEXT PRIMARY KEY, user_id TEXT NOT NULL, text TEXT NOT NULL, length INTEGER NOT NULL)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS postings (user_id TEXT NOT NULL, term TEXT NOT NULL, doc_id TEXT NOT NULL, tf INTEGER NOT NULL, "
+            "PRIMARY KEY (user_id, term, doc_id)) WITHOUT ROWID"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS users (user_id TEXT PRIMARY KEY, n_docs INTEGER NOT NULL, total_length INTEGER NOT NULL)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._db.commit()
+        log.info(f"Lexical memory index opened at {path}.")
+
+    async def _run(self, fn, *args):
+        return await asyncio.wrap_future(self._executor.submit(fn, *args))
+
+    @staticmethod
+    def _doc_id(user_id: str, text: str) -> str:
+        return hashlib.sha256(f"{user_id}\0{text}".encode("utf-8")).hexdigest()
+
+    def _add_many(self, items: List[Tuple[str, str]]) -> int:
+        added = 0
+        with self._db:
+            for user_id, text in items:
+                doc_id = self._doc_id(user_id, text)
+                terms = Counter(tokenize(text))
+                cursor = self._db.execute(
+                    "INSERT OR IGNORE INTO docs (doc_id, user_id, text, length) VALUES (?, ?, ?, ?)",
+                    (doc_id, user_id, text, sum(terms.values()))
+                )
+                if cursor.rowcount == 0:
+                    continue                # already indexed
+                self._db.executemany(
+                    "INSERT INTO postings (user_id, term, doc_id, tf) VALUES (?, ?, ?, ?)",
+                    [(user_id, term, doc_id, tf) for term, tf in terms.items()]
+                )
+                self._db.execute(
+                    "INSERT INTO users (user_id, n_docs, total_length) VALUES (?, 1, ?) "
+                    "ON CONFLICT (user_id) DO UPDATE SET n_docs = n_docs + 1, total_length = total_length + excluded.total_length",
+                    (user_id, sum(terms.values()))
+                )
+                added += 1
+        return added
+
+    def _remove(self, user_id: str, text: str) -> bool:
+        doc_id = self._doc_id(user_id, text)
+        with self._db:
+            row = self._db.execute("SELECT length FROM docs WHERE doc_id = ?", (doc_id,)).fetchone()
+            if row is None:
+                return False
+            self._db.execute("DELETE FROM docs WHERE doc_id = ?", (doc_id,))
+            self._db.execute("DELETE FROM postings WHERE user_id = ? AND doc_id = ?", (user_id, doc_id))
+            self._db.execute(
+                "UPDATE users SET n_docs = n_docs - 1, total_length = total_length - ? WHERE user_id = ?",
+                (row[0], user_id)
+            )
+        return True
+
+    def _search(self, user_id: str, query: str, n_results: int, min_score: float) -> List[str]:
+        terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+        user = self._db.execute("SELECT n_docs, total_length FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if not terms or not user:
+            return []
+        n_docs, total_length = user
+        avg_length = total_length / n_docs if n_docs else 1.0
+
+        rows = self._db.execute(
+            "SELECT p.term, p.doc_id, p.tf, d.length FROM postings p JOIN docs d ON d.doc_id = p.doc_id "
+            f"WHERE p.user_id = ? AND p.term IN ({','.join('?' * len(terms))})",
+            (user_id, *terms)
+        ).fetchall()
+        document_frequency = Counter(term for term, _, _, _ in rows)
+        scores: Dict[str, float] = {}
+        for term, doc_id, tf, length in rows:
+            df = document_frequency[term]
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            norm = tf + self.k1 * (1 - self.b + self.b * length / avg_length)
+            scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+
+        top = [doc_id for doc_id in sorted(scores, key=scores.get, reverse=True)[:n_results] if scores[doc_id] >= min_score]
+        if not top:
+            return []
+        texts = dict(self._db.execute(f"SELECT doc_id, text FROM docs WHERE doc_id IN ({','.join('?' * len(top))})", top).fetchall())
+        return [texts[doc_id] for doc_id in top]
+
+    def _get_meta(self, key: str):
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: str):
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    async def add(self, user_id: str, text: str) -> bool:
+        """index a memory, return False if it was already indexed"""
+        return await self._run(self._add_many, [(user_id, text)]) == 1
+
+    async def add_many(self, items: Iterable[Tuple[str, str]]) -> int:
+        """index many (user_id, text) memories in one transaction, return the number newly indexed"""
+        return await self._run(self._add_many, list(items))
+
+    async def remove(self, user_id: str, text: str) -> bool:
+        """drop a memory from the index (e.g. one superseded by a near duplicate), return False if it was not indexed"""
+        return await self._run(self._remove, user_id, text)
+
+    async def search(self, user_id: str, query: str, n_results: int = 10, min_score: float = 0.0) -> List[str]:
+        """return the user's memory texts scoring at least min_score, ranked by BM25 score against the query (best first)"""
+        return await self._run(self._search, user_id, query, n_results, min_score)
+
+    async def is_backfilled(self) -> bool:
+        """whether the memories stored before the index existed have been indexed"""
+        return await self._run(self._get_meta, "backfilled") is not None
+
+    async def mark_backfilled(self):
+        await self._run(self._set_meta, "backfilled", "1")
+
+    def close(self):
+        """wait for the pending operations and close the database"""
+        self._executor.shutdown(wait=True)
+        self._db.close()
+        log.info("Lexical memory index closed.")
@@ -1,144 +1,420 @@
+import asyncio
+import re
+import sys
 from src import setup_logger
 from collections import deque
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional
 from src import AppConfig
 from src.llm import LLMServiceInterface
 from src.embedding import EmbeddingServiceInterface
-from src.vector_store import VectorStoreInterface
+from src.vector_store import VectorStoreInterface, MemorySearchResult
 
 from src.utils.i18n import get_translator
-from src.utils.core_utils import insert_timestamp, create_system_message
+from src.utils.core_utils import insert_timestamp, BACKGROUND
+from .summarization_scheduler import SummarizationScheduler
+from .history_store import HistoryStore
+from .bounded_user_map import BoundedUserMap
+from .lexical_index import LexicalIndex
 
 log = setup_logger(__name__)
 
+def _estimate_history_bytes(history: deque) -> int:
+    """rough resident size of a history deque and its messages"""
+    return sys.getsizeof(history) + sum(
+        sys.getsizeof(msg) + sum(sys.getsizeof(value) for value in msg.values()) for msg in history
+    )
+
+_SENTENCE_END = re.compile(r"[.!?\u3002\uff01\uff1f](?=\s|$)|[\u3002\uff01\uff1f]|\n")
+
+def truncate_at_sentence(text: str, max_chars: int) -> str:
+    """cut the text to at most max_chars, at the last sentence end (or else the last space) instead of mid-word"""
+    if len(text) <= max_chars:
+        return text
+    head = text[:max_chars]
+    ends = [match.end() for match in _SENTENCE_END.finditer(head)]
+    if ends and ends[-1] > max_chars // 2:
+        return head[:ends[-1]].rstrip()
+    space = head.rfind(" ")
+    return head[:space].rstrip() if space > max_chars // 2 else head
+
+def _drop_summarized(history: List[Dict[str, str]], segment: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """
+    remove the summarized segment from the front of the history; messages are compared by value, since a history
+    reloaded from disk holds new objects, and the oldest messages of the segment may already have been pushed out
+    """
+    for start in range(len(segment)):
+        remaining = segment[start:]
+        if history[:len(remaining)] == remaining:
+            return history[len(remaining):]
+    return history
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[str]:
+    """fuse several rankings of the same items, an item scores 1 / (k + rank) in every ranking it appears in"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
 class MemoryService:
-    def __init__(self, llm_service: LLMServiceInterface, embedding_service: EmbeddingServiceInterface, vector_store: VectorStoreInterface, config: AppConfig):
+    def __init__(self, llm_service: LLMServiceInterface, embedding_service: EmbeddingServiceInterface, vector_store: VectorStoreInterface, config: AppConfig, history_store_path: Optional[str] = None, lexical_index_path: Optional[str] = None):
         self.llm_service = llm_service
         self.embedding_service = embedding_service
         self.vector_store = vector_store
-        # Use a dictionary to store short-term memory for each user {user_id: deque}
-        self.short_term_memory: Dict[str, deque] = {}
-        self.temporary_chat_memory: Dict[str, deque] = {}   # for temporary chat mode
+        # Per-user state is kept in bounded maps {user_id: deque}, idle and least recently used users are evicted
+        limits = config.user_state_limits
+        self.short_term_memory = BoundedUserMap(
+            "short-term memory",
+            max_entries=limits["max_users"],
+            max_bytes=limits["max_history_bytes"],
+            idle_ttl_seconds=limits["idle_ttl_seconds"],
+            sizeof=_estimate_history_bytes,
+            on_evict=self._spill_history
+        )
+        self.temporary_chat_memory = BoundedUserMap(    # for temporary chat mode, never written to disk
+            "temporary chat memory",
+            max_entries=limits["max_users"],
+            max_bytes=limits["max_history_bytes"],
+            idle_ttl_seconds=limits["idle_ttl_seconds"],
+            sizeof=_estimate_history_bytes
+        )
         # Set the maximum length of short-term memory (number of conversation turns)
         # TODO The triggering mechanism needs further adjustment.
         self.max_history_length = 20  # For example, keep the last 10 conversation turns (user+bot)
         # Set the conversation length threshold to trigger summarization
         self.summarization_threshold = 16  # Trigger summarization when the conversation reaches 8 turns
-        # Number of memories to retrieve for RAG
+        # Number of most recent messages never summarized, and the size of the oldest segment summarized per call
+        self.keep_recent_n = 4
+        self.summarization_segment_size = self.summarization_threshold - self.keep_recent_n
+        # Maximum number of memories to retrieve for RAG, fewer (or none) are used when they are not relevant enough
         self.rag_n_results = 3
+        relevance = config.rag_relevance
+        self.max_distance = relevance["max_distance"]
+        self.max_distance_gap = relevance["max_distance_gap"]
+        self.min_lexical_score = relevance["min_lexical_score"]
+        # Optional durable backend of the short-term memory, histories are loaded lazily on the user's first message.
+        # With persistence disabled it can still receive the histories evicted from memory (spill), so they are not lost.
+        self.history_store: Optional[HistoryStore] = None
+        self._write_through = config.short_term_memory_store["persistent"]
+        if history_store_path and (self._write_through or limits["spill_evicted_histories"]):
+            self.history_store = HistoryStore(
+                history_store_path,
+                max_history_length=self.max_history_length,
+                flush_interval=config.short_term_memory_store["flush_interval"],
+                max_batch_size=config.short_term_memory_store["max_batch_size"]
+            )
+
+        # Optional lexical (BM25) index of the long-term memories, fused with the vector search results.
+        # Exact names, dates and rare terms are found even when the embedding similarity misses them.
+        self.lexical_index: Optional[LexicalIndex] = None
+        hybrid = config.hybrid_retrieval
+        self.rag_candidates = max(hybrid["candidates"], self.rag_n_results)  # results fetched from each retriever before fusion
+        self.rrf_k = hybrid["rrf_k"]
+        if lexical_index_path and hybrid["enabled"]:
+            self.lexical_index = LexicalIndex(lexical_index_path)
 
         # load config settings
         self.summarization_prompt = config.summarization_prompt
-        self.rag_prompt_prefix = config.rag_prompt_prefix
+        self.rolling_summary_max_chars = config.rolling_summary_max_chars
         
         self.lang = config.model_lang
         self.tr = get_translator()
         
-        # dynamic settings
-        self.use_temporary_chat: Dict[str, bool] = {}
+        # rolling summary of each user's already summarized conversation {user_id: summary}
+        self.rolling_summaries = BoundedUserMap(
+            "rolling summaries",
+            max_entries=limits["max_users"],
+            idle_ttl_seconds=limits["idle_ttl_seconds"],
+            on_evict=self._spill_summary
+        )
 
+        # dynamic settings, only users in temporary chat mode have an entry; when it idles out the mode ends
+        self.use_temporary_chat = BoundedUserMap(
+            "temporary chat mode",
+            max_entries=limits["max_users"],
+            idle_ttl_seconds=limits["idle_ttl_seconds"],
+            on_evict=lambda user_id, _: self.temporary_chat_memory.pop(user_id)
+        )
+        
+        # summarization runs in the background, off the reply path
+        self.summarization_scheduler = SummarizationScheduler(self.check_and_summarize, max_concurrency=config.summarization_max_concurrency)
 
-    def _get_user_memory(self, user_id: str) -> deque:
-        """get or create the specified user's short-term memory deque"""
-        is_temporary_chat = self.use_temporary_chat.get(user_id, False)
+
+    def _spill_history(self, user_id: str, history: deque):
+        """eviction hook of the short-term memory, a spilled history is loaded again on the user's next message"""
+        if self.history_store is not None and not self._write_through:
+            self.history_store.replace(user_id, history)    # with write-through the store already holds the history
+
+    def evict_idle(self) -> int:
+        """evict the per-user state idle for longer than the configured TTL"""
+        return (
+            self.use_temporary_chat.evict_idle()
+            + self.short_term_memory.evict_idle()
+            + self.temporary_chat_memory.evict_idle()
+            + self.rolling_summaries.evict_idle()
+        )
+
+    def stats(self) -> dict:
+        """return the resident-set and eviction statistics of the per-user state"""
+        return {
+            "short_term_memory": self.short_term_memory.stats(),
+            "temporary_chat_memory": self.temporary_chat_memory.stats(),
+            "temporary_chat_mode": self.use_temporary_chat.stats(),
+            "rolling_summaries": self.rolling_summaries.stats(),
+            "history_store_pending": self.history_store.pending() if self.history_store is not None else 0,
+            "summarization": self.summarization_scheduler.stats()
+        }
+
+    async def _get_user_memory(self, user_id: str, temporary: Optional[bool] = None) -> deque:
+        """get or create the specified user's short-term memory deque (the one of the current chat mode unless `temporary` is given)"""
+        is_temporary_chat = self.use_temporary_chat.get(user_id, False) if temporary is None else temporary
         user_memory = self.temporary_chat_memory if is_temporary_chat else self.short_term_memory
 
         if user_id not in user_memory:
-            user_memory[user_id] = deque(maxlen=self.max_history_length)
-            kind = "short-term" if not is_temporary_chat else "temporary"
-            log.info(f"Initialized {kind} memory for user {user_id}.")
+            messages = []
+            if not is_temporary_chat and self.history_store is not None:
+                try:
+                    messages = await asyncio.wrap_future(self.history_store.load(user_id))
+                except Exception as e:
+                    log.error(f"Failed to load short-term memory of user {user_id}: {e}")
+            if user_id not in user_memory:     # not initialized by another task while loading
+                user_memory[user_id] = deque(messages, maxlen=self.max_history_length)
+                kind = "short-term" if not is_temporary_chat else "temporary"
+                log.info(f"Initialized {kind} memory for user {user_id} with {len(messages)} stored messages.")
         return user_memory[user_id]
 
     async def add_message(self, user_id: str, role: str, content: str, timestamp: str = None):
         """add a message to the short-term memory and trigger summarization check"""
-        user_memory = self._get_user_memory(user_id)
-        user_memory.append({"role": role, "content": content, "timestamp": timestamp})
+        user_memory = await self._get_user_memory(user_id)
+        message = {"role": role, "content": content, "timestamp": timestamp}
+        user_memory.append(message)
+        is_temporary_chat = self.use_temporary_chat.get(user_id, False)
+        if is_temporary_chat:
+            self.temporary_chat_memory.refresh(user_id)
+        else:
+            self.short_term_memory.refresh(user_id)
+            if self._write_through and self.history_store is not None:
+                self.history_store.append(user_id, message)     # write-behind, the reply path does not wait on disk
         log.debug(f"Added message to short-term memory for user {user_id}. New length: {len(user_memory)}")
-        if not self.use_temporary_chat.get(user_id, False):
-            await self.check_and_summarize(user_id) # Check if summarization is needed after adding the message
+        if not is_temporary_chat and len(user_memory) >= self.summarization_threshold:
+            self.summarization_scheduler.schedule(user_id) # Summarize in the background, the reply path does not wait for it
 
-    def get_history(self, user_id: str) -> List[Dict[str, str]]:
+    async def get_history(self, user_id: str) -> List[Dict[str, str]]:
         """get the current short-term history record of the user"""
-        user_memory = self._get_user_memory(user_id)
+        user_memory = await self._get_user_memory(user_id)
         return list(user_memory)
 
-    # TODO This function's mechanism still needs significant optimization
+    async def _get_rolling_summary(self, user_id: str) -> Optional[str]:
+        """get the rolling summary of the already summarized conversation, loaded lazily from the history store"""
+        if user_id not in self.rolling_summaries:
+            summary = None
+            if self.history_store is not None:
+                try:
+                    summary = await asyncio.wrap_future(self.history_store.load_summary(user_id))
+                except Exception as e:
+                    log.error(f"Failed to load rolling summary of user {user_id}: {e}")
+            if user_id not in self.rolling_summaries:
+                self.rolling_summaries[user_id] = summary
+        return self.rolling_summaries.get(user_id)
+
+    def _spill_summary(self, user_id: str, summary: Optional[str]):
+        """eviction hook of the rolling summaries, same policy as _spill_history"""
+        if summary and self.history_store is not None and not self._write_through:
+            self.history_store.set_summary(user_id, summary)
+
+    async def get_summary_context(self, user_id: str) -> Optional[str]:
+        """the rolling summary of the conversation before the short-term history, formatted for the generation prompt"""
+        if self.use_temporary_chat.get(user_id, False):
+            return None
+        summary = await self._get_rolling_summary(user_id)
+        return self.tr.t(self.lang, 'prompt.previous_summary', summary=summary) if summary else None
+
+    async def _extend_rolling_summary(self, user_id: str, segment_summary: str) -> str:
+        """append a segment summary to the rolling summary, condensing it once it outgrows rolling_summary_max_chars"""
+        previous_summary = await self._get_rolling_summary(user_id)
+        rolling_summary = f"{previous_summary}\n{segment_summary}" if previous_summary else segment_summary
+        if len(rolling_summary) <= self.rolling_summary_max_chars:
+            return rolling_summary
+
+        condensed = await self.llm_service.summarize_conversation(
+            self.tr.t(self.lang, 'prompt.previous_summary', summary=rolling_summary), self.summarization_prompt
+        )
+        if condensed and len(condensed) < len(rolling_summary):
+            return truncate_at_sentence(condensed, self.rolling_summary_max_chars)
+        # condensing failed: forget the oldest segments first
+        log.warning(f"Could not condense the rolling summary of user {user_id}, dropping its oldest part.")
+        lines = rolling_summary.split("\n")
+        while len(lines) > 1 and len("\n".join(lines)) > self.rolling_summary_max_chars:
+            lines.pop(0)
+        return truncate_at_sentence("\n".join(lines), self.rolling_summary_max_chars)
+
     async def check_and_summarize(self, user_id: str):
-        """check the conversation length and summarize if needed"""
-        user_memory = list(self._get_user_memory(user_id))
-        if len(user_memory) >= self.summarization_threshold:
-            log.info(f"Summarization threshold reached for user {user_id}. Current length: {len(user_memory)}")
-
-            # Extract the part that needs summarizing (e.g., all dialogue except the most recent turns)
-            # This simply summarizes the entire current deque and then replaces the old one.
-            # A more optimized method would be to only summarize the oldest part.
-            history_to_summarize = insert_timestamp(user_memory, self.tr.t(self.lang, 'prompt.timestamp_format'))
-            history_text = "\n".join([f"{msg['role']}: {msg['content']}" for msg in history_to_summarize])
-
-            summary = await self.llm_service.summarize_conversation(history_text, self.summarization_prompt)
-
-            if summary:
-                log.info(f"Generated summary for user {user_id}: {summary[:100]}...")
-                # 1. Store the summary in long-term memory (vector database)
-                summary_embedding = await self.embedding_service.get_embedding(summary)
-                if summary_embedding:
-                    await self.vector_store.add_memory(user_id, self.tr.t(self.lang, 'prompt.conversation_summary', summary=summary), summary_embedding)
-                    log.debug(f"Summary stored in vector store for user {user_id}.")
-
-                # 2. Update short-term memory: Keep the summary and the most recent turns
-                # For example, keep the summary and the most recent 4 turns of conversation
-                keep_recent_n = 4
-                new_memory = deque(maxlen=self.max_history_length)
-                # TODO: Re-evaluate the use of summary as mid-term memory.
-                # TODO: The current approach conflicts with the insert_timestamp function.
-                # TODO: Exception handling could solve this timestamp conflict.
-                # TODO: However, adding a system role prompt to the history is not a wise choice.
-                # TODO: Therefore, the original intention is temporarily commented out.
-                # new_memory.append(create_system_message(f"Previous conversation summary: {summary}"))  # Add the summary as a system message
-                if len(user_memory) > keep_recent_n:
-                    for msg in user_memory[-keep_recent_n:]:
-                        new_memory.append(msg)
-                else: # If history length is less than keep_recent_n, keep all
-                     for msg in user_memory:
-                        new_memory.append(msg)
-
-
-                self.short_term_memory[user_id] = new_memory
-                log.info(f"Short-term memory updated with summary for user {user_id}. New length: {len(new_memory)}")
-            else:
-                log.warning(f"Failed to generate summary for user {user_id}. Short-term memory not modified by summarization.")
+        """
+        Summarize the oldest unsummarized segment of the conversation once the threshold is reached.
+        Only the summary of the new segment is stored as a long-term memory, so memories do not repeat each
+        other; it is also appended to the user's rolling summary of the whole conversation, which is kept
+        in the history store and given to the generation prompt.
+        """
+        # snapshot the persistent short-term memory (not the temporary one, the user may have switched mode since scheduling)
+        user_memory = list(self.short_term_memory.get(user_id, ()))
+        if len(user_memory) < self.summarization_threshold:
+            return
+        log.info(f"Summarization threshold reached for user {user_id}. Current length: {len(user_memory)}")
 
+        # only the oldest part is summarized, the most recent turns stay verbatim in the short-term memory
+        segment = user_memory[:min(len(user_memory) - self.keep_recent_n, self.summarization_segment_size)]
+        history_to_summarize = insert_timestamp(segment, self.tr.t(self.lang, 'prompt.timestamp_format'))
+        history_text = "\n".join([f"{msg['role']}: {msg['content']}" for msg in history_to_summarize])
 
-    async def retrieve_relevant_memories(self, user_id: str, query: str) -> Optional[str]:
-        """retrieve and format the relevant memories based on the current query"""
-        log.debug(f"Retrieving relevant memories for user {user_id} based on query: {query[:50]}...")
-        query_embedding = await self.embedding_service.get_embedding(query)
+        summary = await self.llm_service.summarize_conversation(history_text, self.summarization_prompt)
+        if not summary:
+            log.warning(f"Failed to generate summary for user {user_id}. Short-term memory not modified by summarization.")
+            return
+        summary = truncate_at_sentence(summary, self.rolling_summary_max_chars)
+        log.info(f"Generated summary for user {user_id}: {summary[:100]}...")
+
+        # 1. Store the summary of the segment in long-term memory (vector database and lexical index)
+        memory_text = self.tr.t(self.lang, 'prompt.conversation_summary', summary=summary)
+        summary_embedding = await self.embedding_service.get_embedding(summary, priority=BACKGROUND)
+        stored = False
+        if summary_embedding:
+            stored = await self.vector_store.add_memory(user_id, memory_text, summary_embedding)
+            log.debug(f"Summary {'stored in' if stored else 'not written to'} vector store for user {user_id}.")
+        # a summary skipped as a near duplicate is not indexed either, one without embedding stays searchable lexically;
+        # the memory a summary replaced as a near duplicate leaves the lexical index too
+        if self.lexical_index is not None and (stored or not summary_embedding):
+            try:
+                if stored and stored.replaced:
+                    await self.lexical_index.remove(user_id, stored.replaced)
+                await self.lexical_index.add(user_id, memory_text)
+            except Exception as e:
+                log.error(f"Failed to index summary of user {user_id} in the lexical index: {e}")
+
+        # 2. Extend the rolling summary of the whole conversation
+        rolling_summary = await self._extend_rolling_summary(user_id, summary)
+        self.rolling_summaries[user_id] = rolling_summary
+        if self._write_through and self.history_store is not None:
+            self.history_store.set_summary(user_id, rolling_summary)
+
+        # 3. Drop the summarized segment from the short-term memory, keeping what arrived while the summary was in flight;
+        # the history may have been evicted and spilled meanwhile, it is then reloaded rather than overwritten
+        current_memory = list(await self._get_user_memory(user_id, temporary=False))
+        new_memory = deque(_drop_summarized(current_memory, segment), maxlen=self.max_history_length)
+        self.short_term_memory[user_id] = new_memory
+        if self._write_through and self.history_store is not None:
+            self.history_store.replace(user_id, new_memory)
+        log.info(f"Short-term memory updated with summary for user {user_id}. New length: {len(new_memory)}")
+
+
+    def _filter_relevant(self, results: List[MemorySearchResult]) -> List[MemorySearchResult]:
+        """
+        Keep the results within max_distance, and stop at the first sharp gap in distance:
+        the memories after it are much less related to the query than the ones before.
+        """
+        kept = []
+        for result in sorted(results, key=lambda r: r.distance):
+            if self.max_distance is not None and result.distance > self.max_distance:
+                break
+            if kept and self.max_distance_gap is not None and result.distance - kept[-1].distance > self.max_distance_gap:
+                break
+            kept.append(result)
+        return kept
+
+    async def _vector_search(self, user_id: str, query: str, n_results: int) -> List[str]:
+        query_embedding = await self.embedding_service.get_query_embedding(query)
         if not query_embedding:
             log.warning(f"Could not get embedding for query for user {user_id}.")
-            return None
+            return []
+        results = await self.vector_store.search_memory(user_id, query_embedding, n_results=n_results)
+        relevant = self._filter_relevant(results)
+        log.debug(f"Vector search for user {user_id}: {len(relevant)}/{len(results)} results relevant, distances {[round(r.distance, 3) for r in results]}")
+        return [result.document for result in relevant]
+
+    async def _lexical_search(self, user_id: str, query: str, n_results: int) -> List[str]:
+        try:
+            return await self.lexical_index.search(user_id, query, n_results=n_results, min_score=self.min_lexical_score)
+        except Exception as e:
+            log.error(f"Lexical memory search failed for user {user_id}: {e}")
+            return []
+
+    def _in_rolling_summary(self, document: str, rolling_summary: str) -> bool:
+        """whether the memory is a segment summary the rolling summary still holds verbatim (not yet condensed)"""
+        prefix, _, suffix = self.tr.t(self.lang, 'prompt.conversation_summary', summary="\0").partition("\0")
+        if not (document.startswith(prefix) and document.endswith(suffix)) or len(document) <= len(prefix) + len(suffix):
+            return False
+        return document[len(prefix):len(document) - len(suffix)] in rolling_summary
 
-        relevant_docs = await self.vector_store.search_memory(user_id, query_embedding, n_results=self.rag_n_results)
+    async def retrieve_relevant_memories(self, user_id: str, query: str) -> Optional[List[str]]:
+        """
+        retrieve the relevant memories (most relevant first) based on the current query, formatting is left to the LLM service;
+        None when nothing is relevant enough, so the prompt carries no RAG block
+        """
+        log.debug(f"Retrieving relevant memories for user {user_id} based on query: {query[:50]}...")
+        # segment summaries still in the rolling summary are already in the prompt (get_summary_context)
+        rolling_summary = None if self.use_temporary_chat.get(user_id, False) else await self._get_rolling_summary(user_id)
+        if self.lexical_index is None:
+            n_results = self.rag_candidates if rolling_summary else self.rag_n_results
+            relevant_docs = await self._vector_search(user_id, query, n_results)
+        else:
+            # both retrievers run concurrently, their rankings are fused by reciprocal rank
+            vector_docs, lexical_docs = await asyncio.gather(
+                self._vector_search(user_id, query, self.rag_candidates),
+                self._lexical_search(user_id, query, self.rag_candidates)
+            )
+            relevant_docs = reciprocal_rank_fusion([vector_docs, lexical_docs], k=self.rrf_k)
+        if rolling_summary:
+            relevant_docs = [doc for doc in relevant_docs if not self._in_rolling_summary(doc, rolling_summary)]
+        relevant_docs = relevant_docs[:self.rag_n_results]
 
         if relevant_docs:
-            # log.info(f"Found {len(relevant_docs)} relevant memories for user {user_id}.")
-            # Format the retrieved documents as RAG context
-            context = "\n".join([f"- {doc}" for doc in relevant_docs])
-            formatted_rag_context = self.rag_prompt_prefix.format(relevant_memories=context)
-            log.debug(f"Formatted RAG context for user {user_id}: {formatted_rag_context[:100]}...")
-            return formatted_rag_context
+            log.debug(f"Found {len(relevant_docs)} relevant memories for user {user_id}.")
+            return relevant_docs
         else:
             # log.info(f"No relevant memories found for user {user_id}.")
             return None
         
+    async def backfill_lexical_index(self, page_size: int = 500) -> int:
+        """index the memories stored in the vector store before the lexical index existed, once"""
+        if self.lexical_index is None or await self.lexical_index.is_backfilled():
+            return 0
+        log.info("Backfilling the lexical memory index from the vector store.")
+        indexed = 0
+        offset = 0
+        while True:
+            page = await self.vector_store.get_page(offset, page_size)
+            if not page["ids"]:
+                break
+            indexed += await self.lexical_index.add_many(
+                (metadata["user_id"], document)
+                for document, metadata in zip(page["documents"], page["metadatas"])
+                if document and metadata and metadata.get("user_id")
+            )
+            offset += len(page["ids"])
+        await self.lexical_index.mark_backfilled()
+        log.info(f"Lexical memory index backfilled with {indexed} memories.")
+        return indexed
+
     def temporary_chat_mode(self, user_id: str, state: bool):
         """set the temporary chat mode state for a specific user and clear temporary history if exiting"""
         log.info(f"Setting temporary chat mode for user {user_id} to {state}")
-        self.use_temporary_chat[user_id] = state # Update the user's state
-        
-        if not state:
+        if state:
+            self.use_temporary_chat[user_id] = True # Update the user's state
+        else:
+            self.use_temporary_chat.pop(user_id)
             if user_id in self.temporary_chat_memory:
                 del self.temporary_chat_memory[user_id] # Clear the temporary chat memory
                 log.info(f"Cleared temporary chat memory for user {user_id}")
             else:
                 log.debug(f"User {user_id} exited temporary mode, but no temporary history was found to clear.")
-    
\ No newline at end of file
+
+    async def close(self):
+        """stop the background workers of the memory service and flush the short-term memory to disk"""
+        await self.summarization_scheduler.stop()
+        if self.history_store is not None:
+            for user_id in self.short_term_memory:
+                self._spill_history(user_id, self.short_term_memory.pop(user_id))
+            for user_id in self.rolling_summaries:
+                self._spill_summary(user_id, self.rolling_summaries.pop(user_id))
+            await asyncio.to_thread(self.history_store.close)
+        if self.lexical_index is not None:
+            await asyncio.to_thread(self.lexical_index.close)
\ No newline at end of file
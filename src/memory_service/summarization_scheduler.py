@@ -0,0 +1,84 @@
+import asyncio
+from typing import Awaitable, Callable, List, Optional, Set
+
+from src import setup_logger
+
+log = setup_logger(__name__)
+
+class SummarizationScheduler:
+    """
+    Background summarization worker pool fed by a queue.
+    Jobs are coalesced per user (at most one queued or running job per user), and the number of
+    workers bounds how many summarizations run at the same time across all users.
+    """
+
+    def __init__(self, summarize: Callable[[str], Awaitable[None]], max_concurrency: int = 2):
+        self._summarize = summarize
+        self.max_concurrency = max_concurrency
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._pending: Set[str] = set()     # users waiting in the queue
+        self._active: Set[str] = set()      # users being summarized right now
+        self._rerun: Set[str] = set()       # users scheduled again while their job was running
+
+    def _ensure_started(self):
+        if self._workers:
+            return
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.max_concurrency)]
+        log.info(f"Summarization scheduler started with {self.max_concurrency} workers.")
+
+    def schedule(self, user_id: str):
+        """request a summarization check for the user, duplicate requests are coalesced"""
+        self._ensure_started()
+        if user_id in self._pending:
+            return
+        if user_id in self._active:
+            self._rerun.add(user_id)        # run once more after the current job, with the messages that arrived meanwhile
+            return
+        self._pending.add(user_id)
+        self._queue.put_nowait(user_id)
+        log.debug(f"Summarization scheduled for user {user_id}. Queue size: {self._queue.qsize()}")
+
+    async def _worker(self, worker_id: int):
+        while True:
+            user_id = await self._queue.get()
+            self._pending.discard(user_id)
+            self._active.add(user_id)
+            try:
+                await self._summarize(user_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f"Summarization worker {worker_id} failed for user {user_id}: {e}", exc_info=True)
+            finally:
+                self._active.discard(user_id)
+                self._queue.task_done()
+            if user_id in self._rerun:
+                self._rerun.discard(user_id)
+                self.schedule(user_id)
+
+    def stats(self) -> dict:
+        """return the queue depth and the number of running jobs"""
+        return {
+            "queued": len(self._pending),
+            "running": len(self._active),
+            "max_concurrency": self.max_concurrency
+        }
+
+    async def join(self):
+        """wait until every queued summarization has finished"""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def stop(self):
+        """cancel the workers, queued jobs are dropped"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+        self._pending.clear()
+        self._active.clear()
+        self._rerun.clear()
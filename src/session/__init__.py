@@ -0,0 +1 @@
+from .user_session import UserSession, SessionManager
\ No newline at end of file
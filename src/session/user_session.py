@@ -0,0 +1,61 @@
+import asyncio
+import time
+from typing import Dict
+
+from src import setup_logger
+
+log = setup_logger(__name__)
+
+class UserSession:
+    """
+    Per-user conversation state.
+    Holds the user's dynamic settings and a lock that serializes the processing of the user's messages.
+    """
+    __slots__ = ("user_id", "temperature", "use_search", "lock", "last_active")
+
+    def __init__(self, user_id: str, temperature: float, use_search: bool = False):
+        self.user_id = user_id
+        self.temperature = temperature
+        self.use_search = use_search
+        self.lock = asyncio.Lock()          # asyncio.Lock is FIFO, so messages are handled in arrival order
+        self.last_active = time.monotonic()
+
+    def touch(self):
+        """mark the session as active now"""
+        self.last_active = time.monotonic()
+
+    def is_idle(self, idle_timeout_seconds: float) -> bool:
+        return not self.lock.locked() and time.monotonic() - self.last_active >= idle_timeout_seconds
+
+class SessionManager:
+    """
+    Creates user sessions on demand and drops the ones idle for longer than `idle_timeout_seconds`.
+    A reaped session falls back to the default settings the next time the user shows up.
+    """
+
+    def __init__(self, default_temperature: float, idle_timeout_seconds: float = 21600):
+        self.default_temperature = default_temperature
+        self.idle_timeout_seconds = idle_timeout_seconds
+        self._sessions: Dict[str, UserSession] = {}
+
+    def get(self, user_id: str) -> UserSession:
+        """get or create the session of the user"""
+        session = self._sessions.get(user_id)
+        if session is None:
+            session = UserSession(user_id, self.default_temperature)
+            self._sessions[user_id] = session
+            log.debug(f"Created session for user {user_id}. Active sessions: {len(self._sessions)}")
+        session.touch()
+        return session
+
+    def reap_idle(self) -> int:
+        """remove idle sessions (never one that is processing a message), return how many were removed"""
+        idle_user_ids = [user_id for user_id, session in self._sessions.items() if session.is_idle(self.idle_timeout_seconds)]
+        for user_id in idle_user_ids:
+            del self._sessions[user_id]
+        if idle_user_ids:
+            log.info(f"Reaped {len(idle_user_ids)} idle sessions. Active sessions: {len(self._sessions)}")
+        return len(idle_user_ids)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
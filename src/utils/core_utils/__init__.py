@@ -1,3 +1,7 @@
 from .discord_utils import get_localized_choices, get_localized_name_from_value
 from .memory_utils import insert_timestamp, create_system_message
-from .time_utils import timestamp_formatter
\ No newline at end of file
+from .time_utils import timestamp_formatter
+from .async_utils import run_stage
+from .delivery_utils import StreamingMessageDelivery
+from .rate_limit_utils import TokenBucket
+from .provider_utils import ProviderCallPolicy, CircuitOpenError, get_provider_policy, INTERACTIVE, BACKGROUND
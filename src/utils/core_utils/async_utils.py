@@ -0,0 +1,32 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Optional
+
+from src import setup_logger
+
+log = setup_logger(__name__)
+
+async def run_stage(stage_name: str, awaitable: Awaitable, timeout: Optional[float] = None, default: Any = None) -> Any:
+    """
+    Await a pipeline stage with a timeout, degrading to a default value instead of failing.
+
+    Args:
+        stage_name: Name of the stage, used for logging.
+        awaitable: The coroutine (or awaitable) that produces the stage result.
+        timeout: Maximum number of seconds to wait for the stage. None means no limit.
+        default: The value returned when the stage times out or raises.
+
+    Returns:
+        The stage result, or `default` if the stage timed out or failed.
+    """
+    start = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(awaitable, timeout=timeout)
+        log.debug(f"Stage '{stage_name}' finished in {(time.perf_counter() - start) * 1000:.1f} ms.")
+        return result
+    except asyncio.TimeoutError:
+        log.warning(f"Stage '{stage_name}' timed out after {timeout}s, continuing without it.")
+        return default
+    except Exception as e:
+        log.error(f"Stage '{stage_name}' failed, continuing without it: {e}", exc_info=True)
+        return default
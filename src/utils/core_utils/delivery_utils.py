@@ -0,0 +1,97 @@
+import time
+from typing import Optional
+
+import discord
+
+from src.log import setup_logger
+
+log = setup_logger(__name__)
+
+CODE_FENCE = "```"
+
+def _has_open_fence(text: str) -> bool:
+    """check if the text ends inside a markdown code block"""
+    return text.count(CODE_FENCE) % 2 == 1
+
+def _find_split(text: str, limit: int, min_index: int = 1) -> int:
+    """find the best split position (exclusive) not exceeding limit, preferring paragraph, line and word boundaries"""
+    fallback = None
+    for separator in ("\n\n", "\n", " "):
+        index = text.rfind(separator, min_index, limit)
+        if index == -1:
+            continue
+        if index + len(separator) >= limit // 2:       # do not waste more than half of a message for a nicer boundary
+            return index + len(separator)
+        fallback = fallback or index + len(separator)
+    return fallback or limit
+
+class StreamingMessageDelivery:
+    """
+    Deliver a streamed LLM response to Discord incrementally.
+    The first message is sent as soon as a markdown-safe boundary (a complete line) is available, then
+    the message is edited as text arrives (at most once per `edit_interval` seconds to respect rate limits).
+    When the text outgrows Discord's message limit, the message is finalized at a paragraph/line/word
+    boundary and a new message is started; open code blocks are closed and reopened across messages.
+    """
+
+    def __init__(self, target: discord.abc.Messageable, chunk_size: int = 2000, edit_interval: float = 1.0):
+        self.target = target
+        self.chunk_size = chunk_size - len(CODE_FENCE) - 1      # reserve room to close a code block
+        self.edit_interval = edit_interval
+
+        self.text = ""                  # complete response received so far
+        self.messages_sent = 0
+        self._committed = 0             # offset of the text already finalized in earlier messages
+        self._reopen_fence = False      # the current message continues a code block from the previous one
+        self._message: Optional[discord.Message] = None
+        self._shown = ""
+        self._last_render = 0.0
+
+    async def feed(self, fragment: str):
+        """append a streamed fragment and update Discord if the edit interval has elapsed"""
+        self.text += fragment
+        if time.monotonic() - self._last_render >= self.edit_interval:
+            await self._render(final=False)
+
+    async def finish(self) -> str:
+        """flush the remaining text and return the complete response"""
+        await self._render(final=True)
+        return self.text
+
+    async def _render(self, final: bool):
+        # only deliver complete lines while streaming, so markdown is never cut mid-token
+        end = len(self.text) if final else self.text.rfind("\n") + 1
+        if end <= self._committed:
+            return
+        self._last_render = time.monotonic()
+
+        # finalize full messages
+        while True:
+            prefix = CODE_FENCE + "\n" if self._reopen_fence else ""
+            segment = prefix + self.text[self._committed:end]
+            if len(segment) <= self.chunk_size:
+                break
+            cut = _find_split(segment, self.chunk_size, min_index=len(prefix) + 1)
+            piece = segment[:cut]
+            self._reopen_fence = _has_open_fence(piece)
+            if self._reopen_fence:
+                piece = piece.rstrip("\n") + "\n" + CODE_FENCE
+            await self._show(piece)
+            self._message = None        # the next piece goes into a new message
+            self._committed += cut - len(prefix)
+
+        # update the message in progress
+        display = segment
+        if _has_open_fence(display):
+            display = display.rstrip("\n") + "\n" + CODE_FENCE
+        await self._show(display)
+
+    async def _show(self, content: str):
+        if not content.strip() or content == self._shown and self._message is not None:
+            return
+        if self._message is None:
+            self._message = await self.target.send(content)
+            self.messages_sent += 1
+        else:
+            await self._message.edit(content=content)
+        self._shown = content
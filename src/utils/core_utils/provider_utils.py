@@ -0,0 +1,201 @@
+import asyncio
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+
+from src.log import setup_logger
+from .rate_limit_utils import TokenBucket
+
+log = setup_logger(__name__)
+
+T = TypeVar("T")
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = {"APIConnectionError", "APITimeoutError", "ConnectError", "ReadTimeout", "ConnectTimeout", "RemoteProtocolError"}
+
+class CircuitOpenError(Exception):
+    """raised without calling the provider while its circuit breaker is open"""
+
+def _status_code(error: Exception) -> Optional[int]:
+    for attr in ("status_code", "code", "status"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    """read the Retry-After header (seconds or HTTP date) of the error response, if any"""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def classify_provider_error(error: Exception) -> Tuple[bool, Optional[float]]:
+    """
+    Decide whether a provider error is worth retrying, without depending on any SDK.
+    Returns (retryable, retry_after_seconds).
+    """
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)) or type(error).__name__ in RETRYABLE_ERROR_NAMES:
+        return True, None
+    status = _status_code(error)
+    if status in RETRYABLE_STATUS_CODES:
+        return True, _retry_after_seconds(error)
+    return False, None
+
+class ProviderCallPolicy:
+    """
+    Rate limiting, retries and circuit breaking for the calls to one provider.
+    - A request bucket (and an optional token bucket) keeps the call rate under the provider quota;
+      up to `burst` requests may start at once, so simultaneous users are not spaced out by the refill rate.
+    - Background traffic (summaries, migrations) additionally goes through its own smaller bucket,
+      so it can never use up the budget of interactive replies.
+    - Retryable failures are retried with exponential backoff and full jitter, honouring Retry-After.
+    - After `failure_threshold` consecutive failures the circuit opens and calls fail fast for
+      `recovery_seconds`, then a single trial call decides whether it closes again.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: float = 60,
+        tokens_per_minute: Optional[float] = None,
+        burst: float = 10,
+        background_share: float = 0.5,
+        max_retries: int = 3,
+        base_delay: float = 1.0,
+        max_delay: float = 30.0,
+        failure_threshold: int = 5,
+        recovery_seconds: float = 30.0,
+        classify: Callable[[Exception], Tuple[bool, Optional[float]]] = classify_provider_error
+    ):
+        self.name = name
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.classify = classify
+
+        burst = max(1.0, min(burst, requests_per_minute))
+        self._requests = TokenBucket.per_minute(requests_per_minute, burst=burst)
+        self._background_requests = TokenBucket.per_minute(requests_per_minute * background_share, burst=max(1.0, burst * background_share))
+        self._tokens = TokenBucket.per_minute(tokens_per_minute, burst=tokens_per_minute) if tokens_per_minute else None
+
+        self._consecutive_failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self.stats_counters = {"calls": 0, "retries": 0, "failures": 0, "rejected": 0}
+
+    def _before_call(self, claim_trial: bool = True) -> bool:
+        """
+        check the circuit breaker, raise CircuitOpenError if the call must not be made.
+        returns whether this call claimed the half-open trial slot.
+        """
+        if self._opened_at is None:
+            return False
+        if time.monotonic() - self._opened_at < self.recovery_seconds or self._trial_in_flight:
+            self.stats_counters["rejected"] += 1
+            raise CircuitOpenError(f"{self.name} circuit is open after {self._consecutive_failures} consecutive failures")
+        if claim_trial:
+            self._trial_in_flight = True    # half-open: let one trial call through
+        return claim_trial
+
+    def _record(self, success: bool, trial: bool = False):
+        if trial:
+            self._trial_in_flight = False
+        if success:
+            if self._opened_at is not None:
+                log.info(f"{self.name} circuit closed.")
+            self._consecutive_failures = 0
+            self._opened_at = None
+            return
+        self._consecutive_failures += 1
+        self.stats_counters["failures"] += 1
+        if self._consecutive_failures >= self.failure_threshold:
+            if self._opened_at is None:
+                log.warning(f"{self.name} circuit opened after {self._consecutive_failures} consecutive failures.")
+            self._opened_at = time.monotonic()
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))     # full jitter
+
+    async def call(self, fn: Callable[[], Awaitable[T]], priority: str = INTERACTIVE, tokens: int = 0) -> T:
+        """
+        Call `fn` (a coroutine factory, called once per attempt) under the policy.
+        `tokens` is the estimated token usage of the request, charged to the token bucket.
+        The last error is re-raised when the call cannot succeed.
+        """
+        for attempt in range(self.max_retries + 1):
+            # fail fast while the circuit is open, but only claim the trial slot once the quota is acquired,
+            # so a call cancelled while waiting on a bucket can never leave the slot taken
+            self._before_call(claim_trial=False)
+            if priority == BACKGROUND:
+                await self._background_requests.acquire()
+            await self._requests.acquire()
+            if self._tokens is not None and tokens:
+                await self._tokens.acquire(tokens)
+            trial = self._before_call()
+
+            self.stats_counters["calls"] += 1
+            try:
+                result = await fn()
+            except asyncio.CancelledError:
+                if trial:
+                    self._trial_in_flight = False
+                raise
+            except Exception as e:
+                retryable, retry_after = self.classify(e)
+                if not retryable:
+                    if trial:
+                        self._trial_in_flight = False   # the provider answered, this is not an outage
+                    raise
+                self._record(False, trial)
+                if attempt >= self.max_retries or self._opened_at is not None:
+                    log.error(f"{self.name} call failed after {attempt + 1} attempts: {e}")
+                    raise
+                delay = self._backoff(attempt, retry_after)
+                self.stats_counters["retries"] += 1
+                log.warning(f"{self.name} call failed on attempt {attempt + 1} ({e}), retrying in {delay:.1f}s.")
+                await asyncio.sleep(delay)
+                continue
+            self._record(True, trial)
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        """return the call counters and the circuit state"""
+        return {
+            **self.stats_counters,
+            "circuit_open": self._opened_at is not None,
+            "consecutive_failures": self._consecutive_failures,
+            "available_requests": self._requests.available
+        }
+
+_policies: Dict[str, ProviderCallPolicy] = {}
+_policies_lock = threading.Lock()
+
+def get_provider_policy(name: str, settings: Optional[Dict[str, Any]] = None) -> ProviderCallPolicy:
+    """
+    Get the unique ProviderCallPolicy of a provider.
+    Services of the same provider share it (and therefore its quota); the settings of the first caller are used.
+    """
+    with _policies_lock:
+        if name not in _policies:
+            _policies[name] = ProviderCallPolicy(name, **(settings or {}))
+        return _policies[name]
@@ -0,0 +1,42 @@
+import asyncio
+import time
+
+class TokenBucket:
+    """
+    Asynchronous token bucket.
+    Holds up to `capacity` tokens and refills at `refill_rate` tokens per second;
+    `acquire` waits until enough tokens are available.
+    """
+
+    def __init__(self, capacity: float, refill_rate: float):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def per_minute(cls, amount: float, burst: float = None) -> "TokenBucket":
+        """create a bucket allowing `amount` tokens per minute, with an optional burst size"""
+        return cls(capacity=burst if burst is not None else max(1.0, amount / 60), refill_rate=amount / 60)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.refill_rate)
+        self._updated_at = now
+
+    async def acquire(self, tokens: float = 1.0):
+        """wait until `tokens` tokens are available and consume them"""
+        tokens = min(tokens, self.capacity)             # a request larger than the bucket would never be served
+        async with self._lock:                          # FIFO: waiters are served in arrival order
+            while True:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.refill_rate)
+
+    @property
+    def available(self) -> float:
+        self._refill()
+        return self._tokens
@@ -1 +1 @@
-from .reporter_utils import weather_period_reporter
\ No newline at end of file
+from .reporter_utils import weather_period_reporter, get_weather_reporter, WeatherPeriodReporter
\ No newline at end of file
@@ -1,4 +1,8 @@
+import asyncio
+import threading
+import time
 from datetime import datetime
+from typing import Dict, Optional, Tuple
 from zoneinfo import ZoneInfo
 import python_weather
 
@@ -7,27 +11,110 @@ from src import setup_logger
 
 log = setup_logger(__name__)
 
-async def weather_period_reporter(timezone, lang='en-us', location='New York'):
-    # 1. time period summary
-    tr = get_translator()
-    now = datetime.now(ZoneInfo(timezone))
-    h = now.hour
-    period = (
-        tr.t(lang, 'prompt.period.early') if 5 <= h < 8 else
-        tr.t(lang, 'prompt.period.morning') if 8 <= h < 12 else
-        tr.t(lang, 'prompt.period.afternoon') if 12 <= h < 18 else
-        tr.t(lang, 'prompt.period.evening') if 18 <= h < 20 else
-        tr.t(lang, 'prompt.period.night')
-    )
-
-    # 2. weather summary
-    async with python_weather.Client() as client:
-        # TODO setup locale based on location
+_reporter_instance = None
+_reporter_lock = threading.Lock()
+
+UNKNOWN_WEATHER = 'Unknown'
+
+class WeatherPeriodReporter:
+    """
+    Cached weather/period context provider.
+    Weather lookups are cached per (location, timezone, lang) for `ttl_seconds` and served stale
+    while a background refresh runs, so the live HTTP lookup stays off the reply path.
+    A single long-lived python_weather client is shared by all lookups.
+    """
+
+    def __init__(self, ttl_seconds: float = 900, failure_retry_seconds: float = 60):
+        self.ttl_seconds = ttl_seconds
+        self.failure_retry_seconds = failure_retry_seconds
+
+        self._client: Optional[python_weather.Client] = None
+        self._cache: Dict[Tuple[str, str, str], Tuple[float, str]] = {}    # key -> (expires_at, weather)
+        self._refreshing: Dict[Tuple[str, str, str], asyncio.Task] = {}
+
+    async def report(self, timezone: str, lang: str = 'en-us', location: str = 'New York') -> Tuple[str, str, str]:
+        """return (date, period, weather) for the location, the weather part may come from the cache"""
+        # 1. time period summary (cheap, always computed live)
+        tr = get_translator()
+        now = datetime.now(ZoneInfo(timezone))
+        h = now.hour
+        period = (
+            tr.t(lang, 'prompt.period.early') if 5 <= h < 8 else
+            tr.t(lang, 'prompt.period.morning') if 8 <= h < 12 else
+            tr.t(lang, 'prompt.period.afternoon') if 12 <= h < 18 else
+            tr.t(lang, 'prompt.period.evening') if 18 <= h < 20 else
+            tr.t(lang, 'prompt.period.night')
+        )
+
+        # 2. weather summary
+        sky_weather = await self._get_weather((location, timezone, lang))
+
+        return now.strftime('%Y-%m-%d'), period, sky_weather
+
+    async def _get_weather(self, key: Tuple[str, str, str]) -> str:
+        entry = self._cache.get(key)
+        if entry is None:
+            # cold cache, wait for the first lookup (shared with any lookup already in flight);
+            # shielded so a caller timing out does not cancel the lookup for everyone else
+            return await asyncio.shield(self._schedule_refresh(key))
+
+        expires_at, sky_weather = entry
+        if time.monotonic() >= expires_at:
+            self._schedule_refresh(key)     # stale-while-revalidate
+        return sky_weather
+
+    def _schedule_refresh(self, key: Tuple[str, str, str]) -> asyncio.Task:
+        task = self._refreshing.get(key)
+        if task is None or task.done():
+            task = asyncio.create_task(self._refresh(key))
+            self._refreshing[key] = task
+            task.add_done_callback(lambda t: self._refreshing.pop(key) if self._refreshing.get(key) is t else None)
+        return task
+
+    async def _refresh(self, key: Tuple[str, str, str]) -> str:
+        location = key[0]
         try:
+            client = self._get_client()
+            # TODO setup locale based on location
             weather = await client.get(location, unit=python_weather.IMPERIAL, locale=python_weather.Locale.CHINESE_TRADITIONAL_TAIWAN)
             sky_weather = weather.description
+            self._cache[key] = (time.monotonic() + self.ttl_seconds, sky_weather)
+            log.debug(f"Refreshed weather for location {location}: {sky_weather}")
+            return sky_weather
         except Exception as e:
-            log.warning(f"Failed to get weather for location {location}: {e}")
-            sky_weather = 'Unknown'
+            # fall back to the last known weather (or 'Unknown') and retry later
+            previous = self._cache.get(key)
+            sky_weather = previous[1] if previous else UNKNOWN_WEATHER
+            self._cache[key] = (time.monotonic() + self.failure_retry_seconds, sky_weather)
+            log.warning(f"Failed to get weather for location {location}, using '{sky_weather}': {e}")
+            return sky_weather
+
+    def _get_client(self) -> python_weather.Client:
+        if self._client is None:
+            self._client = python_weather.Client()
+        return self._client
+
+    async def close(self):
+        """cancel pending refreshes and close the shared HTTP client"""
+        for task in list(self._refreshing.values()):
+            task.cancel()
+        self._refreshing.clear()
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
 
-    return now.strftime('%Y-%m-%d'), period, sky_weather
\ No newline at end of file
+def get_weather_reporter(ttl_seconds: float = 900, failure_retry_seconds: float = 60) -> WeatherPeriodReporter:
+    """
+    Get the unique WeatherPeriodReporter instance.
+    If the instance does not exist, create a new one with the given settings.
+    """
+    global _reporter_instance
+
+    with _reporter_lock:
+        if _reporter_instance is None:
+            _reporter_instance = WeatherPeriodReporter(ttl_seconds=ttl_seconds, failure_retry_seconds=failure_retry_seconds)
+
+    return _reporter_instance
+
+async def weather_period_reporter(timezone, lang='en-us', location='New York'):
+    return await get_weather_reporter().report(timezone, lang=lang, location=location)
@@ -1,3 +1,3 @@
-from .base import VectorStoreInterface
+from .base import VectorStoreInterface, MemorySearchResult, MemoryWriteResult, DimensionMismatchError
 
 from .factory import get_vector_store
\ No newline at end of file
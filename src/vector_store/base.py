@@ -1,5 +1,50 @@
+import hashlib
 from abc import ABC, abstractmethod
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
+
+DEDUP_MODES = ("skip", "replace")
+
+def memory_id(user_id: str, text: str) -> str:
+    """stable content-addressed memory id, the same memory always gets the same id"""
+    return hashlib.sha256(f"{user_id}\0{text}".encode("utf-8")).hexdigest()
+
+class DimensionMismatchError(ValueError):
+    """raised when an embedding does not have the dimension the store was built with"""
+
+    def __init__(self, got: int, expected: int):
+        super().__init__(
+            f"Embedding dimension {got} does not match the store dimension {expected}, "
+            "convert the store to the configured embedding dimensionality first"
+        )
+        self.got = got
+        self.expected = expected
+
+class MemorySearchResult:
+    """one search hit: the memory and its cosine distance to the query (0 is identical, lower is closer)"""
+    __slots__ = ("id", "document", "distance", "metadata")
+
+    def __init__(self, id: str, document: str, distance: float, metadata: Optional[Dict[str, Any]] = None):
+        self.id = id
+        self.document = document
+        self.distance = distance
+        self.metadata = metadata or {}
+
+    def __repr__(self) -> str:
+        return f"MemorySearchResult(id={self.id!r}, distance={self.distance:.4f}, document={self.document[:30]!r})"
+
+class MemoryWriteResult:
+    """outcome of add_memory: whether the memory was written, and the text of the near duplicate it replaced"""
+    __slots__ = ("written", "replaced")
+
+    def __init__(self, written: bool, replaced: Optional[str] = None):
+        self.written = written
+        self.replaced = replaced
+
+    def __bool__(self) -> bool:
+        return self.written
+
+    def __repr__(self) -> str:
+        return f"MemoryWriteResult(written={self.written}, replaced={self.replaced[:30] if self.replaced else None!r})"
 
 class VectorStoreInterface(ABC):
     """
@@ -18,28 +63,86 @@ class VectorStoreInterface(ABC):
         pass
     
     @abstractmethod
-    async def add_memory(self, user_id: str, text: str, embedding: List[float]):
+    async def add_memory(self, user_id: str, text: str, embedding: List[float]) -> MemoryWriteResult:
         """
         Add a memory to the vector database.
+        The memory id is derived from its content, adding the same memory again overwrites it.
+        With dedup_mode "replace", a near duplicate already stored is deleted in favour of the new memory.
 
         Parameters:
             user_id: User identifier.
             text: Memory text content.
             embedding: Vector embedding representation of the text.
+
+        Returns:
+            Whether the memory was written (falsy if skipped as a near duplicate or on failure),
+            with the text of the memory it replaced, so other indexes can drop it too.
+        """
+        pass
+    
+    @abstractmethod
+    async def add_memories(
+        self,
+        ids: List[str],
+        documents: List[str],
+        embeddings: List[List[float]],
+        metadatas: List[Dict[str, Any]],
+        chunk_size: Optional[int] = None
+    ) -> List[str]:
+        """
+        Add (or overwrite) many memories at once, committed in chunks.
+
+        Parameters:
+            ids: Memory identifiers, writing an existing id replaces it.
+            documents: Memory text contents, aligned with ids.
+            embeddings: Vector embeddings, aligned with ids.
+            metadatas: Metadata dicts (must contain 'user_id'), aligned with ids.
+            chunk_size: Number of memories per commit, the store default when None.
+
+        Returns:
+            The ids that could not be written.
         """
         pass
     
     @abstractmethod
-    async def search_memory(self, user_id: str, query_embedding: List[float], n_results: int = 3) -> List[str]:
+    async def search_memory(self, user_id: str, query_embedding: List[float], n_results: int = 3) -> List[MemorySearchResult]:
         """
         Search for relevant memories based on the query embedding.
 
         Parameters:
             user_id: User identifier.
             query_embedding: Vector embedding representation of the query text.
-            n_results: Number of results to return.
+            n_results: Maximum number of results to return.
+
+        Returns:
+            The closest memories with their distances and metadata, closest first.
+        """
+        pass
+    
+    @abstractmethod
+    async def get_page(self, offset: int, limit: int) -> Dict[str, List[Any]]:
+        """
+        Get a page of stored memories in a stable order, used to walk the whole store without loading it at once.
+
+        Parameters:
+            offset: Number of memories to skip.
+            limit: Maximum number of memories to return.
 
         Returns:
-            A list of relevant memory texts.
+            A dict with aligned 'ids', 'documents' and 'metadatas' lists (empty lists past the end).
+        """
+        pass
+    
+    @abstractmethod
+    async def count(self) -> int:
+        """
+        Get the total number of stored memories.
+        """
+        pass
+    
+    def close(self):
+        """
+        Release the resources held by the vector store (thread pools, file handles, ...).
+        Stores without such resources do not need to override this method.
         """
         pass
\ No newline at end of file
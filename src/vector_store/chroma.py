@@ -1,66 +1,462 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import chromadb
 from chromadb.config import Settings
 from src import setup_logger
-from typing import List, Optional
-from .base import VectorStoreInterface
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from .base import VectorStoreInterface, MemorySearchResult, MemoryWriteResult, DimensionMismatchError, DEDUP_MODES, memory_id
 
 log = setup_logger(__name__)
 
+SHARDING_MODES = ("none", "per_user", "hash")
+LEGACY_COLLECTION = "user_memories"         # the single collection used without sharding
+SHARD_PREFIX = "user_memories_shard_"
+MANIFEST_FILE = "shard_manifest.json"
+
 class ChromaVectorStore(VectorStoreInterface):
-    def __init__(self, path: str = "./data/chroma_db"):
+    def __init__(
+        self,
+        path: str = "./data/chroma_db",
+        max_workers: int = 4,
+        write_chunk_size: int = 1000,
+        dedup_distance: Optional[float] = None,
+        dedup_mode: str = "skip",
+        sharding: str = "none",
+        num_shards: int = 16,
+        max_open_collections: int = 256,
+        segment_cache_bytes: Optional[int] = None,
+        dimension: Optional[int] = None
+    ):
+        if dedup_mode not in DEDUP_MODES:
+            raise ValueError(f"dedup_mode must be one of {DEDUP_MODES}, got {dedup_mode!r}")
+        if sharding not in SHARDING_MODES:
+            raise ValueError(f"sharding must be one of {SHARDING_MODES}, got {sharding!r}")
+        # Sharding routes each user's memories to their own collection (per_user) or to one of num_shards
+        # collections (hash), so a search only walks the HNSW index of that user or shard.
+        self.sharding = sharding
+        self.num_shards = num_shards
+        # collection handles are opened lazily and the least recently used ones are dropped
+        self.max_open_collections = max_open_collections
+        self._handles: OrderedDict = OrderedDict()
+        self._handles_lock = threading.Lock()
+        # a new memory within dedup_distance (cosine) of an existing one of the same user is skipped, or replaces it
+        self.dedup_distance = dedup_distance
+        self.dedup_mode = dedup_mode
+        # Chroma's client is synchronous, all collection operations run on this bounded pool
+        # so HNSW searches and SQLite writes never block the event loop
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="chroma")
+        self._max_workers = max_workers
+        self.write_chunk_size = write_chunk_size
+        self._stats_lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._completed = 0
+        self._cancelled = 0
+        
         try:
             # TODO: Further investigation into these settings is needed.
             # Set up ChromaDB for persistent storage on disk
-            self.client = chromadb.PersistentClient(path=path, settings=Settings(anonymized_telemetry=False))
-            # Get or create a collection, similar to a table in a database
-            # Note: If using Gemini embedding, the dimension might be 768 or 1024 (needs confirmation)
-            # ChromaDB usually handles dimension automatically, but specifying embedding_function is more reliable
-            # metadata={"hnsw:space": "cosine"} indicates using cosine similarity
-            self.collection = self.client.get_or_create_collection(
-                name="user_memories",
-                metadata={"hnsw:space": "cosine"} # Use cosine similarity
-                # embedding_function=chromadb.utils.embedding_functions.GoogleGenerativeAiEmbeddingFunction(api_key="YOUR_GEMINI_API_KEY")
-                # Note: If specifying the embedding function here, you don't need to pass embedding during add
-            )
-            log.info(f"ChromaDB client initialized. Collection 'user_memories' loaded/created at {path}.")
+            settings = Settings(anonymized_telemetry=False)
+            if segment_cache_bytes:
+                # bound the memory of the loaded HNSW indexes, least recently used shards are unloaded
+                settings = Settings(anonymized_telemetry=False, chroma_segment_cache_policy="LRU", chroma_memory_limit_bytes=segment_cache_bytes)
+            self.client = chromadb.PersistentClient(path=path, settings=settings)
+            # a chunk larger than the client's batch limit would be rejected as a whole
+            self.write_chunk_size = max(1, min(write_chunk_size, self.client.get_max_batch_size()))
+            self._check_manifest(path, dimension)
+            if self.sharding == "none":
+                # Get or create a collection, similar to a table in a database
+                # metadata={"hnsw:space": "cosine"} indicates using cosine similarity
+                self._open(LEGACY_COLLECTION)
+                log.info(f"ChromaDB client initialized. Collection '{LEGACY_COLLECTION}' loaded/created at {path}.")
+            else:
+                self._migrate_legacy_collection()
+                log.info(f"ChromaDB client initialized at {path} with {self.sharding} sharding.")
+            self._check_stored_dimension(path, dimension)
         except Exception as e:
             log.error(f"Failed to initialize ChromaDB: {e}")
             raise
 
-    async def add_memory(self, user_id: str, text: str, embedding: List[float]):
-        """add a memory to the vector database"""
+    def _check_manifest(self, path: str, dimension: Optional[int]):
+        """
+        Record the routing scheme and the embedding dimension next to the data. Opening the store with
+        another sharding scheme is refused, it would silently route users to the wrong shards
+        (only moving from the single collection to shards is supported, by migration).
+        """
+        self._manifest_path = os.path.join(path, MANIFEST_FILE)
+        routing = {"sharding": self.sharding, "num_shards": self.num_shards if self.sharding == "hash" else None}
+        manifest = {}
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            stored = {"sharding": manifest.get("sharding", "none"), "num_shards": manifest.get("num_shards")}
+            if stored != routing and stored["sharding"] != "none":
+                raise ValueError(
+                    f"Vector store at {path} uses routing {stored}, but {routing} is configured. "
+                    "Keep the original sharding settings or convert the store into a new one."
+                )
+        self._routing = routing
+        self.dimension: Optional[int] = manifest.get("dimension")
+        if manifest != {**routing, "dimension": self.dimension}:
+            self._save_manifest()
+
+    def _check_stored_dimension(self, path: str, dimension: Optional[int]):
+        """
+        A store without a recorded dimension (created before it was recorded) takes it from a stored
+        embedding, not from whatever the next write sends; an empty store is fixed by its first write.
+        """
+        if self.dimension is None:
+            for name in self._collection_names():
+                handle = self._open(name, create=False)
+                embeddings = handle.get(limit=1, include=["embeddings"]).get("embeddings") if handle is not None else None
+                if embeddings is not None and len(embeddings):
+                    self.dimension = len(embeddings[0])
+                    self._save_manifest()
+                    break
+        # not fatal, the store stays readable for a conversion, but vector searches and writes are skipped until then
+        self.dimension_mismatch = dimension is not None and self.dimension is not None and dimension != self.dimension
+        if self.dimension_mismatch:
+            log.warning(
+                f"Vector store at {path} was built with dimension {self.dimension}, but {dimension} is configured. "
+                "Vector retrieval is disabled until the store is converted to the configured dimensionality."
+            )
+
+    def _save_manifest(self):
+        os.makedirs(os.path.dirname(self._manifest_path), exist_ok=True)
+        with open(self._manifest_path, "w", encoding="utf-8") as f:
+            json.dump({**self._routing, "dimension": self.dimension}, f)
+
+    def _check_dimension(self, dimension: int):
+        """refuse embeddings of another dimension than the store's"""
+        if self.dimension is not None and dimension != self.dimension:
+            raise DimensionMismatchError(dimension, self.dimension)
+
+    def _record_dimension(self, dimension: int):
+        """bind an empty store to the dimension of its first successful write"""
+        if self.dimension is None:
+            self.dimension = dimension
+            self._save_manifest()
+
+    def _collection_name(self, user_id: str) -> str:
+        """the collection holding the user's memories"""
+        if self.sharding == "none":
+            return LEGACY_COLLECTION
+        digest = hashlib.sha256(user_id.encode("utf-8")).hexdigest()
+        if self.sharding == "per_user":
+            return f"{SHARD_PREFIX}u_{digest[:32]}"      # collection names are limited to 63 characters
+        return f"{SHARD_PREFIX}{int(digest, 16) % self.num_shards:04d}"
+
+    def _where(self, user_id: str) -> Optional[Dict[str, str]]:
+        # a per-user collection holds nothing else, no metadata filter is needed
+        return None if self.sharding == "per_user" else {"user_id": user_id}
+
+    def _open(self, name: str, create: bool = True):
+        """
+        Get a collection handle from the LRU of open collections, opening it if needed (on a worker thread).
+        Returns None if the collection does not exist and `create` is False.
+        """
+        with self._handles_lock:
+            handle = self._handles.get(name)
+            if handle is not None:
+                self._handles.move_to_end(name)
+                return handle
+        if create:
+            handle = self.client.get_or_create_collection(name=name, metadata={"hnsw:space": "cosine"})
+        else:
+            try:
+                handle = self.client.get_collection(name=name)
+            except Exception:
+                return None         # nothing stored there yet, do not create empty collections on reads
+        with self._handles_lock:
+            self._handles[name] = handle
+            self._handles.move_to_end(name)
+            while len(self._handles) > self.max_open_collections:
+                self._handles.popitem(last=False)
+        return handle
+
+    def _call(self, name: str, method: str, **kwargs) -> Any:
+        """call a collection method, executed on a worker thread"""
+        return getattr(self._open(name), method)(**kwargs)
+
+    def _collection_names(self) -> List[str]:
+        """names of the collections holding memories, in a stable order"""
+        if self.sharding == "none":
+            return [LEGACY_COLLECTION]
+        names = [c if isinstance(c, str) else c.name for c in self.client.list_collections()]
+        return sorted(name for name in names if name.startswith(SHARD_PREFIX))
+
+    def _migrate_legacy_collection(self):
+        """
+        Move the memories of the single legacy collection into the shards, once.
+        Each page is written to the shards before it is deleted from the legacy collection,
+        so an interrupted migration simply continues on the next start.
+        """
+        try:
+            legacy = self.client.get_collection(name=LEGACY_COLLECTION)
+        except Exception:
+            return
+        total = legacy.count()
+        log.info(f"Migrating {total} memories from collection '{LEGACY_COLLECTION}' to {self.sharding} shards.")
+        moved = 0
+        while True:
+            page = legacy.get(limit=self.write_chunk_size, include=["documents", "metadatas", "embeddings"])
+            if not page["ids"]:
+                break
+            by_collection: Dict[str, List[int]] = {}
+            for i, metadata in enumerate(page["metadatas"]):
+                by_collection.setdefault(self._collection_name((metadata or {}).get("user_id", "")), []).append(i)
+            for name, indices in by_collection.items():
+                self._call(
+                    name,
+                    "upsert",
+                    ids=[page["ids"][i] for i in indices],
+                    documents=[page["documents"][i] for i in indices],
+                    embeddings=[page["embeddings"][i] for i in indices],
+                    metadatas=[page["metadatas"][i] for i in indices]
+                )
+            legacy.delete(ids=page["ids"])
+            moved += len(page["ids"])
+            log.info(f"Migrated {moved}/{total} memories to shards.")
+        self.client.delete_collection(name=LEGACY_COLLECTION)
+        log.info(f"Collection '{LEGACY_COLLECTION}' migrated to shards and removed.")
+
+    def _invoke(self, fn: Callable, args: tuple, kwargs: dict) -> Any:
+        """executed on a worker thread, keeps the queue-depth counters up to date"""
+        with self._stats_lock:
+            self._queued -= 1
+            self._running += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._stats_lock:
+                self._running -= 1
+                self._completed += 1
+
+    async def _run(self, fn: Callable, *args, **kwargs) -> Any:
+        """run a blocking Chroma call on the dedicated executor"""
+        with self._stats_lock:
+            self._queued += 1
+        future = self._executor.submit(self._invoke, fn, args, kwargs)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # a call that has not started yet is dropped from the queue, a running one cannot be interrupted
+            if future.cancel():
+                with self._stats_lock:
+                    self._queued -= 1
+                    self._cancelled += 1
+            raise
+
+    def executor_stats(self) -> Dict[str, int]:
+        """return queue-depth metrics of the Chroma executor"""
+        with self._stats_lock:
+            return {
+                "max_workers": self._max_workers,
+                "queued": self._queued,
+                "running": self._running,
+                "completed": self._completed,
+                "cancelled": self._cancelled,
+                "open_collections": len(self._handles)
+            }
+
+    def close(self):
+        """stop the executor, pending calls are cancelled"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _query(self, user_id: str, **kwargs) -> Optional[Dict[str, Any]]:
+        """query the user's collection, None if it does not exist yet (executed on a worker thread)"""
+        collection = self._open(self._collection_name(user_id), create=False)
+        if collection is None:
+            return None
+        return collection.query(where=self._where(user_id), **kwargs)
+
+    async def _find_near_duplicate(self, user_id: str, doc_id: str, embedding: List[float]) -> Optional[Tuple[str, str]]:
+        """return the id and text of the user's closest memory if it lies within dedup_distance"""
+        results = await self._run(self._query, user_id, query_embeddings=[embedding], n_results=1, include=["documents", "distances"])
+        if not results or not results["ids"] or not results["ids"][0]:
+            return None
+        closest_id, distance = results["ids"][0][0], results["distances"][0][0]
+        if closest_id == doc_id or distance > self.dedup_distance:
+            return None
+        log.debug(f"Memory {doc_id} of user {user_id} is a near duplicate of {closest_id} (distance {distance:.4f}).")
+        return closest_id, results["documents"][0][0]
+
+    async def add_memory(self, user_id: str, text: str, embedding: List[float]) -> MemoryWriteResult:
+        """add a memory to the vector database, the result is falsy if it was skipped as a near duplicate or failed"""
         if not embedding:
             log.warning(f"Skipping adding memory for user {user_id} due to missing embedding.")
-            return
+            return MemoryWriteResult(False)
+        if self.dimension_mismatch:
+            return MemoryWriteResult(False)     # reported once at startup
         try:
-            # TODO: Consider using a better ID generation method in the future (low priority for personal use).
-            # Use user_id and a unique identifier (e.g., text hash or timestamp) as the ID.
-            # Here we simply use the text hash, but note that collisions are possible; a better approach is to use a UUID.
-            doc_id = f"{user_id}_{hash(text)}"
-            self.collection.add(
+            self._check_dimension(len(embedding))
+            doc_id = memory_id(user_id, text)
+            name = self._collection_name(user_id)
+            replaced = None
+            if self.dedup_distance is not None:
+                duplicate = await self._find_near_duplicate(user_id, doc_id, embedding)
+                if duplicate is not None:
+                    if self.dedup_mode == "skip":
+                        log.info(f"Skipping memory for user {user_id}, a near duplicate is already stored: {text[:50]}...")
+                        return MemoryWriteResult(False)
+                    # replace: the newer memory supersedes the older one
+                    duplicate_id, replaced = duplicate
+                    await self._run(self._call, name, "delete", ids=[duplicate_id])
+            # upsert: writing the same memory again is a no-op instead of a failed add
+            await self._run(
+                self._call,
+                name,
+                "upsert",
                 embeddings=[embedding],
                 documents=[text],
                 metadatas=[{"user_id": user_id}],
                 ids=[doc_id]
             )
+            self._record_dimension(len(embedding))
             log.debug(f"Memory added for user {user_id}: {text[:50]}...")
+            return MemoryWriteResult(True, replaced)
         except Exception as e:
             log.error(f"Error adding memory to ChromaDB for user {user_id}: {e}")
+            return MemoryWriteResult(False)
 
-    async def search_memory(self, user_id: str, query_embedding: List[float], n_results: int = 3) -> List[str]:
+    async def add_memories(
+        self,
+        ids: List[str],
+        documents: List[str],
+        embeddings: List[List[float]],
+        metadatas: List[Dict[str, Any]],
+        chunk_size: Optional[int] = None
+    ) -> List[str]:
+        """add many memories with one upsert per chunk, return the ids that failed"""
+        if not (len(ids) == len(documents) == len(embeddings) == len(metadatas)):
+            raise ValueError("ids, documents, embeddings and metadatas must have the same length")
+        chunk_size = min(chunk_size or self.write_chunk_size, self.write_chunk_size)
+        for embedding in embeddings:
+            self._check_dimension(len(embedding))
+            if len(embedding) != len(embeddings[0]):
+                raise DimensionMismatchError(len(embedding), len(embeddings[0]))
+
+        # memories are routed to their user's collection, each collection is written in chunks
+        by_collection: Dict[str, List[int]] = {}
+        for i, metadata in enumerate(metadatas):
+            by_collection.setdefault(self._collection_name(metadata["user_id"]), []).append(i)
+
+        failed_ids = []
+        for name, indices in by_collection.items():
+            failed_ids.extend(await self._write_chunked(
+                name,
+                [ids[i] for i in indices],
+                [documents[i] for i in indices],
+                [embeddings[i] for i in indices],
+                [metadatas[i] for i in indices],
+                chunk_size
+            ))
+        if len(failed_ids) < len(ids):
+            self._record_dimension(len(embeddings[0]))
+        log.debug(f"Bulk added {len(ids) - len(failed_ids)}/{len(ids)} memories.")
+        return failed_ids
+
+    async def _write_chunked(
+        self,
+        name: str,
+        ids: List[str],
+        documents: List[str],
+        embeddings: List[List[float]],
+        metadatas: List[Dict[str, Any]],
+        chunk_size: int
+    ) -> List[str]:
+        """upsert into one collection chunk by chunk, return the ids that failed"""
+        failed_ids = []
+        for start in range(0, len(ids), chunk_size):
+            end = start + chunk_size
+            try:
+                await self._run(
+                    self._call,
+                    name,
+                    "upsert",
+                    ids=ids[start:end],
+                    documents=documents[start:end],
+                    embeddings=embeddings[start:end],
+                    metadatas=metadatas[start:end]
+                )
+            except Exception as e:
+                # one bad item fails the whole chunk, retry it item by item to isolate the failures
+                log.warning(f"Bulk write of {end - start} memories failed, retrying item by item: {e}")
+                for i in range(start, min(end, len(ids))):
+                    try:
+                        await self._run(
+                            self._call,
+                            name,
+                            "upsert",
+                            ids=[ids[i]],
+                            documents=[documents[i]],
+                            embeddings=[embeddings[i]],
+                            metadatas=[metadatas[i]]
+                        )
+                    except Exception as item_error:
+                        log.error(f"Error adding memory {ids[i]} to ChromaDB: {item_error}")
+                        failed_ids.append(ids[i])
+        return failed_ids
+
+    async def search_memory(self, user_id: str, query_embedding: List[float], n_results: int = 3) -> List[MemorySearchResult]:
         """Search relevant memories based on the query embedding"""
         if not query_embedding:
             log.warning(f"Skipping memory search for user {user_id} due to missing query embedding.")
             return []
+        if self.dimension_mismatch:
+            return []       # reported once at startup
         try:
-            results = self.collection.query(
+            self._check_dimension(len(query_embedding))
+            # Only search memories for a specific user, within the user's own shard when sharding is enabled
+            results = await self._run(
+                self._query,
+                user_id,
                 query_embeddings=[query_embedding],
                 n_results=n_results,
-                where={"user_id": user_id} # Only search memories for a specific user
+                include=["documents", "metadatas", "distances"]
             )
             # log.debug(f"Memory search results for user {user_id}: {results}")
-            # results['documents'] is a list of lists, we need the first list
-            return results['documents'][0] if results and results['documents'] else []
+            # each field is a list of lists (one per query embedding), we need the first list
+            if not results or not results['ids']:
+                return []
+            return [
+                MemorySearchResult(doc_id, document, distance, metadata)
+                for doc_id, document, distance, metadata in zip(
+                    results['ids'][0], results['documents'][0], results['distances'][0], results['metadatas'][0]
+                )
+            ]
         except Exception as e:
             log.error(f"Error searching memory in ChromaDB for user {user_id}: {e}")
-            return []
\ No newline at end of file
+            return []
+
+    def _get_page(self, offset: int, limit: int) -> Dict[str, List[Any]]:
+        """walk the collections in name order, the offset runs over all of them (executed on a worker thread)"""
+        page = {"ids": [], "documents": [], "metadatas": []}
+        for name in self._collection_names():
+            if limit <= 0:
+                break
+            collection = self._open(name)
+            if self.sharding != "none":
+                size = collection.count()
+                if offset >= size:
+                    offset -= size
+                    continue
+            results = collection.get(offset=offset, limit=limit, include=["documents", "metadatas"])
+            for key in page:
+                page[key].extend(results[key])
+            limit -= len(results["ids"])
+            offset = 0
+        return page
+
+    async def get_page(self, offset: int, limit: int) -> Dict[str, List[Any]]:
+        """get a page of stored memories (ids, documents and metadatas)"""
+        return await self._run(self._get_page, offset, limit)
+
+    async def count(self) -> int:
+        """get the number of stored memories"""
+        return await self._run(lambda: sum(self._open(name).count() for name in self._collection_names()))
\ No newline at end of file
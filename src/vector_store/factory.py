@@ -1,10 +1,33 @@
-from .chroma import ChromaVectorStore
 from .base import VectorStoreInterface
 
 def get_vector_store(vector_store_name: str, **kwargs) -> VectorStoreInterface:
     match vector_store_name:
         case "chroma":
+            from .chroma import ChromaVectorStore       # heavy import, only when selected
             path = kwargs["path"]
-            return ChromaVectorStore(path=path)
+            return ChromaVectorStore(
+                path=path,
+                max_workers=kwargs.get("max_workers", 4),
+                write_chunk_size=kwargs.get("write_chunk_size", 1000),
+                dedup_distance=kwargs.get("dedup_distance"),
+                dedup_mode=kwargs.get("dedup_mode", "skip"),
+                sharding=kwargs.get("sharding", "none"),
+                num_shards=kwargs.get("num_shards", 16),
+                max_open_collections=kwargs.get("max_open_collections", 256),
+                segment_cache_bytes=kwargs.get("segment_cache_bytes"),
+                dimension=kwargs.get("dimension")
+            )
+        case "numpy":
+            from .numpy_store import NumpyVectorStore
+            return NumpyVectorStore(
+                path=kwargs["path"],
+                max_open_users=kwargs.get("max_open_users", 256),
+                compaction_ratio=kwargs.get("compaction_ratio", 0.25),
+                dedup_distance=kwargs.get("dedup_distance"),
+                dedup_mode=kwargs.get("dedup_mode", "skip"),
+                dimension=kwargs.get("dimension"),
+                coarse_dimension=kwargs.get("coarse_dimension"),
+                rerank_candidates=kwargs.get("rerank_candidates", 100)
+            )
         case _:
             raise ValueError(f"Unknown vector store name: {vector_store_name}")
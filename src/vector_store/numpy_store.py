@@ -0,0 +1,464 @@
+import asyncio
+import bisect
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from itertools import accumulate
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src import setup_logger
+from .base import VectorStoreInterface, MemorySearchResult, MemoryWriteResult, DimensionMismatchError, DEDUP_MODES, memory_id
+
+log = setup_logger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+VECTORS_FILE = "vectors.f32"
+RECORDS_FILE = "records.jsonl"
+DELETED_FILE = "deleted.txt"
+GENERATION_FILE = "generation"
+
+def _normalized_prefix(vectors: np.ndarray, dimension: int) -> np.ndarray:
+    prefix = np.asarray(vectors[:, :dimension], dtype=np.float32)
+    norms = np.linalg.norm(prefix, axis=1, keepdims=True)
+    return prefix / np.where(norms == 0, 1, norms)
+
+class _UserShard:
+    """
+    One user's memories: row i of the float32 vector file belongs to line i of the records file.
+    Replaced and deleted rows are listed in the deleted file until the next compaction.
+    Compaction writes a new generation of the three files, then switches to it by atomically replacing
+    the generation file, so a crash leaves either the old or the new generation, never a mix.
+    """
+
+    def __init__(self, directory: str, dimension: int):
+        self.directory = directory
+        self.dimension = dimension
+        self.generation = 0
+        self.ids: List[str] = []
+        self.documents: List[str] = []
+        self.metadatas: List[Dict[str, Any]] = []
+        self.dead: set = set()
+        self.rows: Dict[str, int] = {}      # live row of each id
+        self._vectors: Optional[np.memmap] = None
+        self._coarse: Optional[np.ndarray] = None
+
+        generation_path = os.path.join(directory, GENERATION_FILE)
+        if os.path.exists(generation_path):
+            with open(generation_path, "r", encoding="utf-8") as f:
+                self.generation = int(f.read().strip() or 0)
+        self._remove_other_generations()
+
+        if os.path.exists(self._path(RECORDS_FILE)):
+            with open(self._path(RECORDS_FILE), "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        break               # torn write of the last record
+                    record = json.loads(line)
+                    self.ids.append(record["id"])
+                    self.documents.append(record["document"])
+                    self.metadatas.append(record["metadata"])
+        if os.path.exists(self._path(DELETED_FILE)):
+            with open(self._path(DELETED_FILE), "r", encoding="utf-8") as f:
+                self.dead = {int(line) for line in f if line.strip()}
+
+        # a crash between the two appends leaves one file longer, or a partial vector row at the end:
+        # both files are cut back to the rows complete in both, so later appends stay aligned
+        vectors_path = self._path(VECTORS_FILE)
+        vectors_size = os.path.getsize(vectors_path) if os.path.exists(vectors_path) else 0
+        n = min(len(self.ids), vectors_size // (4 * dimension))
+        if n < len(self.ids) or vectors_size != n * 4 * dimension:
+            self._truncate(n)
+        self.dead = {row for row in self.dead if row < n}
+        self.rows = {doc_id: row for row, doc_id in enumerate(self.ids) if row not in self.dead}
+
+    def _path(self, name: str, generation: Optional[int] = None) -> str:
+        """path of one of the shard files, generation 0 uses the plain file names"""
+        generation = self.generation if generation is None else generation
+        if generation:
+            stem, extension = os.path.splitext(name)
+            name = f"{stem}.{generation}{extension}"
+        return os.path.join(self.directory, name)
+
+    def _remove_other_generations(self):
+        """drop the files of an interrupted compaction (newer) or of a finished one (older)"""
+        if not os.path.isdir(self.directory):
+            return
+        current = {os.path.basename(self._path(name)) for name in (VECTORS_FILE, RECORDS_FILE, DELETED_FILE)}
+        prefixes = tuple(os.path.splitext(name)[0] + "." for name in (VECTORS_FILE, RECORDS_FILE, DELETED_FILE))
+        for file_name in os.listdir(self.directory):
+            if file_name.startswith(prefixes) and file_name not in current:
+                os.remove(os.path.join(self.directory, file_name))
+
+    def _truncate(self, n: int):
+        del self.ids[n:], self.documents[n:], self.metadatas[n:]
+        self._coarse = None
+        self._rewrite_records()
+        if os.path.exists(self._path(VECTORS_FILE)):
+            os.truncate(self._path(VECTORS_FILE), n * 4 * self.dimension)
+
+    def _rewrite_records(self):
+        path = self._path(RECORDS_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            for doc_id, document, metadata in zip(self.ids, self.documents, self.metadatas):
+                f.write(json.dumps({"id": doc_id, "document": document, "metadata": metadata}, ensure_ascii=False) + "\n")
+        os.replace(path + ".tmp", path)
+
+    @property
+    def live_count(self) -> int:
+        return len(self.rows)
+
+    def vectors(self) -> np.ndarray:
+        """the memory-mapped vector rows, reopened after appends"""
+        if self._vectors is None or len(self._vectors) != len(self.ids):
+            if not self.ids:
+                return np.empty((0, self.dimension), dtype=np.float32)
+            self._vectors = np.memmap(self._path(VECTORS_FILE), dtype=np.float32, mode="r", shape=(len(self.ids), self.dimension))
+        return self._vectors
+
+    def coarse(self, dimension: int) -> np.ndarray:
+        """
+        The first `dimension` components of every row, renormalized and kept in memory.
+        Matryoshka embeddings rank almost like the full vectors on such a prefix, at a fraction of the scan cost.
+        """
+        if self._coarse is None or self._coarse.shape[1] != dimension:
+            self._coarse = _normalized_prefix(self.vectors(), dimension)
+        elif len(self._coarse) < len(self.ids):
+            # extend with the rows appended since the last scan
+            self._coarse = np.concatenate([self._coarse, _normalized_prefix(self.vectors()[len(self._coarse):], dimension)])
+        return self._coarse
+
+    def append(self, ids: List[str], documents: List[str], vectors: np.ndarray, metadatas: List[Dict[str, Any]]):
+        """append rows (vectors already normalized), an existing id is replaced by its new row"""
+        os.makedirs(self.directory, exist_ok=True)
+        replaced = []
+        with open(self._path(VECTORS_FILE), "ab") as f:
+            f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        with open(self._path(RECORDS_FILE), "a", encoding="utf-8") as f:
+            for doc_id, document, metadata in zip(ids, documents, metadatas):
+                f.write(json.dumps({"id": doc_id, "document": document, "metadata": metadata}, ensure_ascii=False) + "\n")
+        for doc_id, document, metadata in zip(ids, documents, metadatas):
+            if doc_id in self.rows:
+                replaced.append(self.rows[doc_id])
+            self.rows[doc_id] = len(self.ids)
+            self.ids.append(doc_id)
+            self.documents.append(document)
+            self.metadatas.append(metadata)
+        self.mark_dead(replaced)
+
+    def mark_dead(self, rows: List[int]):
+        rows = [row for row in set(rows) if row not in self.dead]
+        if not rows:
+            return
+        with open(self._path(DELETED_FILE), "a", encoding="utf-8") as f:
+            f.write("".join(f"{row}\n" for row in rows))
+        self.dead.update(rows)
+        for row in rows:
+            if self.rows.get(self.ids[row]) == row:
+                del self.rows[self.ids[row]]
+
+    def compact(self):
+        """rewrite the files with the live rows only, as a new generation"""
+        live = sorted(self.rows.values())
+        vectors = np.array(self.vectors()[live], dtype=np.float32) if live else np.empty((0, self.dimension), dtype=np.float32)
+        ids = [self.ids[row] for row in live]
+        documents = [self.documents[row] for row in live]
+        metadatas = [self.metadatas[row] for row in live]
+
+        generation = self.generation + 1
+        with open(self._path(VECTORS_FILE, generation), "wb") as f:
+            f.write(vectors.tobytes())
+        with open(self._path(RECORDS_FILE, generation), "w", encoding="utf-8") as f:
+            for doc_id, document, metadata in zip(ids, documents, metadatas):
+                f.write(json.dumps({"id": doc_id, "document": document, "metadata": metadata}, ensure_ascii=False) + "\n")
+        # the switch: until the generation file is replaced, a restart still loads the previous generation
+        generation_path = os.path.join(self.directory, GENERATION_FILE)
+        with open(generation_path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(str(generation))
+        os.replace(generation_path + ".tmp", generation_path)
+
+        self.generation = generation
+        self.ids, self.documents, self.metadatas = ids, documents, metadatas
+        self._vectors = None
+        self._coarse = None
+        self._remove_other_generations()
+        self.dead = set()
+        self.rows = {doc_id: row for row, doc_id in enumerate(self.ids)}
+
+class NumpyVectorStore(VectorStoreInterface):
+    """
+    Lightweight in-process vector store for small per-user collections.
+    Each user's vectors are an append-only float32 file, memory-mapped for search, with a JSON lines
+    side file holding the documents and metadata. Vectors are normalized on write, so an exact top-k
+    search is one matrix-vector product over the user's rows. Replaced rows are compacted away once
+    they exceed `compaction_ratio` of the file. Only recently used users are kept open.
+    With `coarse_dimension` set, large users are searched in two stages: a scan over a compact
+    low-dimension prefix of the vectors selects `rerank_candidates`, which the full vectors re-rank.
+    The store is bound to the dimension of its first vector and refuses embeddings of another one.
+    """
+
+    def __init__(
+        self,
+        path: str = "./data/numpy_db",
+        max_open_users: int = 256,
+        compaction_ratio: float = 0.25,
+        dedup_distance: Optional[float] = None,
+        dedup_mode: str = "skip",
+        dimension: Optional[int] = None,
+        coarse_dimension: Optional[int] = None,
+        rerank_candidates: int = 100
+    ):
+        if dedup_mode not in DEDUP_MODES:
+            raise ValueError(f"dedup_mode must be one of {DEDUP_MODES}, got {dedup_mode!r}")
+        self.path = path
+        self.coarse_dimension = coarse_dimension
+        self.rerank_candidates = rerank_candidates
+        self.max_open_users = max_open_users
+        self.compaction_ratio = compaction_ratio
+        self.dedup_distance = dedup_distance
+        self.dedup_mode = dedup_mode
+
+        os.makedirs(path, exist_ok=True)
+        self.dimension: Optional[int] = None    # fixed by the first memory written
+        manifest_path = os.path.join(path, MANIFEST_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                self.dimension = json.load(f)["dimension"]
+        # not fatal, the store stays readable for a conversion, but vector searches and writes are skipped until then
+        self.dimension_mismatch = dimension is not None and self.dimension is not None and dimension != self.dimension
+        if self.dimension_mismatch:
+            log.warning(
+                f"NumPy vector store at {path} was built with dimension {self.dimension}, but {dimension} is configured. "
+                "Vector retrieval is disabled until the store is converted to the configured dimensionality."
+            )
+
+        self._shards: OrderedDict = OrderedDict()
+        # live memories per user directory for get_page / count, built by the first walk and kept current by the writes
+        self._live_counts: Optional[Dict[str, int]] = None
+        self._walk_index: Optional[Tuple[List[str], List[int]]] = None
+        # all file access runs on one worker thread, which also serializes the writes
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="numpy-store")
+        log.info(f"NumPy vector store opened at {path} (dimension {self.dimension}).")
+
+    async def _run(self, fn: Callable, *args) -> Any:
+        return await asyncio.wrap_future(self._executor.submit(fn, *args))
+
+    def close(self):
+        """wait for the pending writes and release the memory maps"""
+        self._executor.shutdown(wait=True)
+        self._shards.clear()
+
+    def _user_directory(self, user_id: str) -> str:
+        return os.path.join(self.path, hashlib.sha256(user_id.encode("utf-8")).hexdigest()[:32])
+
+    def _shard(self, directory: str) -> _UserShard:
+        shard = self._shards.get(directory)
+        if shard is None:
+            shard = _UserShard(directory, self.dimension)
+            self._shards[directory] = shard
+            while len(self._shards) > self.max_open_users:
+                self._shards.popitem(last=False)
+        self._shards.move_to_end(directory)
+        return shard
+
+    def _peek_shard(self, directory: str) -> _UserShard:
+        """an open shard, or a transient one that does not displace the recently used users (a walk over all users)"""
+        shard = self._shards.get(directory)
+        return shard if shard is not None else _UserShard(directory, self.dimension)
+
+    def _walk(self) -> Tuple[List[str], List[int]]:
+        """the user directories in walk order, with the cumulative live count up to and including each one"""
+        if self._live_counts is None:
+            self._live_counts = {directory: self._peek_shard(directory).live_count for directory in self._user_directories()}
+        if self._walk_index is None:
+            directories = sorted(self._live_counts)
+            self._walk_index = (directories, list(accumulate(self._live_counts[directory] for directory in directories)))
+        return self._walk_index
+
+    def _normalize(self, embeddings: List[List[float]]) -> np.ndarray:
+        vectors = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+        if self.dimension is None:
+            self.dimension = vectors.shape[1]
+            with open(os.path.join(self.path, MANIFEST_FILE), "w", encoding="utf-8") as f:
+                json.dump({"dimension": self.dimension}, f)
+        elif vectors.shape[1] != self.dimension:
+            raise DimensionMismatchError(vectors.shape[1], self.dimension)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def _top_k(self, shard: _UserShard, query: np.ndarray, n_results: int):
+        """(rows, cosine distances) of the n_results closest live rows, closest first"""
+        if not shard.live_count:
+            return [], []
+        k = min(n_results, shard.live_count)
+        candidates = None
+        if self.coarse_dimension and self.coarse_dimension < self.dimension and shard.live_count > max(self.rerank_candidates, k):
+            # stage 1: scan the compact prefixes, stage 2 re-ranks the candidates with the full vectors
+            coarse_query = _normalized_prefix(query[None, :], self.coarse_dimension)[0]
+            coarse_scores = shard.coarse(self.coarse_dimension) @ coarse_query
+            if shard.dead:
+                coarse_scores[list(shard.dead)] = -np.inf
+            n_candidates = max(self.rerank_candidates, k)
+            candidates = np.sort(np.argpartition(-coarse_scores, n_candidates - 1)[:n_candidates])
+            scores = shard.vectors()[candidates] @ query
+        else:
+            scores = shard.vectors() @ query
+            if shard.dead:
+                scores[list(shard.dead)] = -np.inf
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        rows = candidates[top] if candidates is not None else top
+        return rows.tolist(), (1.0 - scores[top]).tolist()
+
+    def _write(self, user_id: str, ids: List[str], documents: List[str], embeddings: List[List[float]], metadatas: List[Dict[str, Any]]) -> Tuple[List[str], List[str]]:
+        """write one user's memories, return the ids written and the documents replaced (executed on the worker thread)"""
+        vectors = self._normalize(embeddings)
+        directory = self._user_directory(user_id)
+        shard = self._shard(directory)
+        replaced_documents = []
+        if self.dedup_distance is not None:
+            keep, replaced = [], []
+            for i, doc_id in enumerate(ids):
+                # near duplicates earlier in the same batch count like stored ones
+                if keep:
+                    distances = 1.0 - vectors[keep] @ vectors[i]
+                    batch_duplicates = [j for j, distance in zip(keep, distances) if ids[j] != doc_id and distance <= self.dedup_distance]
+                    if batch_duplicates:
+                        if self.dedup_mode == "skip":
+                            log.info(f"Skipping memory for user {user_id}, a near duplicate is in the same batch: {documents[i][:50]}...")
+                            continue
+                        keep = [j for j in keep if j not in batch_duplicates]
+                rows, distances = self._top_k(shard, vectors[i], 1)
+                if rows and shard.ids[rows[0]] != doc_id and distances[0] <= self.dedup_distance:
+                    if self.dedup_mode == "skip":
+                        log.info(f"Skipping memory for user {user_id}, a near duplicate is already stored: {documents[i][:50]}...")
+                        continue
+                    replaced.append(rows[0])     # replace: the newer memory supersedes the older one
+                keep.append(i)
+            replaced_documents = [shard.documents[row] for row in replaced]
+            shard.mark_dead(replaced)
+            ids, documents, metadatas = [ids[i] for i in keep], [documents[i] for i in keep], [metadatas[i] for i in keep]
+            vectors = vectors[keep]
+        if ids:
+            shard.append(ids, documents, vectors, metadatas)
+        if len(shard.dead) > self.compaction_ratio * len(shard.ids):
+            shard.compact()
+        if self._live_counts is not None and self._live_counts.get(directory) != shard.live_count:
+            self._live_counts[directory] = shard.live_count
+            self._walk_index = None
+        return ids, replaced_documents
+
+    def _search(self, user_id: str, query_embedding: List[float], n_results: int) -> List[MemorySearchResult]:
+        directory = self._user_directory(user_id)
+        if self.dimension is None or not os.path.isdir(directory):
+            return []
+        shard = self._shard(directory)
+        rows, distances = self._top_k(shard, self._normalize([query_embedding])[0], n_results)
+        return [
+            MemorySearchResult(shard.ids[row], shard.documents[row], distance, shard.metadatas[row])
+            for row, distance in zip(rows, distances)
+        ]
+
+    def _user_directories(self) -> List[str]:
+        return sorted(
+            os.path.join(self.path, name) for name in os.listdir(self.path)
+            if os.path.isdir(os.path.join(self.path, name))
+        )
+
+    def _get_page(self, offset: int, limit: int) -> Dict[str, List[Any]]:
+        page = {"ids": [], "documents": [], "metadatas": []}
+        if self.dimension is None:
+            return page
+        directories, ends = self._walk()
+        # only the users the page covers are opened, found by bisecting the cumulative live counts
+        index = bisect.bisect_right(ends, offset)
+        if index:
+            offset -= ends[index - 1]
+        for directory in directories[index:]:
+            if limit <= 0:
+                break
+            shard = self._peek_shard(directory)
+            rows = sorted(shard.rows.values())[offset:offset + limit]
+            page["ids"].extend(shard.ids[row] for row in rows)
+            page["documents"].extend(shard.documents[row] for row in rows)
+            page["metadatas"].extend(shard.metadatas[row] for row in rows)
+            limit -= len(rows)
+            offset = 0
+        return page
+
+    def _count(self) -> int:
+        if self.dimension is None:
+            return 0
+        _, ends = self._walk()
+        return ends[-1] if ends else 0
+
+    async def add_memory(self, user_id: str, text: str, embedding: List[float]) -> MemoryWriteResult:
+        """add a memory of the user, the result is falsy if it was skipped as a near duplicate or failed"""
+        if not embedding:
+            log.warning(f"Skipping adding memory for user {user_id} due to missing embedding.")
+            return MemoryWriteResult(False)
+        if self.dimension_mismatch:
+            return MemoryWriteResult(False)     # reported once at startup
+        try:
+            written, replaced = await self._run(self._write, user_id, [memory_id(user_id, text)], [text], [embedding], [{"user_id": user_id}])
+            log.debug(f"Memory added for user {user_id}: {text[:50]}...")
+            return MemoryWriteResult(bool(written), replaced[0] if replaced else None)
+        except Exception as e:
+            log.error(f"Error adding memory to the NumPy store for user {user_id}: {e}")
+            return MemoryWriteResult(False)
+
+    async def add_memories(
+        self,
+        ids: List[str],
+        documents: List[str],
+        embeddings: List[List[float]],
+        metadatas: List[Dict[str, Any]],
+        chunk_size: Optional[int] = None
+    ) -> List[str]:
+        """add many memories, one append per user, return the ids that failed (chunk_size is not needed here)"""
+        if not (len(ids) == len(documents) == len(embeddings) == len(metadatas)):
+            raise ValueError("ids, documents, embeddings and metadatas must have the same length")
+        by_user: Dict[str, List[int]] = {}
+        for i, metadata in enumerate(metadatas):
+            by_user.setdefault(metadata["user_id"], []).append(i)
+
+        failed_ids = []
+        for user_id, indices in by_user.items():
+            try:
+                await self._run(
+                    self._write,
+                    user_id,
+                    [ids[i] for i in indices],
+                    [documents[i] for i in indices],
+                    [embeddings[i] for i in indices],
+                    [metadatas[i] for i in indices]
+                )
+            except Exception as e:
+                log.error(f"Error adding {len(indices)} memories of user {user_id} to the NumPy store: {e}")
+                failed_ids.extend(ids[i] for i in indices)
+        log.debug(f"Bulk added {len(ids) - len(failed_ids)}/{len(ids)} memories.")
+        return failed_ids
+
+    async def search_memory(self, user_id: str, query_embedding: List[float], n_results: int = 3) -> List[MemorySearchResult]:
+        """exact cosine top-k search over the user's memories"""
+        if not query_embedding:
+            log.warning(f"Skipping memory search for user {user_id} due to missing query embedding.")
+            return []
+        if self.dimension_mismatch:
+            return []       # reported once at startup
+        try:
+            return await self._run(self._search, user_id, query_embedding, n_results)
+        except Exception as e:
+            log.error(f"Error searching memory in the NumPy store for user {user_id}: {e}")
+            return []
+
+    async def get_page(self, offset: int, limit: int) -> Dict[str, List[Any]]:
+        """get a page of stored memories (ids, documents and metadatas), users in directory order"""
+        return await self._run(self._get_page, offset, limit)
+
+    async def count(self) -> int:
+        """get the number of stored memories"""
+        return await self._run(self._count)
@@ -0,0 +1,50 @@
+import asyncio
+from types import SimpleNamespace
+
+from src.llm.router import LLMRouter
+
+SERVICE_ERROR = "service error"
+
+class FakeProvider:
+    def __init__(self, name: str, latency: float):
+        self.name = name
+        self.latency = latency
+
+    async def generate_response(self, *args, **kwargs):
+        await asyncio.sleep(self.latency)
+        return f"answer from {self.name}"
+
+    async def close(self):
+        pass
+
+def make_router(providers) -> LLMRouter:
+    config = SimpleNamespace(
+        llm_router={
+            "enable_hedging": True,
+            "hedge_min_delay_seconds": 0.02,
+            "latency_window": 10,
+            "min_samples": 3,
+            "unhealthy_error_rate": 0.5
+        },
+        service_error=SERVICE_ERROR,
+        unknown_response_error="unknown response"
+    )
+    return LLMRouter(providers, config)
+
+def test_provider_losing_every_hedge_is_demoted():
+    # A was fast in the past but has become slow, B is fast: A keeps losing the hedge to B
+    router = make_router({"A": FakeProvider("A", 0.2), "B": FakeProvider("B", 0.005)})
+    for _ in range(5):
+        router._stats["response"]["A"].record(0.005, True)
+    assert router._ranked("response")[0] == "A"
+
+    async def run():
+        answers = []
+        for _ in range(10):
+            answers.append(await router.generate_response("system", [], "hello"))
+        return answers
+
+    answers = asyncio.run(run())
+    assert all(answer == "answer from B" for answer in answers)
+    assert router._ranked("response")[0] == "B"
+    assert router._stats["response"]["A"].percentile(0.5) > router._stats["response"]["B"].percentile(0.5)